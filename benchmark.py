@@ -0,0 +1,17 @@
+import bpy
+import importlib, sys, os, logging
+
+# benchmark.py is run on a reference city, e.g. a copy of current_city.blend, which may lie outside of the repository
+blend_file_dir = os.path.dirname(os.path.abspath(__file__))
+if blend_file_dir not in sys.path:
+    sys.path.append(blend_file_dir)
+
+import scripts.render_benchmark as render_benchmark
+importlib.reload(render_benchmark)
+
+if __name__ == "__main__":
+    args = render_benchmark.parse_args()
+    logging.basicConfig(filename=os.path.join(blend_file_dir, "data", "runs.log"), filemode='a', level=logging.INFO)
+    render_benchmark.run_benchmark(bpy.data.filepath, args.profiles, args.frames,
+                                   output_dir=os.path.join(blend_file_dir, "benchmark"),
+                                   benchmark_file=os.path.join(blend_file_dir, "benchmark", "benchmark.jsonl"))
@@ -0,0 +1,19 @@
+import bpy
+import importlib, sys, os, logging
+
+# render_shard.py is run on current_city.blend of a run, which may lie in the working directory of a worker
+blend_file_dir = os.path.dirname(os.path.abspath(__file__))
+if blend_file_dir not in sys.path:
+    sys.path.append(blend_file_dir)
+
+import scripts.shard_rendering as shard_rendering
+import scripts.gt_rendering as gt_rendering
+importlib.reload(shard_rendering)
+importlib.reload(gt_rendering)
+
+if __name__ == "__main__":
+    # started by shard_rendering.render_shards, its output is written to shard<i>.log in current_run
+    args = shard_rendering.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    gt_rendering.render_shard(args.current_run_dir, args.data_dir, args.frames, args.stage, args.shard,
+                              args.render_profile)
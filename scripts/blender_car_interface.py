@@ -2,6 +2,9 @@ import bpy
 import re, math, json, os
 """Interface to blender for car handling"""
 
+# resolution of rendered images, passed on with camera.json to frame_prefilter.get_frustum
+image_size = (2048, 1024)
+
 
 # generalized blender-handler
 def clear_cameras():
@@ -40,6 +43,73 @@ def add_curve(objname, curvename, vectors, start_point, end_point,weights, frame
     return object_data
 
 
+class CarModelRegistry:
+    """Loads each car model once into a hidden collection excluded from the view layer and spawns linked duplicates of
+    it, that share mesh data and only differ in their objects, so that each car keeps its own name, transform,
+    constraints and inst_id.
+
+    Attributes
+    ----------
+    car_models_info :   list of dict
+        Each dict contains "file path" to .blend file of model, "main object name" of top parent and "scaling factor".
+    collections :   dict
+        Maps index of model in car_models_info to hidden collection with its loaded objects.
+
+    Methods
+    -------
+    load(model_index)
+        Loads model into hidden collection, if not yet loaded.
+    spawn(model_index)
+        Links duplicate of model to scene and returns its main object.
+    report()
+        Returns number of spawned car objects and of distinct mesh data they use.
+    """
+    def __init__(self, car_models_info):
+        self.car_models_info = car_models_info
+        self.collections = {}
+        self.spawned_objects = []
+
+    def load(self, model_index):
+        """Loads model into hidden collection, if not yet loaded."""
+        if model_index in self.collections:
+            return self.collections[model_index]
+        with bpy.data.libraries.load(self.car_models_info[model_index]['file path']) as (data_from, data_to):
+            data_to.objects = [name for name in data_from.objects]
+        collection = bpy.data.collections.new("CarModel" + str(model_index))
+        collection.hide_viewport = True
+        collection.hide_render = True
+        for obj in data_to.objects:
+            if obj is not None:
+                collection.objects.link(obj)
+        # linked to scene, so that the model is saved with current_city.blend and not dropped as orphan, but excluded
+        # from the view layer, so that it is neither evaluated nor rendered
+        bpy.context.scene.collection.children.link(collection)
+        bpy.context.view_layer.layer_collection.children[collection.name].exclude = True
+        self.collections[model_index] = collection
+        return collection
+
+    def spawn(self, model_index):
+        """Links duplicate of model to scene, sharing data of the loaded objects, and returns its main object."""
+        info = self.car_models_info[model_index]
+        duplicates = {obj: obj.copy() for obj in self.load(model_index).objects}
+        main_object = None
+        scene = bpy.context.scene
+        for obj, duplicate in duplicates.items():
+            scene.collection.objects.link(duplicate)
+            if obj.parent in duplicates:
+                duplicate.parent = duplicates[obj.parent]
+            if re.match(r"^" + info['main object name'] + r"(\.\d{3})?$", obj.name):
+                main_object = duplicate
+        main_object.scale = tuple([info['scaling factor'] for _ in range(3)])
+        self.spawned_objects.extend(duplicates.values())
+        return main_object
+
+    def report(self):
+        """Returns number of spawned car objects and of distinct mesh data they use."""
+        meshes = {obj.data.name for obj in self.spawned_objects if obj.data is not None}
+        return len(self.spawned_objects), len(meshes)
+
+
 def append_car(filepath, main_name):
     with bpy.data.libraries.load(filepath) as (data_from, data_to):
         data_to.objects = [name for name in data_from.objects if 'Car' in name or 'Truck' in name]
@@ -66,8 +136,7 @@ def set_camera_to_calibration_matrix(cam, data_dir):
     v_0 = camera_data["intrinsic"]["v0"]
     f_x = camera_data["intrinsic"]["fx"]
     f_y = camera_data["intrinsic"]["fy"]
-    w = 2048
-    h = 1024
+    (w, h) = image_size
 
     scene = bpy.context.scene
     sensor_width_in_mm = cam.sensor_width
@@ -115,6 +184,19 @@ def add_constraint(object_to_be_bound, curve):
     bpy.ops.constraint.followpath_path_animate(override, constraint='Follow Path')
 
 
+def set_timing_profile(curve, node_frames, frames_per_node):
+    """Replaces linear animation of curve by keyframes, so that the object following it enters node i of its path at
+    node_frames[i]."""
+    curve_data = curve.data
+    curve_data.animation_data_clear()
+    for i, frame in enumerate(node_frames):
+        curve_data.eval_time = i * frames_per_node
+        curve_data.keyframe_insert(data_path="eval_time", frame=frame)
+    for fcurve in curve_data.animation_data.action.fcurves:
+        for keyframe_point in fcurve.keyframe_points:
+            keyframe_point.interpolation = 'LINEAR'
+
+
 def set_camera_car(car):
     """Rename camera carrying car for labeling later."""
     children = car.main_object.children
@@ -124,11 +206,14 @@ def set_camera_car(car):
     car.main_object_name = car.main_object.name
 
 
-def animate_car(vector_list, start_point, end_point, weights, curve_name, car, data_dir, with_camera=False):
+def animate_car(vector_list, start_point, end_point, weights, curve_name, car, data_dir, with_camera=False,
+                model_registry=None):
     """Creates Curve through given weighted vectors and animates car following the curve. """
-    car.append()
+    car.append(model_registry)
     car.curve = add_curve(curve_name + "Object", curve_name, vector_list, start_point, end_point, weights, car.frames_per_node)
     add_constraint(car.main_object, car.curve)
+    if car.node_frames is not None:
+        set_timing_profile(car.curve, car.node_frames, car.frames_per_node)
     if with_camera:
         car.camera = add_camera(car.main_object_name + "Camera", car.camera_pos, data_dir)
         bpy.data.scenes['Scene'].camera = car.camera
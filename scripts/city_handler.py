@@ -1,5 +1,9 @@
 import bpy
-import os, pickle, time, logging
+import os, re, time, logging, importlib, json, hashlib
+from . import grid_interface, profiling, run_checkpoint
+importlib.reload(grid_interface)
+importlib.reload(profiling)
+importlib.reload(run_checkpoint)
 """Script to create a random grid-city with corresponding blender-nodetree."""
 
 # Road and building models to be implemented in City
@@ -85,7 +89,7 @@ def create_grid(nodetree, data_dir, grid_size=(10, 10), cell_size=10):  # ToDo-m
 
     # save grid for later access
     grid = map_creation_node.get_grid()  # type: Grid
-    pickle.dump(grid.data, open(os.path.join(data_dir, 'grid.pkl'), 'wb'))
+    grid_interface.save_grid_data(grid.data, data_dir)
     logging.info(f'grid_size: {grid_size}, cell_size: {cell_size}')
     return map_creation_node
 
@@ -186,28 +190,137 @@ def clear_scene():
     bpy.ops.object.delete(use_global=False)
 
 
-def create_city(grid_size, road_bl_objects, buildings_bl_objects, data_dir, HDRI_base_dir, sky_HDRI) :
-    """Follows steps on https://sites.google.com/view/scenecity16doc/grid-cities to create city."""
-    logging.info('Start create_city')
-    start_time = time.time()
-    # deleting all objects
-    clear_scene()
-    link_assets()
-    remove_collection(["SceneCity low-poly assets"])
+@profiling.hook
+def create_city_layout(grid_size, data_dir, link=True):
+    """Creates SceneCity node tree and grid layout only, saving it in data_dir. Cheap compared to build_city, so that
+    cars can be planned on the layout before roads and buildings are instanced. With link False, the assets linked by a
+    previous call are kept and only its node tree and "City" collection are replaced by a new layout."""
+    logging.info('Start create_city_layout')
+    if link:
+        # deleting all objects
+        clear_scene()
+        link_assets()
+        remove_collection(["SceneCity low-poly assets"])
+    else:
+        remove_collection(["City"])
+        for node_tree in [tree for tree in bpy.data.node_groups if tree.bl_idname == "NodeTree_SceneCity"]:
+            bpy.data.node_groups.remove(node_tree)
     create_collection("City")
     # change context and create node tree
     # bpy.context.area.ui_type = "NodeTree_SceneCity"
     bpy.ops.node.new_node_tree(type="NodeTree_SceneCity")
     nodetree = bpy.data.node_groups["NodeTree"]
     final_grid_node = create_grid(nodetree, data_dir, grid_size=grid_size)
+    return nodetree, final_grid_node
+
+
+def get_mesh_report(objects):
+    """Returns number of mesh objects and of unique mesh data among objects."""
+    mesh_objects = [obj for obj in objects if obj.type == 'MESH']
+    return len(mesh_objects), len({obj.data.name for obj in mesh_objects})
+
+
+def get_instanced_objects():
+    """Returns objects instanced into the scene by SceneCity, i.e. local objects outside the linked asset collection
+    "Collection" of link_assets."""
+    assets = bpy.data.collections.get("Collection")
+    asset_pointers = {obj.as_pointer() for obj in assets.all_objects} if assets else set()
+    return [obj for obj in bpy.context.scene.objects
+            if obj.library is None and obj.as_pointer() not in asset_pointers]
+
+
+def share_mesh_data(objects):
+    """Links local mesh objects with copies of the same asset geometry to one shared mesh and removes the replaced
+    copies, once unused. Objects keep their names, transforms and therefore their inst_id, unlike collection instances.
+    Linked objects and meshes, e.g. SceneCity assets, are left untouched. Returns number of removed meshes."""
+    shared_meshes = {}
+    replaced_meshes = {}
+    for obj in objects:
+        if obj.type != 'MESH' or obj.library is not None or obj.data.library is not None:
+            continue
+        mesh = obj.data
+        # copies of asset meshes differ in numeric suffix only
+        signature = (re.sub(r"\.\d{3}$", "", mesh.name), len(mesh.vertices), len(mesh.edges), len(mesh.polygons),
+                     tuple(material.name if material else "" for material in mesh.materials))
+        shared_mesh = shared_meshes.setdefault(signature, mesh)
+        if shared_mesh != mesh:
+            obj.data = shared_mesh
+            replaced_meshes[mesh.name] = mesh
+    removed_meshes = [mesh for mesh in replaced_meshes.values() if mesh.users == 0]
+    for mesh in removed_meshes:
+        bpy.data.meshes.remove(mesh)
+    return len(removed_meshes)
+
+
+@profiling.hook
+def build_city(nodetree, final_grid_node, road_bl_objects, buildings_bl_objects, HDRI_base_dir, sky_HDRI,
+               share_meshes=True):
+    """Instances roads and buildings on layout of create_city_layout and adds sky. If share_meshes, instanced objects
+    of the same asset share one mesh, reducing memory and BVH build time of large cities."""
     # Define list of blender objects of roads tupled with their function (STRAIGHT, T_CROSSING, X_CROSSING)
     add_roads(nodetree, final_grid_node, road_bl_objects)
     add_buildings(nodetree, final_grid_node, buildings_bl_objects)
+    number_objects, number_meshes = get_mesh_report(get_instanced_objects())
+    logging.info(f'city consists of {number_objects} mesh objects with {number_meshes} unique meshes')
+    if share_meshes:
+        number_removed = share_mesh_data(get_instanced_objects())
+        number_objects, number_meshes = get_mesh_report(get_instanced_objects())
+        logging.info(f'shared meshes, {number_objects} mesh objects with {number_meshes} unique meshes, '
+                     f'removed {number_removed} copies')
     add_sky_texture(HDRI_base_dir, sky_HDRI)
     # bpy.context.area.ui_type = "TEXT_EDITOR"
+
+
+@profiling.hook
+def create_city(grid_size, road_bl_objects, buildings_bl_objects, data_dir, HDRI_base_dir, sky_HDRI, share_meshes=True):
+    """Follows steps on https://sites.google.com/view/scenecity16doc/grid-cities to create city."""
+    logging.info('Start create_city')
+    start_time = time.time()
+    nodetree, final_grid_node = create_city_layout(grid_size, data_dir)
+    build_city(nodetree, final_grid_node, road_bl_objects, buildings_bl_objects, HDRI_base_dir, sky_HDRI, share_meshes)
     logging.info(f'Created GridCity - execution Time: {time.time() - start_time} s')
     print(f'Created GridCity\nExecution Time: {time.time() - start_time} s')
 
 
+# city cache
+def get_city_key(grid_size, road_bl_objects, buildings_bl_objects, sky_HDRI, city_seed):
+    """Returns key of cached city built with given parameters. city_seed distinguishes several cities per parameters."""
+    city_parameters = json.dumps([list(grid_size), road_bl_objects, buildings_bl_objects, sky_HDRI, city_seed])
+    return hashlib.sha1(city_parameters.encode()).hexdigest()
+
+
+def store_city(city_cache_dir, city_key, data_dir):
+    """Saves copy of current scene as city.blend together with its grid in city_cache_dir under city_key, see
+    run_checkpoint.atomic_write."""
+    city_dir = os.path.join(city_cache_dir, city_key)
+    try:
+        with run_checkpoint.atomic_write(city_dir) as tmp_dir:
+            os.makedirs(tmp_dir)
+            grid_interface.copy_grid(data_dir, tmp_dir)
+            bpy.ops.wm.save_as_mainfile(filepath=os.path.join(tmp_dir, "city.blend"), copy=True)
+    except OSError:
+        if not os.path.isdir(city_dir):
+            raise
+        # city was stored by another worker in the meantime
+        return
+    logging.info(f'stored city under {city_dir}')
+
+
+def load_cached_city(city_cache_dir, city_key, data_dir):
+    """Opens city.blend cached under city_key and copies its grid to data_dir. Returns False if there is none.
+
+    The cached city replaces the open file instead of being linked or appended into it: it is the whole scene of a run,
+    i.e. instanced roads and buildings, node tree, sky and render settings, and every job starts from a fresh file
+    anyway. Appending would copy all its data-blocks once more, linked objects could not be edited by later steps, e.g.
+    adding cars."""
+    city_dir = os.path.join(city_cache_dir, city_key)
+    city_file = os.path.join(city_dir, "city.blend")
+    if not os.path.isfile(city_file):
+        return False
+    grid_interface.copy_grid(city_dir, data_dir)
+    bpy.ops.wm.open_mainfile(filepath=city_file)
+    return True
+
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,162 @@
+import importlib
+import numpy as np
+from . import path_interface
+importlib.reload(path_interface)
+"""Collision avoidance of planned cars, following the priority rules in no_collision_while_driving."""
+
+
+class OccupancyIndex:
+    """Space-time occupancy of the cars accepted so far, filled as each car is accepted after avoid_collisions.
+
+    Attributes
+    ----------
+    occupancy   :   dict
+        Maps (grid coord, frame) to list of tuples (car, node index) of cars in that cell during that frame.
+    last_frame  :   dict
+        Maps grid coord to last frame any accepted car is in that cell.
+    parked_from :   dict
+        Maps grid coord to first frame from which an accepted car stands in that cell at the end of its path.
+
+    Methods
+    -------
+    add(car)
+        Adds car with its current path to index.
+    get_conflicts(car)
+        Returns per node of car, whether it conflicts with accepted cars, in one pass over its path.
+    collision(car)
+        True if car collides with any accepted car.
+    get_valid_length(car)
+        Returns number of nodes car's path is truncated to in order to avoid collisions.
+    """
+    def __init__(self):
+        self.occupancy = {}
+        self.last_frame = {}
+        self.parked_from = {}
+
+    def add(self, car):
+        """Adds car with its current path to index."""
+        for i, coord in enumerate(car.grid_path_coordinates):
+            frames = car.get_frames_for_pos(i)
+            for frame in frames:
+                self.occupancy.setdefault((coord, frame), []).append((car, i))
+            self.last_frame[coord] = max(self.last_frame.get(coord, frames[-1]), frames[-1])
+        stop_point = car.grid_path_coordinates[-1]
+        stop_frame = car.get_node_frames()[-2]
+        self.parked_from[stop_point] = min(self.parked_from.get(stop_point, stop_frame), stop_frame)
+
+    def get_conflicts(self, car):
+        """Returns two boolean arrays over the nodes of car, evaluated for every truncation of its path at once.
+
+        Returns
+        -------
+        np.ndarray
+            True for nodes at which car collides with an accepted car however its path is truncated: it drives through
+            a standing car, meets a car at the end of its path or their movements do not comply.
+        np.ndarray
+            True for nodes at which car collides if its path ends there: it stops in the path of a car that has not
+            passed yet or shares the cell with any car.
+        """
+        number_nodes = len(car.nodes)
+        always = np.zeros(number_nodes, dtype=bool)
+        at_end = np.zeros(number_nodes, dtype=bool)
+        for i, coord in enumerate(car.grid_path_coordinates):
+            frames = car.get_frames_for_pos(i)
+            # drives through car standing at coord
+            if coord in self.parked_from and frames[-1] >= self.parked_from[coord]:
+                always[i] = True
+            # stops in path of car that passes coord later
+            if self.last_frame.get(coord, -1) >= frames[0]:
+                at_end[i] = True
+            # first shared frame per accepted car
+            checked_cars = set()
+            for frame in frames:
+                for prev_car, prev_pos in self.occupancy.get((coord, frame), []):
+                    if id(prev_car) in checked_cars:
+                        continue
+                    checked_cars.add(id(prev_car))
+                    if frame == 0:
+                        # shared frame 0 was never considered a collision
+                        continue
+                    at_end[i] = True
+                    # cars at end of path collide, else check if movements comply
+                    if prev_pos + 2 > len(prev_car.nodes) or \
+                            (i + 2 <= number_nodes and not no_collision_while_driving(prev_car, prev_pos, car, i)):
+                        always[i] = True
+        return always, at_end
+
+    def collision(self, car):
+        """True if car collides with any accepted car."""
+        always, at_end = self.get_conflicts(car)
+        return always.any() or at_end[-1]
+
+    def get_valid_length(self, car):
+        """Returns largest number of nodes, for which the truncated path of car does not collide, 1 if there is none."""
+        always, at_end = self.get_conflicts(car)
+        # truncation to n nodes is valid if none of the n nodes always collides and its last node may end the path
+        valid = ~np.logical_or.accumulate(always) & ~at_end
+        valid[0] = True
+        return int(np.nonzero(valid)[0][-1]) + 1
+
+
+def avoid_collisions(car, occupancy_index):
+    """If main_car collides (same grid-cell) with any implemented cars, its path is truncated before first collision.
+    The path is cut once at the length given by occupancy_index and validated once afterwards."""
+    #logging.info(f'Avoid collisions for {car.main_object_name} with path {car.grid_path_coordinates}')
+    valid_length = occupancy_index.get_valid_length(car)
+    if valid_length == len(car.nodes):
+        return
+    car.truncate(valid_length)
+    #logging.info('truncated')
+    if valid_length > 1 and occupancy_index.collision(car):
+        raise RuntimeError(f"Truncated path of {car.main_object_name} still collides.")
+
+
+def no_collision_while_driving(car, car_pos_at_frame, main_car, main_car_pos_at_frame):
+    """True if directions of car and main_car do not comply. Car always has priority.
+
+    Parameters
+    ----------
+    car    :    PlannedCar
+        Previously implemented car.
+    car_pos_at_frame:
+        Index of node of possible encounter for car.
+    main_car    :    PlannedCar
+        Car whose path might get truncated.
+    main_car_pos_at_frame:
+        Index of node of possible encounter for main_car.
+
+    Returns
+    -------
+    bool
+        True if directions do not comply.
+    """
+    #logging.info(f'start no collision')
+    car_movement = car.predict_movement_at_pos(car_pos_at_frame)
+    main_car_movement = main_car.predict_movement_at_pos(main_car_pos_at_frame)
+    car_momentum_after_pos = car.nodes.momenta[car_pos_at_frame + 1]
+    main_car_momentum_after_pos = main_car.nodes.momenta[main_car_pos_at_frame + 1]
+    car_momentum_at_pos = car.nodes.momenta[car_pos_at_frame]
+    #logging.info(f'{car.main_object_name} is going {car_movement}')
+    #logging.info(f'{main_car.main_object_name} is going {main_car_movement}')
+    if path_interface.momenta_parallel(main_car_momentum_after_pos, car_momentum_after_pos):
+        # both cars end up in same street
+        #logging.info('both cars end up in same street')
+        return False
+    if car_movement == "right":
+        #logging.info('car_movement == "right"')
+        return True
+    if (car_movement == "left" or car_movement == "straight") and main_car_movement == "right" and \
+            path_interface.momenta_anti_parallel(car_momentum_at_pos, main_car_momentum_after_pos):
+        # main_car takes right turn into street car comes from
+        #logging.info("main_car takes right turn into street car comes from")
+        return True
+    if path_interface.momenta_anti_parallel(car_momentum_after_pos, main_car_momentum_after_pos) and \
+            main_car_movement == "straight" and car_movement == "straight":
+        # both cars pass each other
+        #logging.info("both cars pass each other")
+        return True
+    return False
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,154 @@
+import os, re, sys, json, sqlite3
+from datetime import datetime
+"""SQLite manifest of the data set in CityScapes-format, that allocates sequence numbers and indexes stored samples."""
+
+manifest_file = "manifest.sqlite"
+splits = ["train", "test", "val"]
+
+# file names in CityScapes-format, e.g. scenecity_000012_000034_gtFine_color.png
+file_name_pattern = re.compile(r"^scenecity_(\d+)_(\d+)_(.+)$")
+
+schema = """
+CREATE TABLE IF NOT EXISTS sequences (
+    sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT,
+    parameters TEXT,
+    number_frames INTEGER,
+    duration REAL);
+CREATE TABLE IF NOT EXISTS samples (
+    sequence INTEGER,
+    frame INTEGER,
+    split TEXT,
+    created TEXT,
+    PRIMARY KEY (sequence, frame));
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    sequence INTEGER,
+    frame INTEGER,
+    category TEXT,
+    size INTEGER);
+CREATE INDEX IF NOT EXISTS samples_split ON samples (split);
+CREATE INDEX IF NOT EXISTS files_sample ON files (sequence, frame);
+"""
+
+
+class DatasetManifest:
+    """Manifest in city_scapes_dir recording every stored sample with its split, files, sizes and the parameters and
+    timing of its run. Sequence numbers are allocated in a transaction, so that concurrent workers never share one.
+
+    Attributes
+    ----------
+    city_scapes_dir :   str
+        Path of CityScapes-format directory, paths of files are stored relative to it.
+    connection  :   sqlite3.Connection
+        Connection to manifest.sqlite in city_scapes_dir in autocommit mode.
+
+    Methods
+    -------
+    allocate_sequence(parameters=None)
+        Returns new sequence number, higher than all numbers stored so far.
+    add_sample(sequence, frame, split, files)
+        Records stored sample with its files.
+    finish_sequence(sequence, number_frames, duration)
+        Records number of stored frames and duration in s of the run of sequence.
+    count(split=None)
+        Returns number of samples, optionally only of split.
+    get_samples(split=None, sequence=None)
+        Returns list of tuples (sequence, frame, split) of samples.
+    """
+    def __init__(self, city_scapes_dir):
+        self.city_scapes_dir = city_scapes_dir
+        os.makedirs(city_scapes_dir, exist_ok=True)
+        path = os.path.join(city_scapes_dir, manifest_file)
+        is_new = not os.path.isfile(path)
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.executescript(schema)
+        if is_new:
+            self.index_directory()
+
+    def allocate_sequence(self, parameters=None):
+        """Returns new sequence number, higher than all numbers stored so far, and records parameters of its run."""
+        cursor = self.connection.execute("INSERT INTO sequences (created, parameters) VALUES (?, ?)",
+                                         (datetime.now().isoformat(), json.dumps(parameters)))
+        return cursor.lastrowid
+
+    def add_sample(self, sequence, frame, split, files):
+        """Records sample stored in split with files, mapping category to path of file in city_scapes_dir."""
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?)",
+                                    (sequence, frame, split, datetime.now().isoformat()))
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                                        [(os.path.relpath(path, self.city_scapes_dir), sequence, frame, category,
+                                          os.path.getsize(path)) for category, path in files.items()])
+
+    def finish_sequence(self, sequence, number_frames, duration):
+        self.connection.execute("UPDATE sequences SET number_frames = ?, duration = ? WHERE sequence = ?",
+                                (number_frames, duration, sequence))
+
+    def count(self, split=None):
+        """Returns number of samples, optionally only of split."""
+        if split is None:
+            return self.connection.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+        return self.connection.execute("SELECT COUNT(*) FROM samples WHERE split = ?", (split,)).fetchone()[0]
+
+    def get_samples(self, split=None, sequence=None):
+        """Returns list of tuples (sequence, frame, split) of samples, optionally only of split and sequence."""
+        conditions, values = [], []
+        for column, value in (("split", split), ("sequence", sequence)):
+            if value is not None:
+                conditions.append(column + " = ?")
+                values.append(value)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return self.connection.execute("SELECT sequence, frame, split FROM samples" + where +
+                                       " ORDER BY sequence, frame", values).fetchall()
+
+    def get_files(self, sequence, frame):
+        """Returns dict mapping category to path of file of sample relative to city_scapes_dir."""
+        return dict(self.connection.execute("SELECT category, path FROM files WHERE sequence = ? AND frame = ?",
+                                            (sequence, frame)).fetchall())
+
+    def get_summary(self):
+        """Returns dict with number of sequences, samples per split and total size of files in bytes."""
+        summary = {'sequences': self.connection.execute("SELECT COUNT(*) FROM sequences").fetchone()[0]}
+        summary.update({split: self.count(split) for split in splits})
+        summary['bytes'] = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+        return summary
+
+    def index_directory(self):
+        """Records samples already stored in city_scapes_dir, e.g. by earlier versions without manifest. Scans the
+        directory once, when the manifest is created."""
+        samples, files = {}, []
+        for category in sorted(os.listdir(self.city_scapes_dir)):
+            for split in splits:
+                split_dir = os.path.join(self.city_scapes_dir, category, split, "scenecity")
+                if not os.path.isdir(split_dir):
+                    continue
+                for file_name in os.listdir(split_dir):
+                    match = file_name_pattern.match(file_name)
+                    if match is None:
+                        continue
+                    sequence, frame = int(match.group(1)), int(match.group(2))
+                    samples[(sequence, frame)] = split
+                    path = os.path.join(split_dir, file_name)
+                    files.append((os.path.relpath(path, self.city_scapes_dir), sequence, frame,
+                                  match.group(3).split('.')[0], os.path.getsize(path)))
+        if not samples:
+            return
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("INSERT OR IGNORE INTO sequences (sequence) VALUES (?)",
+                                        [(sequence,) for sequence in {sequence for sequence, _ in samples}])
+            self.connection.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, NULL)",
+                                        [(sequence, frame, split) for (sequence, frame), split in samples.items()])
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", files)
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    # prints summary of manifest in given CityScapes-format directory, e.g. ground_truth/CityScapes_format
+    manifest = DatasetManifest(sys.argv[1])
+    print(json.dumps(manifest.get_summary(), indent=4))
+    manifest.close()
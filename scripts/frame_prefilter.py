@@ -0,0 +1,181 @@
+import importlib, math, logging
+import numpy as np
+from . import grid_interface
+importlib.reload(grid_interface)
+"""Blender-free geometric pre-filter, that rejects rendering frames before any GT is rendered, whose rendered GT would
+be rejected by filtering.get_allowed_frames anyway. Cars are approximated by the polyline through their nodes and
+buildings by the district cells of the grid, so that frames are only rejected if they are clearly hopeless."""
+
+# angle in rad, by which the frustum is widened for cars and narrowed for the city edge, covering the deviation of the
+# animated NURBS curves from the polylines and of the heading in turns
+angle_margin = math.radians(5)
+
+# half extent of a car in cells, its corners are tested additionally to its centre
+car_extent = 0.2
+
+# step in cells of sampled lines of sight and number of rays cast to find the city edge
+sight_step = 0.1
+number_rays = 32
+
+
+def get_occluder_mask(grid):
+    """Returns boolean (nxm)-matrix, True for district cells, whose buildings block the view."""
+    if isinstance(grid.data, grid_interface.CompactGridData):
+        return grid.data.get_mask('district')
+    grid_data = np.asarray(grid.data)
+    occluder_mask = np.zeros(grid_data.shape, dtype=bool)
+    for (i, j), grid_dict in np.ndenumerate(grid_data):
+        occluder_mask[i, j] = 'district' in grid_dict
+    return occluder_mask
+
+
+def get_frustum(camera_data, camera_height):
+    """Returns horizontal angles of frustum to the left and right of the viewing direction in rad and the minimal
+    distance of ground visible below the horizontal camera in blender units."""
+    (w, h) = camera_data['image_size']
+    intrinsic = camera_data['intrinsic']
+    left_angle = math.atan(intrinsic['u0'] / intrinsic['fx'])
+    right_angle = math.atan((w - intrinsic['u0']) / intrinsic['fx'])
+    min_ground_distance = camera_height * intrinsic['fy'] / (h - intrinsic['v0'])
+    return left_angle, right_angle, min_ground_distance
+
+
+def get_polyline(car, grid):
+    """Returns (L+2)x2-matrix of blender xy-coordinates of the curve points of car, from the point before its first to
+    the point after its last node, as created by car_handler.add_cars_to_city."""
+    start_point, end_point = grid_interface.get_start_end_point(car, grid)
+    points = [start_point] + grid_interface.get_blender_street_coords(car.nodes, grid) + [end_point]
+    return np.array(points)[:, :2]
+
+
+def get_poses(car, grid, frames):
+    """Returns (Fx2)-matrices of positions and unit headings of car in frames. The curve is evaluated at the keyframed
+    eval_time of blender_car_interface.set_timing_profile, linearly along the polyline of its points."""
+    polyline = get_polyline(car, grid)
+    number_nodes = len(car.nodes)
+    node_frames = car.get_node_frames()
+    curve_fraction = np.interp(frames, node_frames, np.arange(number_nodes + 1) / number_nodes)
+    point_index = curve_fraction * (len(polyline) - 1)
+    segment = np.minimum(point_index.astype(int), len(polyline) - 2)
+    fraction = (point_index - segment)[:, None]
+    directions = polyline[segment + 1] - polyline[segment]
+    positions = polyline[segment] + fraction * directions
+    headings = directions / np.maximum(np.linalg.norm(directions, axis=1, keepdims=True), 1e-9)
+    return positions, headings
+
+
+def get_cells(grid, points):
+    """Returns integer grid coordinates of the cells containing blender xy-points and True per point inside the grid."""
+    cells = np.round(points / grid.cell_size + np.array(grid.grid_size) / 2).astype(int)
+    inside = np.all((cells >= 0) & (cells < np.array(grid.grid_size)), axis=-1)
+    return cells, inside
+
+
+def is_sight_blocked(grid, occluder_mask, origin, targets):
+    """Returns True per target if the line of sight from origin passes a district cell."""
+    distances = np.linalg.norm(targets - origin, axis=1)
+    number_steps = max(int(distances.max() / (sight_step * grid.cell_size)), 1)
+    samples = origin + np.linspace(0, 1, number_steps + 1)[None, :, None] * (targets - origin)[:, None, :]
+    cells, inside = get_cells(grid, samples)
+    cells = np.where(inside[..., None], cells, 0)
+    return np.any(inside & occluder_mask[cells[..., 0], cells[..., 1]], axis=1)
+
+
+def passes_car(position, ray_direction, distance, car_positions, radius):
+    """True if the ray from position passes within radius of any car before distance."""
+    relative = car_positions - position
+    along = relative @ ray_direction
+    across = np.abs(ray_direction[0] * relative[:, 1] - ray_direction[1] * relative[:, 0])
+    return bool(np.any((along > -radius) & (along < distance + radius) & (across < radius)))
+
+
+def frame_shows_edge(grid, occluder_mask, position, heading, frustum, car_positions):
+    """True if a ray in the narrowed frustum leaves the grid through a road cell without passing a district cell or a
+    car, which may hide the road behind it, so that the sky meets the road, at a distance where the ground is in
+    view."""
+    left_angle, right_angle, min_ground_distance = frustum
+    angles = np.linspace(-right_angle + angle_margin, left_angle - angle_margin, number_rays)
+    ray_directions = np.stack([heading[0] * np.cos(angles) - heading[1] * np.sin(angles),
+                               heading[0] * np.sin(angles) + heading[1] * np.cos(angles)], axis=1)
+    max_distance = math.hypot(*grid.grid_size) * grid.cell_size
+    steps = np.arange(1, int(max_distance / (sight_step * grid.cell_size)) + 2) * sight_step * grid.cell_size
+    samples = position + steps[None, :, None] * ray_directions[:, None, :]
+    cells, inside = get_cells(grid, samples)
+    clipped = np.where(inside[..., None], cells, 0)
+    blocked = inside & occluder_mask[clipped[..., 0], clipped[..., 1]]
+    on_road = inside & grid.road_mask[clipped[..., 0], clipped[..., 1]]
+    for ray in range(number_rays):
+        outside = np.nonzero(~inside[ray])[0]
+        if not len(outside) or outside[0] == 0:
+            continue
+        exit_step = outside[0]
+        if blocked[ray, :exit_step].any() or not on_road[ray, exit_step - 1]:
+            continue
+        if steps[exit_step] < min_ground_distance:
+            continue
+        # cars within the radius of their corners hide the ground behind them
+        if not passes_car(position, ray_directions[ray], steps[exit_step], car_positions,
+                          math.sqrt(2) * car_extent * grid.cell_size):
+            return True
+    return False
+
+
+def frame_shows_car(grid, occluder_mask, position, heading, frustum, car_positions):
+    """True if a corner or the centre of any car lies in the widened frustum with a free line of sight."""
+    if not len(car_positions):
+        return False
+    left_angle, right_angle, _ = frustum
+    offsets = np.array([(0, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)]) * car_extent * grid.cell_size
+    targets = (car_positions[:, None, :] + offsets[None, :, :]).reshape(-1, 2)
+    relative = targets - position
+    forward = relative @ heading
+    left = heading[0] * relative[:, 1] - heading[1] * relative[:, 0]
+    angles = np.arctan2(left, forward)
+    in_view = (forward > 0) & (angles <= left_angle + angle_margin) & (angles >= -right_angle - angle_margin)
+    if not in_view.any():
+        return False
+    return not is_sight_blocked(grid, occluder_mask, position, targets[in_view]).all()
+
+
+def get_allowed_frames(cars, grid, frames, camera_data, camera_height):
+    """Returns frames, in which the camera on cars[0] neither clearly sees the city edge nor clearly sees no other car.
+
+    Parameters
+    ----------
+    cars    :   list of PlannedCar
+        Planned cars, the first carries the camera.
+    grid    :   Grid
+        Grid the cars were planned on.
+    frames  :   list of int
+        Candidate rendering frames.
+    camera_data :   dict
+        Content of camera.json with the intrinsic parameters of the camera and image_size, the (width, height) of
+        rendered images, see blender_car_interface.image_size.
+    camera_height   :   float
+        Height of the camera above the road in blender units, z of camera_pos of the ego car model.
+
+    Returns
+    -------
+    list of int
+        Frames, that may pass filtering.get_allowed_frames.
+    """
+    if not frames:
+        return []
+    occluder_mask = get_occluder_mask(grid)
+    frustum = get_frustum(camera_data, camera_height)
+    ego_positions, ego_headings = get_poses(cars[0], grid, frames)
+    car_positions = np.stack([get_poses(car, grid, frames)[0] for car in cars[1:]], axis=1) if len(cars) > 1 \
+        else np.zeros((len(frames), 0, 2))
+    allowed_frames = []
+    for i, frame in enumerate(frames):
+        if frame_shows_edge(grid, occluder_mask, ego_positions[i], ego_headings[i], frustum, car_positions[i]):
+            continue
+        if not frame_shows_car(grid, occluder_mask, ego_positions[i], ego_headings[i], frustum, car_positions[i]):
+            continue
+        allowed_frames.append(frame)
+    logging.info(f'pre-filter allowed {len(allowed_frames)} of {len(frames)} frames')
+    return allowed_frames
+
+
+if __name__ == "__main__":
+    pass
@@ -1,16 +1,273 @@
 import numpy as np
-import pickle, os, importlib
+import pickle, os, importlib, json, argparse, shutil
 from . import path_interface
 importlib.reload(path_interface)
-"""Interface to grid stored in /data/grid.pkl . With various coordinate transformations."""
+"""Interface to grid stored in /data/grid or /data/grid.pkl . With various coordinate transformations."""
+
+# directory of compact grid format within data_dir, containing one .npy plane per SceneCity key and key table
+compact_grid_dir = "grid"
+key_table_file = "keys.json"
 
 
 class Grid:
-    """Grid class adapted from SceneCity/nodes/__init__.py"""
-    def __init__(self, data, size, cell_size=1):
+    """Grid class adapted from SceneCity/nodes/__init__.py
+
+    On construction a road index is built once, so that path sampling and border detection query numpy arrays
+    instead of the SceneCity dicts in data.
+
+    Attributes
+    ----------
+    data    :   np.ndarray or CompactGridData
+        (nxm)-matrix with elements being dicts that contain the SceneCity key,value-pairs.
+    grid_size   :   tuple
+        Shape of the grid.
+    cell_size   :   float
+        Size of one cell in blender units.
+    road_mask   :   np.ndarray of bool
+        (nxm)-matrix, True for road cells.
+    road_cells  :   np.ndarray of int32
+        (kx2)-matrix with grid coordinates of all road cells in row-major order.
+    cell_ids    :   np.ndarray of int32
+        (nxm)-matrix with index into road_cells for road cells and -1 elsewhere.
+    adjacency_indptr    :   np.ndarray of int32
+        CSR index pointer, neighbours of road cell i are adjacency_indices[adjacency_indptr[i]:adjacency_indptr[i+1]].
+    adjacency_indices   :   np.ndarray of int32
+        CSR column indices, ids of neighbouring road cells.
+    adjacency_directions    :   np.ndarray of int8
+        Index into path_interface.directions of the step towards the corresponding neighbour in adjacency_indices.
+    neighbour_table :   np.ndarray of int32
+        Dense (kx4)-matrix with id of neighbouring road cell per direction and -1 where there is none.
+    degree  :   np.ndarray of int32
+        Number of neighbouring road cells per road cell.
+    neighbours  :   dict
+        Maps grid coordinate of road cell to list of tuples (neighbour coordinate, direction).
+    border_streets  :   list of tuple
+        Road cells on the city border, ordered as returned by get_border_streets.
+    border_cells    :   set of tuple
+        Set of border_streets for membership tests.
+    border_ids  :   np.ndarray of bool
+        True per road cell id if cell lies on the city border.
+    intersections   :   np.ndarray of int32
+        Ids of road cells with degree 3 (T-crossing) or 4 (X-crossing).
+    border_distance :   np.ndarray of int32
+        BFS distance in steps from each road cell to the nearest border street, path_interface.unreachable_distance
+        if there is none.
+    exit_distance   :   np.ndarray of int32
+        (kx4)-matrix with minimal number of steps to a border street after entering a road cell via the direction
+        with given index, without stepping back to the previous cell. path_interface.unreachable_distance if there is none.
+    long_exit_distances :   dict
+        Maps cap to read-only result of get_long_exit_distance, computed once per cap.
+    """
+    def __init__(self, data, size, cell_size=1, road_mask=None):
         self.data = data
         self.grid_size = size
         self.cell_size = cell_size
+        if road_mask is None:
+            road_mask = data.get_mask('road') if isinstance(data, CompactGridData) else get_road_mask(data)
+        self.road_mask = np.asarray(road_mask, dtype=bool)
+        self.build_road_index()
+        self.build_distance_fields()
+        self.long_exit_distances = {}
+
+    def build_road_index(self):
+        """Builds road cells, CSR adjacency, border and intersection index from road_mask."""
+        (n, m) = self.road_mask.shape
+        self.road_cells = np.argwhere(self.road_mask).astype(np.int32)
+        self.cell_ids = np.full((n, m), -1, dtype=np.int32)
+        self.cell_ids[self.road_mask] = np.arange(len(self.road_cells), dtype=np.int32)
+
+        # neighbour ids per direction, -1 for non-road or off-grid neighbours
+        padded_ids = np.pad(self.cell_ids, 1, mode='constant', constant_values=-1)
+        x, y = self.road_cells[:, 0] + 1, self.road_cells[:, 1] + 1
+        neighbour_ids = np.stack([padded_ids[x + dx, y + dy] for dx, dy in path_interface.directions], axis=1)
+        valid = neighbour_ids >= 0
+        self.neighbour_table = neighbour_ids.astype(np.int32)
+        self.degree = valid.sum(axis=1).astype(np.int32)
+        self.adjacency_indptr = np.zeros(len(self.road_cells) + 1, dtype=np.int32)
+        np.cumsum(self.degree, out=self.adjacency_indptr[1:])
+        self.adjacency_indices = neighbour_ids[valid].astype(np.int32)
+        self.adjacency_directions = np.nonzero(valid)[1].astype(np.int8)
+
+        road_coords = [tuple(coord) for coord in self.road_cells.tolist()]
+        self.neighbours = {coord: [] for coord in road_coords}
+        for cell_id, coord in enumerate(road_coords):
+            for k in range(self.adjacency_indptr[cell_id], self.adjacency_indptr[cell_id + 1]):
+                self.neighbours[coord].append((road_coords[self.adjacency_indices[k]],
+                                               path_interface.directions[self.adjacency_directions[k]]))
+
+        self.border_streets = [(0, j) for j in np.nonzero(self.road_mask[0, :])[0].tolist()]
+        self.border_streets.extend([(i, 0) for i in np.nonzero(self.road_mask[:, 0])[0].tolist()])
+        self.border_streets.extend([(n - 1, j) for j in np.nonzero(self.road_mask[n - 1, :])[0].tolist()])
+        self.border_streets.extend([(i, m - 1) for i in np.nonzero(self.road_mask[:, m - 1])[0].tolist()])
+        self.border_cells = set(self.border_streets)
+        self.border_ids = np.zeros(len(self.road_cells), dtype=bool)
+        if self.border_streets:
+            self.border_ids[self.cell_ids[tuple(np.array(self.border_streets).T)]] = True
+        self.intersections = np.nonzero(self.degree >= 3)[0].astype(np.int32)
+
+    def build_distance_fields(self):
+        """Builds border_distance and exit_distance via BFS from the border streets."""
+        self.border_distance = np.full(len(self.road_cells), path_interface.unreachable_distance, dtype=np.int32)
+        frontier = np.nonzero(self.border_ids)[0]
+        distance = 0
+        while len(frontier):
+            self.border_distance[frontier] = distance
+            neighbour_ids = self.neighbour_table[frontier].ravel()
+            neighbour_ids = neighbour_ids[neighbour_ids >= 0]
+            frontier = np.unique(neighbour_ids[self.border_distance[neighbour_ids] == path_interface.unreachable_distance])
+            distance += 1
+
+        # relax distances of directed states (cell, direction of arrival) until stable
+        opposite = np.array([path_interface.directions.index((-dx, -dy)) for dx, dy in path_interface.directions])
+        allowed = np.arange(4)[None, :] != opposite[:, None]  # allowed[arrival, next] forbids stepping back
+        has_neighbour = self.neighbour_table >= 0
+        self.exit_distance = np.full((len(self.road_cells), 4), path_interface.unreachable_distance, dtype=np.int32)
+        self.exit_distance[self.border_ids] = 0
+        while True:
+            steps = self.exit_distance[self.neighbour_table, np.arange(4)[None, :]] + 1
+            steps[~has_neighbour] = path_interface.unreachable_distance
+            exit_distance = np.where(allowed[None, :, :], steps[:, None, :], path_interface.unreachable_distance).min(axis=2)
+            exit_distance = np.minimum(exit_distance, path_interface.unreachable_distance).astype(np.int32)
+            exit_distance[self.border_ids] = 0
+            if np.array_equal(exit_distance, self.exit_distance):
+                break
+            self.exit_distance = exit_distance
+
+    def get_long_exit_distance(self, cap):
+        """Returns (kx4)-matrix like exit_distance, but with maximal number of steps to a border street, capped at cap.
+        As walks may run in circles, only the cap bounds the distance. -1 if the border is not reachable."""
+        if cap in self.long_exit_distances:
+            return self.long_exit_distances[cap]
+        opposite = np.array([path_interface.directions.index((-dx, -dy)) for dx, dy in path_interface.directions])
+        allowed = np.arange(4)[None, :] != opposite[:, None]
+        has_neighbour = self.neighbour_table >= 0
+        long_exit_distance = np.full((len(self.road_cells), 4), -1, dtype=np.int32)
+        long_exit_distance[self.border_ids] = 0
+        for _ in range(cap):
+            steps = long_exit_distance[self.neighbour_table, np.arange(4)[None, :]]
+            steps = np.where(has_neighbour & (steps >= 0), steps + 1, -1)
+            long_exit_distance = np.where(allowed[None, :, :], steps[:, None, :], -1).max(axis=2)
+            long_exit_distance = np.minimum(long_exit_distance, cap).astype(np.int32)
+            long_exit_distance[self.border_ids] = 0
+        long_exit_distance.flags.writeable = False
+        self.long_exit_distances[cap] = long_exit_distance
+        return long_exit_distance
+
+    def is_road(self, coord):
+        """True if grid coord lies on grid and is a road cell."""
+        return 0 <= coord[0] < self.grid_size[0] and 0 <= coord[1] < self.grid_size[1] and \
+            bool(self.road_mask[coord[0], coord[1]])
+
+    def is_intersection(self, coord):
+        """True if grid coord is a T- or X-crossing."""
+        return self.is_road(coord) and len(self.neighbours[tuple(coord)]) >= 3
+
+
+def get_road_mask(grid_data):
+    """Returns boolean (nxm)-matrix, True where the SceneCity cell dict contains a road."""
+    grid_data = np.asarray(grid_data)
+    road_mask = np.zeros(grid_data.shape, dtype=bool)
+    for (i, j), grid_dict in np.ndenumerate(grid_data):
+        road_mask[i, j] = 'road' in grid_dict
+    return road_mask
+
+
+class CompactGridData:
+    """Columnar grid data with one integer plane per SceneCity key, loaded memory-mapped from data_dir/grid.
+
+    Attributes
+    ----------
+    planes  :   dict
+        Maps SceneCity key to (nxm)-matrix of codes, 0 where the cell has no such key and i where its value is
+        key_values[key][i-1].
+    key_values  :   dict
+        Maps SceneCity key to list of its values.
+    shape   :   tuple
+        Shape of the grid.
+
+    Indexing with (i, j) returns the dict of the cell as in grid.pkl.
+    """
+    def __init__(self, planes, key_values, shape):
+        self.planes = planes
+        self.key_values = key_values
+        self.shape = tuple(shape)
+
+    def __getitem__(self, coord):
+        return {key: self.key_values[key][plane[coord] - 1] for key, plane in self.planes.items() if plane[coord]}
+
+    def get_mask(self, key, value=None):
+        """Returns boolean (nxm)-matrix, True where cells contain key, with given value if not None."""
+        if key not in self.planes:
+            return np.zeros(self.shape, dtype=bool)
+        if value is None:
+            return np.asarray(self.planes[key]) > 0
+        if value not in self.key_values[key]:
+            return np.zeros(self.shape, dtype=bool)
+        return np.asarray(self.planes[key]) == self.key_values[key].index(value) + 1
+
+    def tolist(self):
+        """Returns nested list of dicts in the schema of grid.pkl."""
+        return [[self[i, j] for j in range(self.shape[1])] for i in range(self.shape[0])]
+
+
+def grid_data_to_compact(grid_data):
+    """Encodes nested list or (nxm)-matrix of SceneCity dicts as CompactGridData."""
+    grid_data = np.asarray(grid_data)
+    key_values = {}
+    for grid_dict in grid_data.ravel():
+        for key, value in grid_dict.items():
+            if value not in key_values.setdefault(key, []):
+                key_values[key].append(value)
+    planes = {}
+    for key, values in key_values.items():
+        plane = np.zeros(grid_data.shape, dtype=np.uint8 if len(values) < 256 else np.uint16)
+        for (i, j), grid_dict in np.ndenumerate(grid_data):
+            if key in grid_dict:
+                plane[i, j] = values.index(grid_dict[key]) + 1
+        planes[key] = plane
+    return CompactGridData(planes, key_values, grid_data.shape)
+
+
+def save_compact_grid(compact_data, data_dir):
+    """Saves CompactGridData as .npy plane per key and key table in data_dir/grid."""
+    grid_dir = os.path.join(data_dir, compact_grid_dir)
+    os.makedirs(grid_dir, exist_ok=True)
+    for file_name in os.listdir(grid_dir):
+        os.remove(os.path.join(grid_dir, file_name))
+    key_files = {}
+    for i, (key, plane) in enumerate(compact_data.planes.items()):
+        key_files[key] = f"plane{i}.npy"
+        np.save(os.path.join(grid_dir, key_files[key]), np.ascontiguousarray(plane))
+    with open(os.path.join(grid_dir, key_table_file), "w") as f:
+        json.dump({'shape': list(compact_data.shape), 'files': key_files, 'values': compact_data.key_values}, f)
+
+
+def load_compact_grid(data_dir, mmap_mode='r'):
+    """Returns CompactGridData from data_dir/grid with planes memory-mapped."""
+    grid_dir = os.path.join(data_dir, compact_grid_dir)
+    with open(os.path.join(grid_dir, key_table_file)) as f:
+        key_table = json.load(f)
+    planes = {key: np.load(os.path.join(grid_dir, file_name), mmap_mode=mmap_mode)
+              for key, file_name in key_table['files'].items()}
+    return CompactGridData(planes, key_table['values'], key_table['shape'])
+
+
+def save_grid_data(grid_data, data_dir):
+    """Saves SceneCity grid data in compact format in data_dir."""
+    save_compact_grid(grid_data if isinstance(grid_data, CompactGridData) else grid_data_to_compact(grid_data),
+                      data_dir)
+
+
+def copy_grid(src_data_dir, dst_data_dir):
+    """Copies grid in compact format from src_data_dir to dst_data_dir, replacing the grid there."""
+    dst_grid_dir = os.path.join(dst_data_dir, compact_grid_dir)
+    shutil.rmtree(dst_grid_dir, ignore_errors=True)
+    shutil.copytree(os.path.join(src_data_dir, compact_grid_dir), dst_grid_dir)
+
+
+def convert_grid_file(data_dir, grid_file="grid.pkl"):
+    """Converts grid.pkl in data_dir to compact format."""
+    save_grid_data(get_grid_from_file(data_dir, grid_file), data_dir)
 
 
 def get_grid_from_file(data_base_dir, grid_file):
@@ -19,8 +276,12 @@ def get_grid_from_file(data_base_dir, grid_file):
 
 
 def get_grid_from_data(data_dir):
-    """Help function that returns Grid object from file. Due to bug in SceneCity cell_size always 1."""
-    grid_data = np.array(get_grid_from_file(data_dir, "grid.pkl"))
+    """Help function that returns Grid object from file. Due to bug in SceneCity cell_size always 1.
+    Prefers compact format in data_dir/grid over grid.pkl."""
+    if os.path.isfile(os.path.join(data_dir, compact_grid_dir, key_table_file)):
+        grid_data = load_compact_grid(data_dir)
+    else:
+        grid_data = np.array(get_grid_from_file(data_dir, "grid.pkl"))
     grid_size = grid_data.shape
     return Grid(grid_data, grid_size)
 
@@ -53,25 +314,36 @@ def get_blender_street_coord(node, grid):
 
 
 def get_border_streets(grid):
-    """Returns list of tuples representing the streets on the city border in grid coordinates."""
-    border_streets = [(0, j) for j, grid_dict in enumerate(grid.data[0, :]) if 'road' in grid_dict]
-    border_streets.extend([(i, 0) for i, grid_dict in enumerate(grid.data[:, 0]) if 'road' in grid_dict])
-    border_streets.extend(
-        [(grid.grid_size[0] - 1, j) for j, grid_dict in enumerate(grid.data[grid.grid_size[0] - 1, :]) if 'road' in grid_dict])
-    border_streets.extend(
-        [(i, grid.grid_size[1] - 1) for i, grid_dict in enumerate(grid.data[:, grid.grid_size[1] - 1]) if 'road' in grid_dict])
-    return border_streets
+    """Returns list of tuples representing the streets on the city border in grid coordinates.
+    Corner streets are contained twice, as they lie on two borders."""
+    return grid.border_streets[:]
+
+
+def get_blender_street_coords(path, grid):
+    """Batch version of get_blender_street_coord for all nodes of path. Returns list of tuples."""
+    coords = path.coords.astype(np.float64)
+    momenta = path.momenta.astype(np.float64)
+    momenta_len = np.abs(momenta).sum(axis=1)
+    scale = np.divide(0.15 * grid.cell_size, momenta_len, out=np.zeros_like(momenta_len), where=momenta_len != 0)
+    blender_coords = np.zeros((len(coords), 3))
+    blender_coords[:, 0] = (coords[:, 0] - grid.grid_size[0] / 2) * grid.cell_size + momenta[:, 1] * scale
+    blender_coords[:, 1] = (coords[:, 1] - grid.grid_size[1] / 2) * grid.cell_size - momenta[:, 0] * scale
+    return [tuple(coord) for coord in blender_coords.tolist()]
 
 
 def get_start_end_point(car, grid):
-    start_point_coord = car.nodes[0].coord - car.nodes[1].momentum
-    zero_momentum = path_interface.Vector((0, 0))
-    start_point = path_interface.Node(start_point_coord, zero_momentum)
-    end_point = path_interface.Node(car.nodes[-1].coord + car.nodes[-1].momentum/len(car.nodes[-1].momentum), zero_momentum)
-    start_point_blender = get_blender_street_coord(start_point, grid)
-    end_point_blender = get_blender_street_coord(end_point, grid)
+    """Returns blender coords of points one cell before the start and one cell after the end of the car's path."""
+    path = car.nodes
+    start_point_coord = path.coords[0] - path.momenta[1]
+    end_point_coord = path.coords[-1] + path.momenta[-1] / np.abs(path.momenta[-1]).sum()
+    # both points have zero momentum and therefore no offset to the street side
+    start_point_blender = coordtransform_grid_to_blender(tuple(start_point_coord.tolist()), grid)
+    end_point_blender = coordtransform_grid_to_blender(tuple(end_point_coord.tolist()), grid)
     return start_point_blender, end_point_blender
 
 
 if __name__=="__main__":
-    pass
\ No newline at end of file
+    # python -m scripts.grid_interface data ... converts data/grid.pkl to compact format in data/grid
+    parser = argparse.ArgumentParser(description="Converts data_dir/grid.pkl to compact format in data_dir/grid.")
+    parser.add_argument("data_dir")
+    convert_grid_file(parser.parse_args().data_dir)
@@ -1,56 +1,293 @@
 import bpy
 import cv2
 import bpycv
+import OpenEXR, Imath
+import numpy as np
 import os, time, importlib, logging, datetime
-from shutil import copyfile
-from . import pre_processing, post_processing, filtering
+from . import pre_processing, post_processing, filtering, dataset_manifest, metrics, profiling, run_checkpoint, \
+    shard_rendering
 importlib.reload(pre_processing)
 importlib.reload(post_processing)
 importlib.reload(filtering)
+importlib.reload(dataset_manifest)
+importlib.reload(metrics)
+importlib.reload(profiling)
+importlib.reload(run_checkpoint)
+importlib.reload(shard_rendering)
 
+# depth above which bpycv sets depth to 0, Cycles' Z pass of the sky is 1e10
+limit_depth = 1e8
 
-def set_render_settings():
+current_gt_categories = ["image", "semantic_segmentation", "disparity", "semantic_segmentation_color"]
+city_scapes_gt_categories = ["gtFine", "disparity", "camera", "leftImg8bit"]
+
+
+# named render profiles, settings missing in a profile are kept as saved in the .blend file
+#   device              :   'CPU' or 'GPU', compute_device_type 'CUDA' or 'OPTIX' for GPU
+#   threads             :   number of CPU threads, None detects them automatically
+#   samples             :   number of Cycles samples per pixel
+#   adaptive_threshold  :   noise threshold of adaptive sampling, 0 disables it
+#   denoise             :   denoise rendered images
+#   tile_size           :   edge length of render tiles in pixels, small tiles suit CPUs, large ones GPUs
+#   persistent_data     :   keep scene data, e.g. BVH, between rendered frames
+render_profiles = {
+    'gpu_cuda': {'device': 'GPU', 'compute_device_type': 'CUDA', 'threads': 4},
+    'cpu': {'device': 'CPU', 'threads': None, 'tile_size': 32, 'persistent_data': True},
+    'cpu_fast': {'device': 'CPU', 'threads': None, 'samples': 64, 'adaptive_threshold': 0.05, 'denoise': True,
+                 'tile_size': 32, 'persistent_data': True},
+    'cpu_draft': {'device': 'CPU', 'threads': None, 'samples': 16, 'adaptive_threshold': 0.1, 'denoise': True,
+                  'tile_size': 32, 'persistent_data': True}}
+default_render_profile = 'gpu_cuda'
+
+
+def set_render_settings(render_profile=default_render_profile):
+    """Sets Cycles settings of render_profile, given as name in render_profiles or as dict of the same schema. Settings
+    not available in the running Blender version are skipped."""
+    if isinstance(render_profile, str) and render_profile not in render_profiles:
+        raise RuntimeError(f"Unknown render profile {render_profile}, choose one of {list(render_profiles)}.")
+    profile = render_profiles[render_profile] if isinstance(render_profile, str) else render_profile
     scene = bpy.data.scenes[0]
     scene.render.engine = 'CYCLES'
-    bpy.context.preferences.addons["cycles"].preferences.compute_device_type = "CUDA"
-    scene.cycles.device = "GPU"
-    scene.render.threads_mode = 'FIXED'
-    scene.render.threads = 4
+    if 'device' in profile:
+        scene.cycles.device = profile['device']
+    if 'compute_device_type' in profile:
+        bpy.context.preferences.addons["cycles"].preferences.compute_device_type = profile['compute_device_type']
+    if 'threads' in profile:
+        scene.render.threads_mode = 'AUTO' if profile['threads'] is None else 'FIXED'
+        if profile['threads'] is not None:
+            scene.render.threads = profile['threads']
+    settings = {'samples': (scene.cycles, 'samples'),
+                'adaptive_threshold': (scene.cycles, 'adaptive_threshold'),
+                'denoise': (bpy.context.view_layer.cycles, 'use_denoising'),
+                'persistent_data': (scene.render, 'use_persistent_data')}
+    for key, (settings_object, attribute) in settings.items():
+        if key not in profile:
+            continue
+        if not hasattr(settings_object, attribute):
+            logging.info(f'render setting {key} not available in Blender {bpy.app.version_string}, skipped')
+            continue
+        setattr(settings_object, attribute, profile[key])
+    if 'adaptive_threshold' in profile and hasattr(scene.cycles, 'use_adaptive_sampling'):
+        scene.cycles.use_adaptive_sampling = bool(profile['adaptive_threshold'])
+    if 'tile_size' in profile:
+        # Blender 3.x sets a single Cycles tile size, older versions the tile size of the render
+        if hasattr(scene.cycles, 'tile_size'):
+            scene.cycles.tile_size = profile['tile_size']
+        elif hasattr(scene.render, 'tile_x'):
+            scene.render.tile_x = profile['tile_size']
+            scene.render.tile_y = profile['tile_size']
+        else:
+            logging.info(f'render setting tile_size not available in Blender {bpy.app.version_string}, skipped')
+    logging.info(f'render profile: {render_profile}')
+
+
+def write_gt(current_run_base_dir, frame, inst, depth, legends):
+    """Post-processes inst_id and depth of frame in memory, see post_processing.process_frame, and saves semantic
+    segmentation with unlabeled and sky swapped, its color image and disparity once in current_run_base_dir/all, see
+    run_checkpoint.atomic_write.
+
+    Returns
+    -------
+    list of str
+        Paths of saved files.
+    bool
+        True if the frame passes filtering.is_allowed.
+    """
+    images = post_processing.process_frame(inst, depth, legends)
+    allowed = filtering.is_allowed(images["semantic_segmentation"], legends['class_id_dict'])
+    paths = []
+    for category, img in images.items():
+        path = os.path.join(current_run_base_dir, "all", category, category + str(frame) + ".png")
+        with run_checkpoint.atomic_write(path) as tmp_path:
+            cv2.imwrite(tmp_path, img)
+        paths.append(path)
+    return paths, allowed
 
 
-def render_gt(current_run_base_dir, data_dir, rendering_frames):
-    """Renders GT for current for all frames and saves it in gt_base_dir"""
+@profiling.hook
+def render_gt(current_run_base_dir, data_dir, rendering_frames, checkpoint=None):
+    """Renders GT for current for all frames and saves it in gt_base_dir. Frames journaled in checkpoint are
+    skipped."""
     bpy.types.ImageFormatSettings.color_depth = 16
+    legends = post_processing.load_legends(data_dir)
     # gt rendering
     for i, frame in enumerate(rendering_frames):
-        logging.info(f"Render GT frame {frame}  ({i+1}/{len(rendering_frames)})")
-        bpy.context.scene.frame_set(frame)
-        result = bpycv.render_data(render_image=False, render_annotation=True)
-        cv2.imwrite(os.path.join(current_run_base_dir, "all", "semantic_segmentation", "semantic_segmentation" + str(frame) + ".png"),
-                    result["inst"])
-        disparity = post_processing.generate_disparity(result["depth"], result["inst"], data_dir)
-        cv2.imwrite(os.path.join(current_run_base_dir, "all", "disparity", "disparity" + str(frame) + ".png"), disparity)
+        if checkpoint is not None and checkpoint.is_done(frame, 'gt'):
+            continue
+        with metrics.measure('gt_render_frame', frame=frame), profiling.time_frame('gt_render', frame):
+            logging.info(f"Render GT frame {frame}  ({i+1}/{len(rendering_frames)})")
+            bpy.context.scene.frame_set(frame)
+            result = bpycv.render_data(render_image=False, render_annotation=True)
+            paths, allowed = write_gt(current_run_base_dir, frame, result["inst"], result["depth"], legends)
+        if checkpoint is not None:
+            checkpoint.add(frame, 'gt', paths, allowed=allowed)
         # normalized depth
         # cv2.imwrite(os.path.join(current_run_base_dir, "all", "depth", "depth" + str(frame) + ".png"),
         #             result["depth"] / result["depth"].max() * 255)
 
 
-def render_images(current_run_base_dir, frames, current_gt_categories):
-    # image rendering
+@profiling.hook
+def probe_frames(rendering_frames, data_dir, probe_fraction=0.125, probe_samples=1):
+    """Renders inst_id only at probe_fraction of the resolution with probe_samples samples and returns frames, whose
+    probe passes filtering.is_allowed. Cars covering less than a pixel of the probe are missed."""
+    scene = bpy.context.scene
+    resolution_percentage, samples = scene.render.resolution_percentage, scene.cycles.samples
+    scene.render.resolution_percentage = max(1, round(100 * probe_fraction))
+    scene.cycles.samples = probe_samples
+    class_id_dict = pre_processing.get_dict_from_file(data_dir, "class_id_legend.txt")
+    allowed_frames = []
+    try:
+        for i, frame in enumerate(rendering_frames):
+            with metrics.measure('probe_frame', frame=frame) as fields, profiling.time_frame('probe', frame):
+                bpy.context.scene.frame_set(frame)
+                result = bpycv.render_data(render_image=False, render_annotation=True)
+                sem_seg = post_processing.swap_ids(result["inst"].astype(np.uint8), class_id_dict)
+                fields['allowed'] = filtering.is_allowed(sem_seg, class_id_dict)
+                if fields['allowed']:
+                    allowed_frames.append(frame)
+    finally:
+        scene.render.resolution_percentage = resolution_percentage
+        scene.cycles.samples = samples
+    logging.info(f'probe at {scene.render.resolution_x * probe_fraction:.0f}x{scene.render.resolution_y * probe_fraction:.0f} '
+                 f'allowed {len(allowed_frames)} of {len(rendering_frames)} frames')
+    return allowed_frames
+
+
+@profiling.hook
+def render_images(current_run_base_dir, frames, current_gt_categories, checkpoint=None):
+    # image rendering, frames journaled in checkpoint are skipped
     for i, frame in enumerate(frames):
-        bpy.context.scene.frame_set(frame)
-        bpy.data.scenes[0].render.filepath = os.path.join(current_run_base_dir, "filtered", "image", "image" + str(frame) + ".png")
-        logging.info(f'Render image frame {frame} ({i+1}/{len(frames)}) using: {bpy.data.scenes[0].render.engine}')
-        bpy.ops.render.render(write_still=True)
-        gt_files = [os.path.join(category, category + str(frame) + ".png")
-                    for category in current_gt_categories if category != "image"]
-        for gt_file in gt_files:
-            copyfile(src=os.path.join(current_run_base_dir, "all", gt_file),
-                     dst=os.path.join(current_run_base_dir, "filtered", gt_file))
+        if checkpoint is not None and checkpoint.is_done(frame, 'image'):
+            continue
+        with metrics.measure('image_render_frame', frame=frame), profiling.time_frame('image_render', frame):
+            bpy.context.scene.frame_set(frame)
+            bpy.data.scenes[0].render.filepath = os.path.join(current_run_base_dir, "filtered", "image", "image" + str(frame) + ".png")
+            logging.info(f'Render image frame {frame} ({i+1}/{len(frames)}) using: {bpy.data.scenes[0].render.engine}')
+            bpy.ops.render.render(write_still=True)
+            copy_to_filtered(current_run_base_dir, frame, [category for category in current_gt_categories if category != "image"])
+        if checkpoint is not None:
+            checkpoint.add(frame, 'image', [os.path.join(current_run_base_dir, "filtered", category,
+                                                         category + str(frame) + ".png")
+                                            for category in current_gt_categories])
+
+
+def copy_to_filtered(current_run_base_dir, frame, categories):
+    """Links, or else copies, files of frame in categories from all to filtered of current run."""
+    for gt_file in [os.path.join(category, category + str(frame) + ".png") for category in categories]:
+        post_processing.link_or_copy(src=os.path.join(current_run_base_dir, "all", gt_file),
+                                     dst=os.path.join(current_run_base_dir, "filtered", gt_file))
+
+
+def set_up_pass_output(passes_dir):
+    """Enables object index and Z pass and adds compositor File Output node writing both per frame as multilayer EXR
+    passes_<frame>.exr to passes_dir. The object index of each object is set to its inst_id."""
+    scene = bpy.context.scene
+    for obj in bpy.data.objects:
+        obj.pass_index = int(obj["inst_id"]) if "inst_id" in obj else 0
+    view_layer = bpy.context.view_layer
+    view_layer.use_pass_object_index = True
+    view_layer.use_pass_z = True
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    node_tree = scene.node_tree
+    render_layers_node = next((node for node in node_tree.nodes if node.type == 'R_LAYERS'), None)
+    if render_layers_node is None:
+        render_layers_node = node_tree.nodes.new("CompositorNodeRLayers")
+    if not any(node.type == 'COMPOSITE' for node in node_tree.nodes):
+        composite_node = node_tree.nodes.new("CompositorNodeComposite")
+        node_tree.links.new(render_layers_node.outputs["Image"], composite_node.inputs["Image"])
+    file_output_node = node_tree.nodes.new("CompositorNodeOutputFile")
+    file_output_node.base_path = os.path.join(passes_dir, "passes_####")
+    file_output_node.format.file_format = 'OPEN_EXR_MULTILAYER'
+    file_output_node.format.color_depth = '32'
+    file_output_node.format.exr_codec = 'ZIP'
+    file_output_node.layer_slots.clear()
+    for slot, output in (("inst_id", "IndexOB"), ("depth", "Depth")):
+        file_output_node.layer_slots.new(slot)
+        node_tree.links.new(render_layers_node.outputs[output], file_output_node.inputs[slot])
+    return file_output_node
 
 
-def extract_gt(gt_base_dir, data_dir, blend_file_dir, rendering_frames, test_perc, val_perc, number_of_frames=None):
-    """Extracts ground_truth for current run  and copies it to CityScapes-format.
+def read_exr_layers(exr_path):
+    """Returns dict mapping layer name to (nxm)-array of float32 of its first channel in multilayer EXR."""
+    exr_file = OpenEXR.InputFile(exr_path)
+    header = exr_file.header()
+    data_window = header['dataWindow']
+    shape = (data_window.max.y - data_window.min.y + 1, data_window.max.x - data_window.min.x + 1)
+    layers = {}
+    for channel in sorted(header['channels']):
+        layer = channel.rsplit('.', 1)[0]
+        if layer not in layers:
+            channel_data = exr_file.channel(channel, Imath.PixelType(Imath.PixelType.FLOAT))
+            layers[layer] = np.frombuffer(channel_data, dtype=np.float32).reshape(shape).copy()
+    exr_file.close()
+    return layers
+
+
+@profiling.hook
+def render_single_pass(current_run_base_dir, data_dir, rendering_frames, checkpoint=None):
+    """Renders image, inst_id and depth of each frame in one Cycles render via render passes, instead of rendering
+    annotations with bpycv and images after reopening current_city.blend. Saves image, semantic segmentation and
+    disparity of all frames in current_run_base_dir/all. Frames journaled in checkpoint are skipped."""
+    passes_dir = os.path.join(current_run_base_dir, "all", "passes")
+    os.makedirs(passes_dir, exist_ok=True)
+    file_output_node = set_up_pass_output(passes_dir)
+    legends = post_processing.load_legends(data_dir)
+    for i, frame in enumerate(rendering_frames):
+        if checkpoint is not None and checkpoint.is_done(frame, 'gt'):
+            continue
+        with metrics.measure('single_pass_frame', frame=frame), profiling.time_frame('single_pass', frame):
+            bpy.context.scene.frame_set(frame)
+            bpy.data.scenes[0].render.filepath = os.path.join(current_run_base_dir, "all", "image", "image" + str(frame) + ".png")
+            logging.info(f'Render image and GT frame {frame} ({i+1}/{len(rendering_frames)}) in single pass')
+            bpy.ops.render.render(write_still=True)
+            exr_path = os.path.join(passes_dir, "passes_" + str(frame).zfill(4) + ".exr")
+            layers = read_exr_layers(exr_path)
+            os.remove(exr_path)
+            inst = np.round(layers["inst_id"]).astype(np.uint8)
+            depth = layers["depth"]
+            depth[depth > limit_depth] = 0
+            paths, allowed = write_gt(current_run_base_dir, frame, inst, depth, legends)
+        if checkpoint is not None:
+            checkpoint.add(frame, 'gt', paths + [bpy.data.scenes[0].render.filepath], allowed=allowed)
+    bpy.context.scene.node_tree.nodes.remove(file_output_node)
+
+
+def render_shard(current_run_base_dir, data_dir, frames, stage, shard, render_profile=default_render_profile):
+    """Renders stage of frames of the opened current_city.blend as shard, journaling them in the journal of shard in
+    current_run_base_dir. Called by render_shard.py in processes started by shard_rendering.render_shards."""
+    checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir, shard_rendering.get_journal_file_name(shard))
+    set_render_settings(render_profile)
+    logging.info(f'shard {shard} renders {stage} of frames {frames}')
+    if stage == 'image':
+        render_images(current_run_base_dir, frames, current_gt_categories, checkpoint)
+        return
+    pre_processing.set_up_semantic_segmentation(data_dir)
+    if stage == 'single_pass':
+        render_single_pass(current_run_base_dir, data_dir, frames, checkpoint)
+    else:
+        render_gt(current_run_base_dir, data_dir, frames, checkpoint)
+
+
+def render_sharded(blend_file_dir, data_dir, frames, stage, checkpoint, number_shards, render_profile,
+                   shard_launchers=None, shard_timeout=None):
+    """Renders stage of frames of current_city.blend in number_shards Blender processes, see
+    shard_rendering.render_shards. Returns frames left unrendered by failed shards."""
+    with metrics.measure('shards_' + stage, frames=len(frames), shards=number_shards) as fields:
+        missing_frames = shard_rendering.render_shards(bpy.app.binary_path,
+                                                       os.path.join(blend_file_dir, "current_city.blend"), checkpoint,
+                                                       data_dir, frames, stage, number_shards, render_profile,
+                                                       shard_launchers, shard_timeout)
+        fields['missing'] = len(missing_frames)
+    return missing_frames
+
+
+def extract_gt(gt_base_dir, data_dir, blend_file_dir, rendering_frames, test_perc, val_perc, number_of_frames=None,
+               current_run_base_dir=None, parameters=None, single_pass=False, probe_fraction=None,
+               render_profile=default_render_profile, checkpoint=None, number_shards=1, shard_launchers=None,
+               shard_timeout=None):
+    """Extracts ground_truth for current run  and copies it to CityScapes-format. Every rendered and stored frame is
+    journaled in checkpoint, so that an interrupted run resumes with its first unfinished frame.
 
     Parameters
     ----------
@@ -59,7 +296,7 @@ def extract_gt(gt_base_dir, data_dir, blend_file_dir, rendering_frames, test_per
     data_dir    :    str
         Path of data base directory with camera.json file.
     blend_file_dir  :   str
-        Path of .blend file.
+        Path of directory with current_city.blend.
     rendering_frames    :   list of int
         List of frames to be rendered.
     test_perc    :    float
@@ -68,32 +305,105 @@ def extract_gt(gt_base_dir, data_dir, blend_file_dir, rendering_frames, test_per
         Approximate percentage of current run used for validation. Used as weight in random choice.
     number_of_frames    :    int
         Number of frames to render. None corresponds to the rendering of all frames.
+    current_run_base_dir    :   str
+        Path of directory for ground truth of current run. None corresponds to gt_base_dir/current_run.
+    parameters  :   dict
+        Parameters of the run recorded in the manifest of the data set.
+    single_pass :   bool
+        If True, images are rendered together with the GT of all frames in one render per frame, see
+        render_single_pass, else GT is rendered with bpycv and images of allowed frames only.
+    probe_fraction  :   float
+        If given, frames are filtered on a low resolution probe render of this fraction of the resolution before
+        rendering full resolution GT, see probe_frames.
+    render_profile  :   str or dict
+        Name of profile in render_profiles or dict of the same schema, see set_render_settings.
+    checkpoint  :   RunCheckpoint
+        Checkpoint of the run in current_run_base_dir. If its state holds the frames of an interrupted run, these are
+        resumed without clearing current_run_base_dir. None starts a new checkpoint.
+    number_shards   :   int
+        If greater than 1, GT and images of the frames are rendered by this number of parallel Blender processes on
+        current_city.blend in blend_file_dir, see shard_rendering. Frames of failed shards are rendered here.
+    shard_launchers :   list of list of str
+        Command prefixes starting shards on other machines sharing the paths, e.g. [['ssh', 'node1']].
+    shard_timeout   :   float
+        Maximal duration of the shards of a stage in s, after which they are killed. None for no limit.
+
+    Returns
+    -------
+    list of int
+        Frames stored in CityScapes-format.
     """
     start_time = time.time()
-    current_run_base_dir = os.path.join(gt_base_dir, "current_run")
-    current_gt_categories = ["image", "semantic_segmentation", "disparity", "semantic_segmentation_color"]
-    city_scapes_gt_categories = ["gtFine", "disparity", "camera", "leftImg8bit"]
-    pre_processing.create_ground_truth_dir(current_run_base_dir, current_gt_categories)
+    if current_run_base_dir is None:
+        current_run_base_dir = os.path.join(gt_base_dir, "current_run")
+    if checkpoint is None:
+        checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir)
+        checkpoint.start(parameters or {})
+    resumed = 'frames' in checkpoint.state
+    pre_processing.create_ground_truth_dir(current_run_base_dir, current_gt_categories, clear=not resumed)
     pre_processing.set_up_semantic_segmentation(data_dir)
-    set_render_settings()
-    if number_of_frames:
-        rendering_frames = rendering_frames[:number_of_frames]
+    set_render_settings(render_profile)
+    if resumed:
+        rendering_frames = checkpoint.state['frames']
+        logging.info(f'resuming run with {len(checkpoint.get_done_frames(rendering_frames, "gt"))} of '
+                     f'{len(rendering_frames)} frames rendered')
+    else:
+        if number_of_frames:
+            rendering_frames = rendering_frames[:number_of_frames]
+        if probe_fraction:
+            rendering_frames = probe_frames(rendering_frames, data_dir, probe_fraction)
+        checkpoint.update(frames=rendering_frames)
     logging.info(f'Updated rendering_frames: {rendering_frames}')
-    render_gt(current_run_base_dir, data_dir, rendering_frames)
-    post_processing.swap_id_unlabeled_and_sky(os.path.join(current_run_base_dir, "all"), data_dir)
-    post_processing.generate_color_images(os.path.join(current_run_base_dir, "all"), data_dir)
-    allowed_frames = filtering.get_allowed_frames(os.path.join(current_run_base_dir, "all"), data_dir)
+    # semantic segmentation is saved with unlabeled and sky swapped and colored per frame, see write_gt
+    gt_frames = rendering_frames
+    if number_shards > 1:
+        gt_frames = render_sharded(blend_file_dir, data_dir, rendering_frames, "single_pass" if single_pass else "gt",
+                                   checkpoint, number_shards, render_profile, shard_launchers,
+                                   shard_timeout)
+    if single_pass:
+        render_single_pass(current_run_base_dir, data_dir, gt_frames, checkpoint)
+    else:
+        render_gt(current_run_base_dir, data_dir, gt_frames, checkpoint)
+    with metrics.measure('filtering', frames=len(rendering_frames)) as fields:
+        # decisions were taken in memory by write_gt, frames journaled without are filtered from their files
+        undecided_frames = [frame for frame in rendering_frames
+                            if 'allowed' not in checkpoint.get_entry(frame, 'gt')]
+        allowed_undecided = filtering.get_allowed_frames(os.path.join(current_run_base_dir, "all"), data_dir,
+                                                         undecided_frames) if undecided_frames else []
+        allowed_frames = [frame for frame in rendering_frames if checkpoint.get_entry(frame, 'gt').get('allowed')
+                          or frame in allowed_undecided]
+        fields['allowed'] = len(allowed_frames)
     logging.info(f'allowed frames: {allowed_frames}')
-    if allowed_frames:
-        bpy.ops.wm.open_mainfile(filepath=os.path.join(blend_file_dir, "current_city.blend"))
-        logging.basicConfig(filename=os.path.join(data_dir, "runs.log"), filemode='a', level=logging.INFO)
-        set_render_settings()
-        render_images(current_run_base_dir, allowed_frames[:], current_gt_categories)
+    if allowed_frames and not checkpoint.state.get('stored'):
+        if single_pass:
+            for frame in allowed_frames:
+                copy_to_filtered(current_run_base_dir, frame, current_gt_categories)
+        else:
+            image_frames = [frame for frame in allowed_frames if not checkpoint.is_done(frame, 'image')]
+            if number_shards > 1 and image_frames:
+                image_frames = render_sharded(blend_file_dir, data_dir, image_frames, "image", checkpoint,
+                                              number_shards, render_profile, shard_launchers, shard_timeout)
+            # the city is only reopened for images neither journaled nor rendered by shards
+            if image_frames:
+                with metrics.measure('reopen_city'):
+                    bpy.ops.wm.open_mainfile(filepath=os.path.join(blend_file_dir, "current_city.blend"))
+                logging.basicConfig(filename=os.path.join(data_dir, "runs.log"), filemode='a', level=logging.INFO)
+                set_render_settings(render_profile)
+                render_images(current_run_base_dir, image_frames, current_gt_categories, checkpoint)
         post_processing.check_city_scapes_dirs(gt_base_dir, city_scapes_gt_categories)
-        post_processing.store_current_run(gt_base_dir, data_dir, allowed_frames[:], city_scapes_gt_categories,
-                                          current_gt_categories, test_perc, val_perc)
+        with metrics.measure('store', frames=len(allowed_frames)):
+            post_processing.store_current_run(gt_base_dir, data_dir, allowed_frames[:], city_scapes_gt_categories,
+                                              current_gt_categories, test_perc, val_perc, current_run_base_dir,
+                                              parameters, checkpoint)
+    if allowed_frames:
+        manifest = dataset_manifest.DatasetManifest(os.path.join(gt_base_dir, "CityScapes_format"))
+        manifest.finish_sequence(checkpoint.state['sequence'], len(allowed_frames), time.time() - start_time)
+        manifest.close()
+    checkpoint.finish()
+    metrics.record('extract_gt', time.time() - start_time, frames=len(rendering_frames), allowed=len(allowed_frames))
     logging.info(f'Rendered ground truth and {len(allowed_frames)} images - execution time: {round(time.time() - start_time)} s')
     print(f'Rendered ground truth and {len(allowed_frames)} images\nExecution time: {round(time.time() - start_time)} s')
+    return allowed_frames
 
 
 if __name__ == "__main__":
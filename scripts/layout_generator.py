@@ -0,0 +1,117 @@
+import importlib
+import numpy as np
+from . import grid_interface
+importlib.reload(grid_interface)
+"""Blender-free generator of grid-city layouts in the schema of SceneCity's NonOverlappingBoxesLayoutNode."""
+
+# kind of cell per value in layout arrays
+cell_kinds = ("empty", "road", "district")
+road_kind = cell_kinds.index("road")
+district_kind = cell_kinds.index("district")
+
+# SceneCity key,value-pairs per kind of cell, as queried by 'road = all' and 'district = comm'
+cell_dicts = {road_kind: {'road': 'default'}, district_kind: {'district': 'comm'}}
+
+
+def get_road_positions(rng, length, min_block, max_block):
+    """Returns indices of roads along one axis of given length, separated by blocks of min_block to max_block cells.
+    Roads keep at least min_block cells distance to the border, so that every border cell of a road is a road end."""
+    blocks = rng.integers(min_block, max_block + 1, size=length // (min_block + 1) + 1)
+    positions = np.cumsum(blocks + 1) - 1
+    positions = positions[positions <= length - 1 - min_block]
+    if not len(positions):
+        positions = np.array([length // 2])
+    return positions
+
+
+def generate_layout(rng, grid_size, min_block=2, max_block=5, merge_probability=0.2):
+    """Randomly generates layout of roads and districts.
+
+    Roads run through the whole city between blocks of districts. Road segments between two X-crossings are removed
+    with merge_probability to merge neighbouring blocks, so that only straight roads, T- and X-crossings remain.
+
+    Parameters
+    ----------
+    rng :   np.random.Generator
+        Random generator, the same seed reproduces the same layout.
+    grid_size   :   tuple
+        Shape of the grid.
+    min_block, max_block    :   int
+        Minimal and maximal number of cells between two parallel roads.
+    merge_probability   :   float
+        Probability to remove a road segment between two X-crossings.
+
+    Returns
+    -------
+    np.ndarray of uint8
+        (nxm)-matrix with index into cell_kinds per cell.
+    """
+    (n, m) = grid_size
+    rows = get_road_positions(rng, n, min_block, max_block)
+    columns = get_road_positions(rng, m, min_block, max_block)
+    road_mask = np.zeros((n, m), dtype=bool)
+    road_mask[rows, :] = True
+    road_mask[:, columns] = True
+
+    if merge_probability:
+        # candidate segments between neighbouring crossings, horizontal and vertical, in random order
+        segments = [(row, columns[k], columns[k + 1], True) for row in rows for k in range(len(columns) - 1)]
+        segments += [(column, rows[k], rows[k + 1], False) for column in columns for k in range(len(rows) - 1)]
+        for index in rng.permutation(len(segments)):
+            if rng.random() >= merge_probability:
+                continue
+            line, start, end, horizontal = segments[index]
+            ends = [(line, start), (line, end)] if horizontal else [(start, line), (end, line)]
+            if all(get_degree(road_mask, cell) == 4 for cell in ends):
+                if horizontal:
+                    road_mask[line, start + 1:end] = False
+                else:
+                    road_mask[start + 1:end, line] = False
+
+    layout = np.full((n, m), district_kind, dtype=np.uint8)
+    layout[road_mask] = road_kind
+    return layout
+
+
+def get_degree(road_mask, cell):
+    """Returns number of neighbouring road cells of cell."""
+    (i, j) = cell
+    return sum(road_mask[i + di, j + dj] for di, dj in ((1, 0), (-1, 0), (0, 1), (0, -1))
+               if 0 <= i + di < road_mask.shape[0] and 0 <= j + dj < road_mask.shape[1])
+
+
+def generate_layouts(rng, count, grid_size, **kwargs):
+    """Returns (count x n x m)-array of layouts generated by generate_layout with given kwargs."""
+    return np.stack([generate_layout(rng, grid_size, **kwargs) for _ in range(count)])
+
+
+def layout_to_grid_data(layout):
+    """Converts layout to nested list of dicts in the schema of grid.pkl created by city_handler.create_grid."""
+    return [[dict(cell_dicts.get(kind, {})) for kind in row] for row in layout.tolist()]
+
+
+def get_grid_from_layout(layout):
+    """Returns Grid of layout, the road index is built from the layout instead of the dicts."""
+    return grid_interface.Grid(layout_to_compact(layout), layout.shape, road_mask=layout == road_kind)
+
+
+def layout_to_compact(layout):
+    """Converts layout to grid_interface.CompactGridData without building dicts."""
+    planes = {key: (layout == kind).astype(np.uint8) for kind, cell_dict in cell_dicts.items() for key in cell_dict}
+    key_values = {key: [value] for cell_dict in cell_dicts.values() for key, value in cell_dict.items()}
+    return grid_interface.CompactGridData(planes, key_values, layout.shape)
+
+
+def save_layout(layout, data_dir):
+    """Saves layout in compact format in data_dir, readable by grid_interface.get_grid_from_data."""
+    grid_interface.save_compact_grid(layout_to_compact(layout), data_dir)
+
+
+def get_grid_loader(rng, grid_size, **kwargs):
+    """Returns function without arguments, that returns Grid of a newly generated layout, e.g. for
+    scene_planner.plan_scene."""
+    return lambda: get_grid_from_layout(generate_layout(rng, grid_size, **kwargs))
+
+
+if __name__ == "__main__":
+    pass
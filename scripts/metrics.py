@@ -0,0 +1,124 @@
+import os, sys, json, time, glob, resource, argparse
+from contextlib import contextmanager
+from datetime import datetime
+"""Structured performance telemetry, writing one JSON line per pipeline stage and per rendered frame, and a report
+aggregating these records across runs."""
+
+metrics_file_name = "metrics.jsonl"
+
+# state of the current run, records are dropped while no run is started
+current_run = {'file': None, 'id': None, 'start_time': None, 'parameters': {}}
+
+
+def get_peak_rss():
+    """Returns peak resident set size of the process in MB."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS and in KB elsewhere
+    return peak_rss / 1024 ** 2 if sys.platform == "darwin" else peak_rss / 1024
+
+
+def start_run(metrics_file, **parameters):
+    """Starts recording to metrics_file for a new run with scene parameters, e.g. grid_size."""
+    current_run['file'] = metrics_file
+    current_run['id'] = datetime.now().strftime("%Y%m%d_%H%M%S_") + str(os.getpid())
+    current_run['start_time'] = time.perf_counter()
+    current_run['parameters'] = dict(parameters)
+
+
+def update_run(**parameters):
+    """Adds scene parameters known only during the run, e.g. number of cars, to the record of the run."""
+    current_run['parameters'].update(parameters)
+
+
+def end_run(**fields):
+    """Records the run as stage 'run' with its parameters and total duration and stops recording."""
+    if current_run['file'] is None:
+        return
+    fields = dict(current_run['parameters'], **fields)
+    record('run', time.perf_counter() - current_run['start_time'], **fields)
+    current_run.update({'file': None, 'id': None, 'start_time': None, 'parameters': {}})
+
+
+def record(stage, duration, **fields):
+    """Appends record of stage with its duration in s, the peak RSS and fields to the metrics file of the run."""
+    if current_run['file'] is None:
+        return
+    entry = {'run': current_run['id'], 'stage': stage, 'duration': duration, 'peak_rss': get_peak_rss(),
+             'time': datetime.now().isoformat()}
+    entry.update(fields)
+    with open(current_run['file'], "a") as f:
+        f.write(json.dumps(entry, default=str) + "\n")
+
+
+@contextmanager
+def measure(stage, **fields):
+    """Context manager recording the wall time of its body as stage. Yields dict of fields, to which the body can add
+    results, e.g. number of frames."""
+    start_time = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record(stage, time.perf_counter() - start_time, **fields)
+
+
+# report
+def load_records(paths):
+    """Returns records of metrics files, directories are searched recursively for metrics.jsonl."""
+    records = []
+    for path in paths:
+        files = glob.glob(os.path.join(path, "**", metrics_file_name), recursive=True) if os.path.isdir(path) else [path]
+        for file in files:
+            with open(file) as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def get_stage_table(records):
+    """Returns list of dicts per stage with count, total, mean and max duration in s and share of the total run time,
+    sorted by total duration. Stages nest, e.g. gt_render_frame within extract_gt, so shares do not add up to 1."""
+    run_time = sum(entry['duration'] for entry in records if entry['stage'] == 'run') or 1
+    stages = {}
+    for entry in records:
+        if entry['stage'] != 'run':
+            stages.setdefault(entry['stage'], []).append(entry['duration'])
+    table = [{'stage': stage, 'count': len(durations), 'total': sum(durations), 'mean': sum(durations) / len(durations),
+              'max': max(durations), 'share': sum(durations) / run_time} for stage, durations in stages.items()]
+    return sorted(table, key=lambda row: row['total'], reverse=True)
+
+
+def get_throughput(records):
+    """Returns dict with number of runs, runs worth rendering, stored frames, total hours, frames per hour and peak
+    RSS in MB, overall and per grid size."""
+    runs = [entry for entry in records if entry['stage'] == 'run']
+
+    def summarize(selected_runs):
+        hours = sum(entry['duration'] for entry in selected_runs) / 3600
+        frames = sum(entry.get('frames_stored', 0) for entry in selected_runs)
+        return {'runs': len(selected_runs), 'render_worth': sum(bool(entry.get('render_worth')) for entry in selected_runs),
+                'frames_stored': frames, 'hours': hours, 'frames_per_hour': frames / hours if hours else 0.0,
+                'peak_rss': max((entry['peak_rss'] for entry in selected_runs), default=0.0)}
+
+    throughput = {'all': summarize(runs)}
+    for grid_size in sorted({str(entry.get('grid_size')) for entry in runs}):
+        throughput['grid ' + grid_size] = summarize([entry for entry in runs if str(entry.get('grid_size')) == grid_size])
+    return throughput
+
+
+def format_report(records):
+    """Returns throughput and hotspot tables of records as str."""
+    lines = ["throughput", f'{"":<20}{"runs":>8}{"worth":>8}{"frames":>10}{"hours":>10}{"frames/h":>10}{"RSS MB":>10}']
+    for name, row in get_throughput(records).items():
+        lines.append(f'{name:<20}{row["runs"]:>8}{row["render_worth"]:>8}{row["frames_stored"]:>10}'
+                     f'{row["hours"]:>10.2f}{row["frames_per_hour"]:>10.1f}{row["peak_rss"]:>10.0f}')
+    lines += ["", "hotspots", f'{"stage":<24}{"count":>8}{"total s":>12}{"mean s":>10}{"max s":>10}{"share":>8}']
+    for row in get_stage_table(records):
+        lines.append(f'{row["stage"]:<24}{row["count"]:>8}{row["total"]:>12.1f}{row["mean"]:>10.2f}{row["max"]:>10.2f}'
+                     f'{row["share"]:>8.1%}')
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python -m scripts.metrics data workers ... prints report of all metrics.jsonl found
+    parser = argparse.ArgumentParser(description="Reports throughput and hotspots of recorded runs.")
+    parser.add_argument("paths", nargs="+", help="metrics.jsonl files or directories containing them")
+    print(format_report(load_records(parser.parse_args().paths)))
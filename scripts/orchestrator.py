@@ -0,0 +1,235 @@
+import os, sys, json, time, shutil, signal, logging, argparse, threading, queue, subprocess
+"""Blender-free orchestrator, that runs jobs of worker.py on several headless Blender workers in parallel."""
+
+# prefix of lines on stdout of worker.py reporting the result of a job, see scene_worker.result_prefix
+result_prefix = "CITYNTHESIZER_RESULT "
+
+
+def get_available_memory():
+    """Returns memory available for new processes in GB, falls back to total physical memory."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3
+
+
+def get_number_workers(memory_per_worker=4.0, cpus_per_worker=1):
+    """Returns number of workers fitting into the CPUs and available memory in GB of the machine, at least 1."""
+    by_cpu = (os.cpu_count() or 1) // cpus_per_worker
+    by_memory = int(get_available_memory() // memory_per_worker)
+    return max(1, min(by_cpu, by_memory))
+
+
+def create_work_dir(blend_file_dir, work_dir):
+    """Creates isolated working directory of a worker with a copy of the static files of blend_file_dir/data, i.e.
+    camera.json and legends. Grid, runs.log, current_city.blend and current_run of the worker are written to it."""
+    work_data_dir = os.path.join(work_dir, "data")
+    os.makedirs(work_data_dir, exist_ok=True)
+    data_dir = os.path.join(blend_file_dir, "data")
+    for file_name in os.listdir(data_dir):
+        if os.path.isfile(os.path.join(data_dir, file_name)) and file_name != "runs.log":
+            shutil.copyfile(os.path.join(data_dir, file_name), os.path.join(work_data_dir, file_name))
+
+
+class BlenderWorker:
+    """Headless Blender process running worker.py, that receives jobs as JSON lines on stdin and reports their result
+    on stdout.
+
+    Attributes
+    ----------
+    command :   list of str
+        Command starting the Blender process.
+    work_dir    :   str
+        Working directory of the worker, passed as CITYNTHESIZER_WORK_DIR to setup.py.
+    process :   subprocess.Popen
+        Running Blender process, None if not started.
+    lines   :   queue.Queue
+        Result lines read from stdout of the process, None once stdout is closed.
+
+    Methods
+    -------
+    start()
+        Starts Blender process.
+    run_job(job, timeout)
+        Hands job to the process and waits for its result.
+    stop()
+        Closes stdin of the process, letting it finish, or kills it.
+    """
+    def __init__(self, blender, blend_file_dir, work_dir):
+        self.command = [blender, os.path.join(blend_file_dir, "standard.blend"), "-b",
+                        "-P", os.path.join(blend_file_dir, "worker.py"), "--", "--jobs", "-"]
+        self.work_dir = work_dir
+        self.process = None
+        self.lines = None
+
+    def start(self):
+        env = dict(os.environ, CITYNTHESIZER_WORK_DIR=self.work_dir)
+        with open(os.path.join(self.work_dir, "blender.log"), "a") as log_file:
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=log_file, env=env, universal_newlines=True, errors='replace',
+                                            start_new_session=True)
+        self.lines = queue.Queue()
+        threading.Thread(target=self.read_stdout, args=(self.process, self.lines), daemon=True).start()
+
+    def read_stdout(self, process, lines):
+        """Forwards result lines of process to lines and appends everything else to blender.log of the worker."""
+        with open(os.path.join(self.work_dir, "blender.log"), "a") as log_file:
+            for line in process.stdout:
+                if line.startswith(result_prefix):
+                    lines.put(line[len(result_prefix):])
+                else:
+                    log_file.write(line)
+        lines.put(None)
+
+    def run_job(self, job, timeout=None):
+        """Hands job to the process and waits for its result.
+
+        Returns
+        -------
+        dict
+            Result reported by the worker, None if the process crashed or exceeded timeout in s and was killed.
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        try:
+            self.process.stdin.write(json.dumps(job) + "\n")
+            self.process.stdin.flush()
+            line = self.lines.get(timeout=timeout)
+        except (OSError, queue.Empty):
+            line = None
+        if line is None:
+            self.kill()
+            return None
+        return json.loads(line)
+
+    def kill(self):
+        """Kills the process group of the worker, i.e. Blender and processes started by it."""
+        if self.process is not None and self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+        self.process = None
+
+    def stop(self, timeout=60):
+        """Closes stdin of the process, letting the worker finish, and kills it after timeout in s."""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+        self.process = None
+
+
+class Orchestrator:
+    """Hands out jobs from a queue to parallel BlenderWorkers. Jobs of crashed or timed out workers are retried on a
+    restarted worker up to max_retries times.
+
+    Attributes
+    ----------
+    workers :   list of BlenderWorker
+        One worker per working directory blend_file_dir/workers/worker<i>.
+    job_timeout :   float
+        Maximal duration of one job in s, None for no limit.
+    max_retries :   int
+        Number of times a job is retried after its worker crashed or timed out.
+    results :   list of dict
+        Result per finished job, including its parameters and number of attempts.
+
+    Methods
+    -------
+    run(jobs)
+        Runs all jobs and returns results.
+    """
+    def __init__(self, blender, blend_file_dir, number_workers, job_timeout=None, max_retries=2):
+        self.workers = []
+        for i in range(number_workers):
+            work_dir = os.path.join(blend_file_dir, "workers", "worker" + str(i))
+            create_work_dir(blend_file_dir, work_dir)
+            self.workers.append(BlenderWorker(blender, blend_file_dir, work_dir))
+        self.job_timeout = job_timeout
+        self.max_retries = max_retries
+        self.results = []
+        self.lock = threading.Lock()
+
+    def work(self, worker, jobs):
+        """Runs jobs of queue on worker until the queue is empty."""
+        while True:
+            try:
+                index, job, attempt = jobs.get_nowait()
+            except queue.Empty:
+                break
+            start_time = time.time()
+            result = worker.run_job(job, self.job_timeout)
+            if result is None:
+                logging.warning(f'job {index} crashed or timed out after {time.time() - start_time:.0f} s '
+                                f'on {worker.work_dir} (attempt {attempt + 1})')
+                if attempt < self.max_retries:
+                    jobs.put((index, job, attempt + 1))
+                    continue
+                result = {'succeeded': False, 'render_worth': False, 'duration': time.time() - start_time}
+            result.update({'job': index, 'parameters': job, 'attempts': attempt + 1, 'worker': worker.work_dir})
+            logging.info(f'finished job {index}: {result}')
+            with self.lock:
+                self.results.append(result)
+        worker.stop()
+
+    def run(self, jobs):
+        """Runs all jobs on the workers in parallel and returns their results ordered by job."""
+        job_queue = queue.Queue()
+        for index, job in enumerate(jobs):
+            job_queue.put((index, job, 0))
+        threads = [threading.Thread(target=self.work, args=(worker, job_queue)) for worker in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(self.results, key=lambda result: result['job'])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run jobs of worker.py on parallel headless Blender workers.")
+    parser.add_argument("blender", help="path to blender executable")
+    parser.add_argument("--blend-file-dir", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help="directory of standard.blend and worker.py")
+    parser.add_argument("--jobs", default=None, help="JSON-lines file with one dict of run parameters per scene")
+    parser.add_argument("--runs", type=int, default=20, help="number of scenes with default parameters, without --jobs")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of parallel workers, by default chosen from CPU count and available memory")
+    parser.add_argument("--memory-per-worker", type=float, default=4.0, help="memory needed per worker in GB")
+    parser.add_argument("--cpus-per-worker", type=int, default=1, help="CPUs needed per worker")
+    parser.add_argument("--timeout", type=float, default=None, help="maximal duration of one job in s")
+    parser.add_argument("--retries", type=int, default=2, help="number of retries of crashed or timed out jobs")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if args.jobs is None:
+        jobs = [{} for _ in range(args.runs)]
+    else:
+        with open(args.jobs) as f:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    number_workers = args.workers or get_number_workers(args.memory_per_worker, args.cpus_per_worker)
+    number_workers = min(number_workers, len(jobs)) or 1
+    logging.info(f'running {len(jobs)} jobs on {number_workers} workers')
+    start_time = time.time()
+    orchestrator = Orchestrator(args.blender, args.blend_file_dir, number_workers, args.timeout, args.retries)
+    results = orchestrator.run(jobs)
+    succeeded = sum(result['succeeded'] for result in results)
+    render_worth = sum(result['render_worth'] for result in results)
+    logging.info(f'{succeeded}/{len(jobs)} jobs succeeded, {render_worth} were worth rendering, '
+                 f'execution time: {round(time.time() - start_time)} s')
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,4 +1,5 @@
 import random
+import numpy as np
 """Interface that handles space- and velocity-information of the paths for each car."""
 
 
@@ -84,7 +85,86 @@ class Node:
         return f"coord: {self.coord.data}, momentum:{self.momentum.data}"
 
 
-def create_random_path(start_points, border_streets, grid):
+class Path:
+    """Array-backed path of a car with space and velocity information.
+
+    Attributes
+    ----------
+    coords  :   np.ndarray of int32
+        (nx2)-matrix with grid coordinates of the path's nodes in correct order.
+    momenta :   np.ndarray of int32
+        (nx2)-matrix with momentum of each node, accumulated along straight parts of the path.
+
+    Indexing with an int returns a Node, slicing returns a Path sharing the underlying arrays.
+    """
+    __slots__ = ('coords', 'momenta')
+
+    def __init__(self, coords, momenta):
+        self.coords = np.asarray(coords, dtype=np.int32).reshape(-1, 2)
+        self.momenta = np.asarray(momenta, dtype=np.int32).reshape(-1, 2)
+        if self.coords.shape != self.momenta.shape:
+            raise RuntimeError("Coordinates and momenta of path differ in length.")
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Path(self.coords[key], self.momenta[key])
+        return Node(Vector(tuple(self.coords[key].tolist())), Vector(tuple(self.momenta[key].tolist())))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __str__(self):
+        return f"coords: {self.coords.tolist()}, momenta: {self.momenta.tolist()}"
+
+    def grid_coordinates(self):
+        """Returns list of tuples with grid coordinates of all nodes."""
+        return [tuple(coord) for coord in self.coords.tolist()]
+
+    def turns(self):
+        """Returns sign of z component of cross product of momenta at pos and pos+1 for all but the last position.
+        Negative corresponds to a right, positive to a left turn."""
+        z_comp_cross_product = self.momenta[:-1, 0] * self.momenta[1:, 1] - self.momenta[:-1, 1] * self.momenta[1:, 0]
+        return np.sign(z_comp_cross_product).astype(np.int8)
+
+    def predict_movements(self):
+        """Returns direction as str for all but the last position, depending on momenta of node pos and pos+1."""
+        return [movement_names[turn] for turn in self.turns().tolist()]
+
+
+def path_from_nodes(nodes):
+    """Converts list of Node to Path."""
+    return Path([node.coord.data for node in nodes], [node.momentum.data for node in nodes])
+
+
+# unit steps between neighbouring cells, order defines order of neighbours in road index of Grid
+directions = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+# distance of road cells without connection to the border, small enough to be added to without overflow
+unreachable_distance = np.iinfo(np.int32).max // 2
+
+# direction as str for sign of z component of cross product of consecutive momenta
+movement_names = {-1: "right", 0: "straight", 1: "left"}
+
+
+def momenta_parallel(momentum, other):
+    """Equivalent of Vector.is_parallel_to for tuples or arrays. Every vector parallel to origin."""
+    if not any(momentum) or not any(other):
+        return True
+    return momentum[0] * other[1] == momentum[1] * other[0] and momentum[0] * other[0] + momentum[1] * other[1] > 0
+
+
+def momenta_anti_parallel(momentum, other):
+    """Equivalent of Vector.is_anti_parallel_to for tuples or arrays. Every vector parallel to origin."""
+    if not any(momentum) or not any(other):
+        return True
+    return momentum[0] * other[1] == momentum[1] * other[0] and momentum[0] * other[0] + momentum[1] * other[1] < 0
+
+
+def create_random_path(start_points, border_streets, grid, min_length=0, max_length=None, border_bias=0.0):
     """Randomly create a path from border to border of city.
 
     Parameters
@@ -92,44 +172,191 @@ def create_random_path(start_points, border_streets, grid):
     start_points    :   list
         List of possible start points in grid-coordinates.
     border_streets  :   list
-        List of tuples as grid-coordinates of streets on city border.
+        List of tuples as grid-coordinates of streets on city border. Kept for compatibility, border cells are
+        taken from the road index of grid.
     grid : Grid
-        data attr is (nxm)-matrix with elements being dicts that contain the SceneCity key,value-pairs.
+        Grid with precomputed road index (neighbours, border_cells) and distance fields.
+    min_length  :   int
+        Target minimal number of nodes, steps that cannot lead to a path of min_length are avoided if possible.
+    max_length  :   int
+        Maximal number of nodes. Only steps that can still reach the border within max_length are taken, if none is
+        left the path heads straight for the border.
+    border_bias :   float
+        Steps away from the border are weighted by exp(border_bias), steps towards it by exp(-border_bias).
 
     Returns
     -------
-    list of Node
-        List containing nodes with coord and momentum of cars on randomly chosen path in correct order.
+    Path
+        Path containing coord and momentum of cars on randomly chosen path in correct order.
     """
     # choose start point and remove from available start points
     start_point = random.choice(start_points)
     start_points.remove(start_point)
-    nodes = [Node(Vector(start_point), Vector((0, 0)))]
-    directions = [Vector((1, 0)), Vector((-1, 0)), Vector((0, 1)), Vector((0, -1))]
-    next_node = Node(Vector((grid.grid_size[0]/2, grid.grid_size[1]/2)), Vector((0, 0)))  # middle node not on border
-    while next_node.coord.data not in border_streets:
-        if len(nodes) <= 1:
-            previous_node = Node(Vector(grid.grid_size), Vector((0, 0)))  # definitely not on grid
+    coords = [tuple(start_point)]
+    momenta = [(0, 0)]
+    previous_coord = tuple(grid.grid_size)  # definitely not on grid
+    constrained = min_length or max_length is not None or border_bias
+    long_exit_distance = grid.get_long_exit_distance(min_length) if min_length else None
+    while len(coords) <= 1 or coords[-1] not in grid.border_cells:
+        current_coord, current_momentum = coords[-1], momenta[-1]
+        # get neighbouring road nodes from road index, excluding previous node
+        neighbours = [(coord, direction) for coord, direction in grid.neighbours[current_coord]
+                      if coord != previous_coord]
+        if constrained:
+            current_id = grid.cell_ids[current_coord]
+            candidates = np.full((1, 4), -1, dtype=np.int32)
+            for coord, direction in neighbours:
+                candidates[0, directions.index(direction)] = grid.cell_ids[coord]
+            weights = get_step_weights(grid, np.array([current_id]), candidates, candidates >= 0,
+                                       np.array([len(coords)]), min_length, max_length, border_bias,
+                                       long_exit_distance)[0]
+            if not weights.any():
+                raise RuntimeError(f"Random walk trapped at {current_coord}, border not reachable.")
+            neighbours = [(coord, direction) for coord, direction in neighbours
+                          if weights[directions.index(direction)] > 0]
+            next_coord, direction = random.choices(
+                neighbours, weights=[weights[directions.index(direction)] for _, direction in neighbours])[0]
         else:
-            previous_node = nodes[-2]
-        current_node = nodes[-1]
-        #print('current_node', current_node.coord.data, coordtransform_grid_to_blender(current_node.coord.data, grid))
-        # get neighbouring nodes and filter non-street nodes
-        neighbours = [Node(coord=current_node.coord + direction, momentum=direction)
-                      for direction in directions]
-        #print('neighbours', [(neighbour.coord.data, coordtransform_grid_to_blender(neighbour.coord.data, grid)) for neighbour in neighbours])
-        neighbours = [node for node in neighbours if 0 <= node.coord.x() < grid.grid_size[0]
-                      and 0 <= node.coord.y() < grid.grid_size[1]]
-        neighbours = [node for node in neighbours if 'road' in grid.data[node.coord[0]][node.coord[1]]
-                      and node.coord.data != previous_node.coord.data]
-        #print('filtered neighbours', [(neighbour.coord.data, coordtransform_grid_to_blender(neighbour.coord.data, grid)) for neighbour in neighbours])
+            next_coord, direction = random.choice(neighbours)
         # add up momenta or introduce curve
-        for node in neighbours:
-            if current_node.momentum.is_parallel_to(node.momentum):
-                node.momentum = current_node.momentum + node.momentum
-            # ToDo-me: else add more nodes/increase weight (-> add as attr to Node) to get better curvature
-        next_node = random.choice(neighbours)
-        #print('next_node second', next_node.coord.data, coordtransform_grid_to_blender(next_node.coord.data, grid))
-        nodes.append(next_node)
-
-    return nodes
+        # ToDo-me: else add more nodes/increase weight (-> add as attr to Node) to get better curvature
+        if momenta_parallel(current_momentum, direction):
+            direction = (current_momentum[0] + direction[0], current_momentum[1] + direction[1])
+        previous_coord = current_coord
+        coords.append(next_coord)
+        momenta.append(direction)
+
+    return Path(coords, momenta)
+
+
+def get_step_weights(grid, current, candidates, valid, length, min_length=0, max_length=None, border_bias=0.0,
+                     long_exit_distance=None):
+    """Returns (wx4)-matrix of weights for the next step of w random walks, zero for forbidden steps.
+
+    Parameters
+    ----------
+    grid : Grid
+        Grid with precomputed road index and distance fields.
+    current :   np.ndarray
+        Road cell ids the walks are in.
+    candidates  :   np.ndarray
+        (wx4)-matrix of neighbouring road cell ids per direction.
+    valid   :   np.ndarray
+        (wx4)-matrix, True for neighbours that may be stepped on, i.e. existing and not the previous cell.
+    length  :   np.ndarray
+        Number of nodes of each walk so far.
+    min_length, max_length, border_bias :
+        See create_random_path.
+    long_exit_distance  :   np.ndarray
+        Grid.get_long_exit_distance(min_length), required if min_length is set.
+
+    Returns
+    -------
+    np.ndarray
+        Weights, rows without any positive weight belong to trapped walks.
+    """
+    remaining = np.where(valid, grid.exit_distance[candidates, np.arange(4)[None, :]], unreachable_distance)
+    allowed = valid & (remaining < unreachable_distance)
+    if max_length is not None:
+        # keep steps from which the border can be reached in time, else head straight for the border
+        feasible = allowed & (length[:, None] + 1 + remaining <= max_length)
+        shortest = allowed & (remaining == remaining.min(axis=1)[:, None])
+        allowed = np.where(feasible.any(axis=1)[:, None], feasible, shortest)
+    if min_length:
+        # keep steps from which a path of min_length can still be completed, if there are any
+        long_remaining = long_exit_distance[candidates, np.arange(4)[None, :]]
+        growing = allowed & (length[:, None] + 1 + long_remaining >= min_length)
+        allowed = np.where(growing.any(axis=1)[:, None], growing, allowed)
+    weights = allowed.astype(np.float64)
+    if border_bias:
+        ascent = grid.border_distance[candidates] - grid.border_distance[current][:, None]
+        weights *= np.exp(border_bias * np.clip(ascent, -1, 1))
+    return weights
+
+
+def sample_random_paths(grid, rng, count, start_points=None, min_length=0, max_length=None, border_bias=0.0):
+    """Samples count random paths from border to border of city at once, seeded by rng.
+
+    All random walks are stepped in lock-step over the road index of grid and follow the rules of
+    create_random_path: no step back to the previous node, momenta add up along straight parts.
+
+    Parameters
+    ----------
+    grid : Grid
+        Grid with precomputed road index (neighbour_table, border_ids) and distance fields.
+    rng :   np.random.Generator
+        Random generator, the same seed reproduces the same paths.
+    count   :   int
+        Number of paths to sample.
+    start_points    :   list
+        List of possible start points in grid-coordinates, drawn with replacement. Defaults to all border streets.
+    min_length, max_length, border_bias :
+        See create_random_path.
+
+    Returns
+    -------
+    list of Path or None
+        Sampled paths, None for walks that got trapped without a way to the border.
+    """
+    if start_points is None:
+        start_points = grid.border_streets
+    if count <= 0 or not start_points:
+        return []
+    start_points = np.asarray(start_points, dtype=np.int64).reshape(-1, 2)
+    start_ids = grid.cell_ids[tuple(start_points[rng.integers(len(start_points), size=count)].T)]
+    # state of active walks only, finished walks are dropped from the state arrays
+    walks = np.arange(count)
+    current = start_ids.astype(np.int32)
+    previous = np.full(count, -1, dtype=np.int32)
+    length = np.ones(count, dtype=np.int32)
+    long_exit_distance = grid.get_long_exit_distance(min_length) if min_length else None
+    cell_history = [(walks, current)]
+    dead_end = np.zeros(count, dtype=bool)
+    while len(walks):
+        candidates = grid.neighbour_table[current]
+        valid = (candidates >= 0) & (candidates != previous[:, None])
+        weights = get_step_weights(grid, current, candidates, valid, length, min_length, max_length, border_bias,
+                                   long_exit_distance)
+        cumulative_weights = np.cumsum(weights, axis=1)
+        stuck = cumulative_weights[:, -1] == 0
+        if stuck.any():
+            dead_end[walks[stuck]] = True
+            walks, current, length, candidates, cumulative_weights = \
+                walks[~stuck], current[~stuck], length[~stuck], candidates[~stuck], cumulative_weights[~stuck]
+        # choose neighbour according to weights
+        threshold = rng.random(len(walks)) * cumulative_weights[:, -1]
+        direction_index = np.argmax(cumulative_weights > threshold[:, None], axis=1)
+        previous, current = current, candidates[np.arange(len(walks)), direction_index]
+        length = length + 1
+        cell_history.append((walks, current))
+        running = ~grid.border_ids[current]
+        walks, current, previous, length = walks[running], current[running], previous[running], length[running]
+
+    # gather cell ids per walk in order of steps
+    step_walks = np.concatenate([step[0] for step in cell_history])
+    step_cells = np.concatenate([step[1] for step in cell_history])
+    order = np.argsort(step_walks, kind='stable')
+    bounds = np.searchsorted(step_walks[order], np.arange(count + 1))
+    step_cells = step_cells[order]
+    paths = []
+    for i in range(count):
+        if dead_end[i]:
+            paths.append(None)
+            continue
+        paths.append(path_from_coords(grid.road_cells[step_cells[bounds[i]:bounds[i + 1]]]))
+    return paths
+
+
+def path_from_coords(coords):
+    """Returns Path through coords of neighbouring cells, momenta add up along straight parts like in
+    create_random_path."""
+    coords = np.asarray(coords, dtype=np.int32).reshape(-1, 2)
+    steps = np.diff(coords, axis=0)
+    # length of run of equal steps ending at each step
+    run_start = np.ones(len(steps), dtype=bool)
+    run_start[1:] = (steps[1:] != steps[:-1]).any(axis=1)
+    step_index = np.arange(len(steps))
+    run_length = step_index - np.maximum.accumulate(np.where(run_start, step_index, 0)) + 1
+    momenta = np.zeros_like(coords)
+    momenta[1:] = steps * run_length[:, None]
+    return Path(coords, momenta)
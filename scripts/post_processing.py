@@ -1,11 +1,12 @@
-import os, importlib, random, json, logging, re, time
+import os, importlib, random, json, logging, time
 from datetime import datetime
 from pathlib import Path
 from shutil import copyfile
-import cv2
 import numpy as np
-from . import pre_processing
+from . import pre_processing, dataset_manifest, profiling
 importlib.reload(pre_processing)
+importlib.reload(dataset_manifest)
+importlib.reload(profiling)
 
 
 def corrected_depth(depth):
@@ -16,10 +17,11 @@ def corrected_depth(depth):
     return depth
 
 
-def disparity_from_depth(depth, data_dir):
-    """Returns disparity in px in image space."""
-    with open(os.path.join(data_dir, "camera.json")) as f:
-        camera_data = json.load(f)
+def disparity_from_depth(depth, data_dir, camera_data=None):
+    """Returns disparity in px in image space. camera_data of data_dir/camera.json is read if not given."""
+    if camera_data is None:
+        with open(os.path.join(data_dir, "camera.json")) as f:
+            camera_data = json.load(f)
     base_line = camera_data['extrinsic']['baseline']
     focal_length = camera_data['intrinsic']['fx'] + camera_data['intrinsic']['fy'] / 2
     disparity = (base_line * focal_length) / depth
@@ -33,54 +35,82 @@ def disparity_float_to_16_bit(disparity_float):
     return disparity_16bit.astype(np.uint16)
 
 
-def disparity_filter_ego_vehicle(disparity, sem_seg, data_dir):
+def disparity_filter_ego_vehicle(disparity, sem_seg, data_dir, class_id_dict=None):
     """Most CS disparity maps show measurements for the ego vehicle to be invalid (== 0)"""
-    class_id_dict = pre_processing.get_dict_from_file(data_dir, "class_id_legend.txt")
+    if class_id_dict is None:
+        class_id_dict = pre_processing.get_dict_from_file(data_dir, "class_id_legend.txt")
     disparity[sem_seg == int(class_id_dict['ego vehicle'])] = 0
     return disparity
 
 
-def generate_disparity(depth, sem_seg, data_dir):
-    """Corrects depth, generates disparity, converts and filters it according to CityScapes."""
+def generate_disparity(depth, sem_seg, data_dir, camera_data=None, class_id_dict=None):
+    """Corrects depth, generates disparity, converts and filters it according to CityScapes. Camera and legend are
+    read from data_dir if not given."""
     depth = corrected_depth(depth)
-    disparity_float = disparity_from_depth(depth, data_dir)
+    disparity_float = disparity_from_depth(depth, data_dir, camera_data)
     disparity_16bit = disparity_float_to_16_bit(disparity_float)
-    disparity_filtered = disparity_filter_ego_vehicle(disparity_16bit, sem_seg, data_dir)
+    disparity_filtered = disparity_filter_ego_vehicle(disparity_16bit, sem_seg, data_dir, class_id_dict)
     return disparity_filtered
 
 
-def swap_id_unlabeled_and_sky(current_run_base_dir, data_dir):
-    """Blender is unable to assign Sky as HDRI an inst_id, defaults to 0. Therefore swapped with unlabeled in class_id_dict.
-    Now swap ids according to CityScapes"""
-    sem_seg_base_dir = os.path.join(current_run_base_dir, "semantic_segmentation")
-    class_id_dict = pre_processing.get_dict_from_file(data_dir, "class_id_legend.txt")
-    for filename in os.listdir(sem_seg_base_dir):
-        img_path = os.path.join(sem_seg_base_dir, filename)
-        img = cv2.imread(img_path, 0)
-        mask_sky = img == int(class_id_dict['unlabeled'])
-        mask_unlabeled = img == int(class_id_dict['sky'])
-        img[mask_sky] = int(class_id_dict['sky'])
-        img[mask_unlabeled] = int(class_id_dict['unlabeled'])
-        cv2.imwrite(img_path, img)
-
-
-def generate_color_images(current_run_base_dir, data_dir):
-    sem_seg_base_dir = os.path.join(current_run_base_dir, "semantic_segmentation")
-    color_base_dir = os.path.join(current_run_base_dir, "semantic_segmentation_color")
+def load_legends(data_dir):
+    """Returns dict with class_id_dict, color_lut and camera_data of data_dir, loaded once per run for process_frame."""
+    with open(os.path.join(data_dir, "camera.json")) as f:
+        camera_data = json.load(f)
+    return {'class_id_dict': pre_processing.get_dict_from_file(data_dir, "class_id_legend.txt"),
+            'color_lut': get_color_lut(get_id_color_dict(data_dir)), 'camera_data': camera_data}
+
+
+@profiling.hook
+def process_frame(inst, depth, legends):
+    """Post-processes inst_id and depth of a rendered frame in memory, i.e. swaps unlabeled and sky, colors the
+    semantic segmentation and generates disparity. Returns dict mapping GT category to image ready to be written."""
+    disparity = generate_disparity(depth, inst, None, legends['camera_data'], legends['class_id_dict'])
+    sem_seg = swap_ids(inst.astype(np.uint8), legends['class_id_dict'])
+    return {"semantic_segmentation": sem_seg,
+            "semantic_segmentation_color": get_color_image(sem_seg, legends['color_lut']),
+            "disparity": disparity}
+
+
+def swap_ids(img, class_id_dict):
+    """Swaps ids of unlabeled and sky in semantic segmentation img in place and returns it."""
+    mask_sky = img == int(class_id_dict['unlabeled'])
+    mask_unlabeled = img == int(class_id_dict['sky'])
+    img[mask_sky] = int(class_id_dict['sky'])
+    img[mask_unlabeled] = int(class_id_dict['unlabeled'])
+    return img
+
+
+def get_id_color_dict(data_dir):
+    """Returns dict mapping label id as str to RGB tuple of id_color_legend."""
     id_color_dict = pre_processing.get_dict_from_file(data_dir, "id_color_legend.txt")
     for label, color in id_color_dict.items():
         id_color_dict[label] = tuple(int(color[1:-1].split(',')[i]) for i in range(3))
-    for filename in os.listdir(sem_seg_base_dir):
-        regex = re.compile(r'\d+')
-        frame_number = int(regex.search(filename).group(0))
-        sem_seg_path = os.path.join(sem_seg_base_dir, filename)
-        color_path = os.path.join(color_base_dir, "semantic_segmentation_color" + str(frame_number) + ".png")
-        sem_seg = cv2.imread(sem_seg_path, 0)
-        color = np.zeros(sem_seg.shape + (3,))
-        for label_id in np.unique(sem_seg):
-            color[sem_seg == label_id] = id_color_dict[str(label_id)]
-        color = color.astype(np.uint8)
-        cv2.imwrite(color_path, cv2.cvtColor(color, cv2.COLOR_RGB2BGR))
+    return id_color_dict
+
+
+def get_color_lut(id_color_dict):
+    """Returns (256x3)-lookup table of BGR colors per label id of id_color_dict, as written by cv2."""
+    color_lut = np.zeros((256, 3), dtype=np.uint8)
+    for label, color in id_color_dict.items():
+        color_lut[int(label)] = color[::-1]
+    return color_lut
+
+
+def get_color_image(sem_seg, color_lut):
+    """Returns color image of 8-bit semantic segmentation in BGR order, looked up in color_lut."""
+    return color_lut[sem_seg]
+
+
+def link_or_copy(src, dst):
+    """Hard links dst to src, so that a file is stored without writing it again, and copies it where links are not
+    supported, e.g. across file systems. Only used within current_run, files of the data set are copies."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        copyfile(src, dst)
 
 
 def check_city_scapes_dirs(gt_base_dir, categories):
@@ -91,18 +121,11 @@ def check_city_scapes_dirs(gt_base_dir, categories):
         Path(path_str).mkdir(parents=True, exist_ok=True)
 
 
-def get_highest_sequence_number(city_scapes_paths, splits):
-    """Returns highest sequence number over all CityScapes-categories."""
-    split_dirs = [os.path.join(path, split, "scenecity") for key, path in city_scapes_paths.items() for split in splits]
-    sequence_nr = 0
-    for split_dir in split_dirs:
-        for filename in os.listdir(split_dir):
-            sequence_nr = max(int(filename.split('_')[1]), sequence_nr)
-    return sequence_nr
-
-
-def store_current_run(gt_base_dir, data_dir, allowed_frames, city_scapes_gt_categories, current_gt_categories, test_perc=0.0, val_perc=0.0):
-    """Stores GT of current run in CityScapes-format. By default all data used for training.
+@profiling.hook
+def store_current_run(gt_base_dir, data_dir, allowed_frames, city_scapes_gt_categories, current_gt_categories, test_perc=0.0, val_perc=0.0,
+                      current_run_base_dir=None, parameters=None, checkpoint=None):
+    """Stores GT of current run in CityScapes-format and records it in the manifest of the data set. By default all
+    data used for training.
 
     Parameters
     ----------
@@ -120,38 +143,77 @@ def store_current_run(gt_base_dir, data_dir, allowed_frames, city_scapes_gt_cate
         Approximate percentage of current run used for testing. Used as weight in random choice.
     val_perc    :    float
         Approximate percentage of current run used for validation. Used as weight in random choice.
+    current_run_base_dir    :   str
+        Path of directory with ground truth of current run. None corresponds to gt_base_dir/current_run.
+    parameters  :   dict
+        Parameters of the run recorded in the manifest.
+    checkpoint  :   RunCheckpoint
+        If given, sequence number and splits are kept in the state of the run and stored frames are journaled, so
+        that a resumed run stores its remaining frames under the same sequence number and splits.
+
+    Returns
+    -------
+    int
+        Sequence number allocated for current run by the manifest.
     """
+    if current_run_base_dir is None:
+        current_run_base_dir = os.path.join(gt_base_dir, "current_run")
     splits = ["train", "test", "val"]
-    current_run_paths = {gt_category: os.path.join(gt_base_dir, "current_run", "filtered", gt_category)
+    current_run_paths = {gt_category: os.path.join(current_run_base_dir, "filtered", gt_category)
                          for gt_category in current_gt_categories}
     city_scapes_paths = {gt_category: os.path.join(gt_base_dir, "CityScapes_format", gt_category)
                          for gt_category in city_scapes_gt_categories}
-    sequence_nr = get_highest_sequence_number(city_scapes_paths, splits) + 1
-    splits = random.choices(splits, weights=[100 * (1 - test_perc - val_perc), 100 * test_perc, 100 * val_perc], k=len(allowed_frames))
+    manifest = dataset_manifest.DatasetManifest(os.path.join(gt_base_dir, "CityScapes_format"))
+    if checkpoint is not None and 'sequence' in checkpoint.state:
+        sequence_nr = checkpoint.state['sequence']
+        splits = [checkpoint.state['splits'][str(frame)] for frame in allowed_frames]
+    else:
+        sequence_nr = manifest.allocate_sequence(parameters)
+        splits = random.choices(splits, weights=[100 * (1 - test_perc - val_perc), 100 * test_perc, 100 * val_perc], k=len(allowed_frames))
+        if checkpoint is not None:
+            checkpoint.update(sequence=sequence_nr, splits={str(frame): split for frame, split in zip(allowed_frames, splits)})
     logging.info(f'About to store {allowed_frames}')
     for i, frame in enumerate(allowed_frames):
+        if checkpoint is not None and checkpoint.is_done(frame, 'stored'):
+            logging.info(f'frame {frame} already stored')
+            continue
         current_files = {current_gt_category: os.path.join(current_run_paths[current_gt_category],
                                                            current_gt_category + str(frame) + ".png")
                          for current_gt_category in current_gt_categories}
         current_files["camera"] = os.path.join(data_dir, "camera.json")
         from_split = os.path.join(splits[i], "scenecity")
         city_scapes_file_name = '_'.join(["scenecity", str(sequence_nr).zfill(6), str(frame).zfill(6)])
-        logging.info(f'storing frame {frame} under {city_scapes_file_name}\ncurrent file names: {current_files} ')
+        logging.info('storing frame %s under %s', frame, city_scapes_file_name)
+        logging.debug('current file names: %s', current_files)
         # copy to gtFine
-        copyfile(current_files["image"],
-                 os.path.join(city_scapes_paths["leftImg8bit"], from_split, city_scapes_file_name + "_leftImg8bit.png"))
-        copyfile(current_files["semantic_segmentation"],
-                 os.path.join(city_scapes_paths["gtFine"], from_split, city_scapes_file_name + "_gtFine_labelIds.png"))
-        copyfile(current_files["semantic_segmentation_color"],
-                 os.path.join(city_scapes_paths["gtFine"], from_split, city_scapes_file_name + "_gtFine_color.png"))
-        copyfile(current_files["disparity"],
-                 os.path.join(city_scapes_paths["disparity"], from_split, city_scapes_file_name + "_disparity.png"))
-        copyfile(current_files["camera"],
-                 os.path.join(city_scapes_paths["camera"], from_split, city_scapes_file_name + "_camera.json"))
+        city_scapes_files = {
+            "leftImg8bit": (current_files["image"], os.path.join(city_scapes_paths["leftImg8bit"], from_split,
+                                                                 city_scapes_file_name + "_leftImg8bit.png")),
+            "gtFine_labelIds": (current_files["semantic_segmentation"], os.path.join(
+                city_scapes_paths["gtFine"], from_split, city_scapes_file_name + "_gtFine_labelIds.png")),
+            "gtFine_color": (current_files["semantic_segmentation_color"], os.path.join(
+                city_scapes_paths["gtFine"], from_split, city_scapes_file_name + "_gtFine_color.png")),
+            "disparity": (current_files["disparity"], os.path.join(city_scapes_paths["disparity"], from_split,
+                                                                   city_scapes_file_name + "_disparity.png")),
+            "camera": (current_files["camera"], os.path.join(city_scapes_paths["camera"], from_split,
+                                                             city_scapes_file_name + "_camera.json"))}
+        # copied, so that files of the data set do not share inodes with current_run, which is rewritten by later runs,
+        # files left by an interrupted run are removed instead of being overwritten in place
+        for src, dst in city_scapes_files.values():
+            if os.path.lexists(dst):
+                os.remove(dst)
+            copyfile(src, dst)
+        manifest.add_sample(sequence_nr, frame, splits[i], {category: dst for category, (src, dst) in city_scapes_files.items()})
+        if checkpoint is not None:
+            checkpoint.add(frame, 'stored', [dst for src, dst in city_scapes_files.values()])
         logging.info(f"stored frame {frame} in CityScapes-format")
-    os.rename(src=os.path.join(gt_base_dir, "current_run", "filtered"),
-              dst=os.path.join(gt_base_dir, "current_run", "filtered" + datetime.now().strftime("%d_%m_%Y_%H_%M_%S")))
+    if checkpoint is not None:
+        checkpoint.update(stored=True)
+    os.rename(src=os.path.join(current_run_base_dir, "filtered"),
+              dst=os.path.join(current_run_base_dir, "filtered" + datetime.now().strftime("%d_%m_%Y_%H_%M_%S")))
+    manifest.close()
     logging.info(f'Stored {len(allowed_frames)} in CityScapes-format under sequence-nr. {sequence_nr}')
+    return sequence_nr
 
 
 if __name__ == "__main__":
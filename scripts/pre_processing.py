@@ -39,7 +39,8 @@ def clear_folder(path):
             print('Failed to delete %s. Reason: %s' % (file_path, e))
 
 
-def create_ground_truth_dir(base_dir, sub_dirs):
+def create_ground_truth_dir(base_dir, sub_dirs, clear=True):
     for path_str in [os.path.join(base_dir, top, sub_dir) for sub_dir in sub_dirs for top in ["all", "filtered"]]:
         Path(path_str).mkdir(parents=True, exist_ok=True)
-        clear_folder(path_str)
+        if clear:
+            clear_folder(path_str)
@@ -0,0 +1,145 @@
+import os, io, sys, time, pstats, cProfile, tracemalloc, functools, statistics
+from contextlib import contextmanager
+"""Opt-in profiling hooks around pipeline stages, writing a cProfile dump, tracemalloc top allocators and per-frame
+wall times per run. Profiling is enabled by the environment variable CITYNTHESIZER_PROFILE or the job entry 'profile',
+both a comma-separated list of profile_modes, e.g. CITYNTHESIZER_PROFILE=cprofile,frames. Disabled hooks only call
+the wrapped function."""
+
+profile_env = "CITYNTHESIZER_PROFILE"
+profile_modes = ["cprofile", "tracemalloc", "frames"]
+
+# number of allocators listed per stage and every how many frames a wall time is kept
+number_top_allocators = 15
+frame_sample_interval = 1
+
+# state of the current run, hooks are inactive while modes is empty
+current_profile = {'modes': set(), 'path': None, 'profiler': None, 'depth': 0, 'allocations': [], 'frames': [],
+                   'frame_counts': {}}
+
+
+def get_modes(setting=None):
+    """Returns set of enabled profile_modes from setting, a comma-separated str or list, or else from profile_env."""
+    if setting is None:
+        setting = os.environ.get(profile_env, "")
+    if isinstance(setting, str):
+        setting = setting.split(",")
+    modes = {mode.strip().lower() for mode in setting if mode.strip()}
+    if "all" in modes:
+        return set(profile_modes)
+    unknown = modes - set(profile_modes)
+    if unknown:
+        raise RuntimeError(f'unknown profile modes {sorted(unknown)}, choose from {profile_modes}')
+    return modes
+
+
+def start_run(profile_dir, run_id, modes):
+    """Starts profiling of a run with modes, its files are written to profile_dir with prefix run_id by end_run."""
+    current_profile.update({'modes': set(modes), 'path': os.path.join(profile_dir, run_id), 'profiler': None,
+                            'depth': 0, 'allocations': [], 'frames': [], 'frame_counts': {}})
+    if "tracemalloc" not in modes and tracemalloc.is_tracing():
+        # left tracing by a failed run
+        tracemalloc.stop()
+    if not modes:
+        return
+    os.makedirs(profile_dir, exist_ok=True)
+    if "cprofile" in modes:
+        current_profile['profiler'] = cProfile.Profile()
+    if "tracemalloc" in modes and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def end_run():
+    """Writes files of the current run and stops profiling. Returns list of paths of written files."""
+    modes, path = current_profile['modes'], current_profile['path']
+    paths = []
+    if "cprofile" in modes:
+        current_profile['profiler'].dump_stats(path + ".prof")
+        paths.append(path + ".prof")
+    if "tracemalloc" in modes:
+        tracemalloc.stop()
+        with open(path + "_tracemalloc.txt", "w") as f:
+            f.write("\n".join(current_profile['allocations']) + "\n")
+        paths.append(path + "_tracemalloc.txt")
+    if "frames" in modes:
+        with open(path + "_frames.txt", "w") as f:
+            f.write(format_frame_times(current_profile['frames']))
+        paths.append(path + "_frames.txt")
+    current_profile.update({'modes': set(), 'path': None, 'profiler': None, 'depth': 0, 'allocations': [],
+                            'frames': [], 'frame_counts': {}})
+    return paths
+
+
+@contextmanager
+def profile_stage(stage):
+    """Context manager profiling its body as stage with the enabled modes. Nested stages are profiled by the outermost
+    one with cProfile, tracemalloc lists the allocators of each stage."""
+    modes = current_profile['modes']
+    profiler = current_profile['profiler'] if current_profile['depth'] == 0 else None
+    snapshot = tracemalloc.take_snapshot() if "tracemalloc" in modes else None
+    current_profile['depth'] += 1
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        current_profile['depth'] -= 1
+        if snapshot is not None:
+            statistics_diff = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+            peak_memory = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+            current_profile['allocations'].append(f'{stage} (peak traced memory {peak_memory:.1f} MB)')
+            current_profile['allocations'].extend("    " + str(stat) for stat in statistics_diff[:number_top_allocators])
+
+
+def hook(function):
+    """Decorator profiling function as stage of its name while profiling is enabled."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not current_profile['modes']:
+            return function(*args, **kwargs)
+        with profile_stage(function.__module__.split(".")[-1] + "." + function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def time_frame(stage, frame):
+    """Context manager keeping the wall time of rendering frame in stage every frame_sample_interval frames."""
+    if "frames" not in current_profile['modes']:
+        yield
+        return
+    frame_counts = current_profile['frame_counts']
+    frame_counts[stage] = frame_counts.get(stage, 0) + 1
+    if (frame_counts[stage] - 1) % frame_sample_interval:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        current_profile['frames'].append((stage, frame, time.perf_counter() - start_time))
+
+
+def format_frame_times(frames):
+    """Returns sampled wall times per frame and their mean, median and max per stage as str."""
+    lines = []
+    for stage in dict.fromkeys(sampled_stage for sampled_stage, _, _ in frames):
+        durations = [duration for sampled_stage, _, duration in frames if sampled_stage == stage]
+        lines.append(f'{stage}: {len(durations)} frames, mean {statistics.mean(durations):.2f} s, '
+                     f'median {statistics.median(durations):.2f} s, max {max(durations):.2f} s')
+        lines.extend(f'    frame {frame}: {duration:.2f} s' for sampled_stage, frame, duration in frames
+                     if sampled_stage == stage)
+    return "\n".join(lines) + "\n"
+
+
+def format_stats(prof_file, number_lines=30):
+    """Returns the number_lines functions of cProfile dump prof_file with the highest cumulative time as str."""
+    stream = io.StringIO()
+    pstats.Stats(prof_file, stream=stream).sort_stats("cumulative").print_stats(number_lines)
+    return stream.getvalue()
+
+
+if __name__ == "__main__":
+    # python -m scripts.profiling data/profiles/<run>.prof prints the hotspots of a cProfile dump
+    print(format_stats(sys.argv[1]))
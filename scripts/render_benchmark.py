@@ -0,0 +1,78 @@
+import bpy
+import os, sys, json, time, logging, importlib, argparse
+from datetime import datetime
+from . import gt_rendering
+importlib.reload(gt_rendering)
+"""Benchmark of render profiles on a fixed reference city, reporting seconds per frame and images per hour."""
+
+
+def get_benchmark_frames(number_frames):
+    """Returns number_frames frames evenly spaced between start and end frame of the scene."""
+    scene = bpy.context.scene
+    if number_frames <= 1:
+        return [scene.frame_start]
+    step = (scene.frame_end - scene.frame_start) / (number_frames - 1)
+    return sorted({scene.frame_start + round(i * step) for i in range(number_frames)})
+
+
+def benchmark_profile(reference_file, render_profile, frames, output_dir):
+    """Reopens reference_file, renders frames under render_profile and returns dict with its throughput."""
+    bpy.ops.wm.open_mainfile(filepath=reference_file, load_ui=False)
+    scene = bpy.context.scene
+    if scene.camera is None:
+        raise RuntimeError(f"Reference city {reference_file} has no camera, use a current_city.blend of a run.")
+    gt_rendering.set_render_settings(render_profile)
+    durations = []
+    for frame in frames:
+        scene.frame_set(frame)
+        scene.render.filepath = os.path.join(output_dir, str(render_profile) + "_" + str(frame) + ".png")
+        start_time = time.perf_counter()
+        bpy.ops.render.render(write_still=True)
+        durations.append(time.perf_counter() - start_time)
+    seconds_per_frame = sum(durations) / len(durations)
+    return {'profile': render_profile, 'reference': os.path.basename(reference_file), 'frames': frames,
+            'resolution': [scene.render.resolution_x, scene.render.resolution_y],
+            'first_frame': durations[0], 'seconds_per_frame': seconds_per_frame,
+            'images_per_hour': 3600 / seconds_per_frame, 'cpu_count': os.cpu_count(),
+            'blender': bpy.app.version_string, 'date': datetime.now().isoformat()}
+
+
+def run_benchmark(reference_file, render_profiles, number_frames, output_dir, benchmark_file):
+    """Benchmarks render_profiles on the same frames of reference_file, appends one JSON line per profile to
+    benchmark_file and returns the results."""
+    os.makedirs(output_dir, exist_ok=True)
+    bpy.ops.wm.open_mainfile(filepath=reference_file, load_ui=False)
+    frames = get_benchmark_frames(number_frames)
+    results = []
+    for render_profile in render_profiles:
+        result = benchmark_profile(reference_file, render_profile, frames, output_dir)
+        logging.info(f'benchmark: {result}')
+        with open(benchmark_file, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        results.append(result)
+    print(format_results(results))
+    return results
+
+
+def format_results(results):
+    """Returns table of profiles with their seconds per frame and images per hour."""
+    lines = [f'{"profile":<16}{"first frame [s]":>18}{"s/frame":>12}{"images/h":>12}']
+    for result in results:
+        lines.append(f'{str(result["profile"]):<16}{result["first_frame"]:>18.1f}{result["seconds_per_frame"]:>12.1f}'
+                     f'{result["images_per_hour"]:>12.1f}')
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    """Parses arguments given to the benchmark after '--' on the Blender command line."""
+    argv = sys.argv if argv is None else argv
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(description="Benchmark render profiles on the opened reference city.")
+    parser.add_argument("--profiles", nargs="+", default=list(gt_rendering.render_profiles),
+                        help="names of profiles in gt_rendering.render_profiles")
+    parser.add_argument("--frames", type=int, default=5, help="number of frames evenly spaced over the animation")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,139 @@
+import os, json, shutil
+from contextlib import contextmanager
+from datetime import datetime
+"""Checkpoint of a run in its current_run directory, so that a run interrupted by a crash or preemption resumes at its
+first unfinished frame instead of starting over."""
+
+state_file_name = "run_state.json"
+journal_file_name = "journal.jsonl"
+plan_file_name = "plan.pkl"
+
+
+@contextmanager
+def atomic_write(path):
+    """Context manager yielding a temporary path next to path, with the same extension, that is renamed to path once
+    the body has written it, so that a crash or a concurrent reader never sees a truncated or partial file or
+    directory at path. The temporary file or directory is removed if the body or the rename fails."""
+    root, extension = os.path.splitext(path)
+    tmp_path = root + ".tmp" + str(os.getpid()) + extension
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        elif os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+
+class RunCheckpoint:
+    """State of a run, i.e. its job, city, seed and frames, and a journal with one line per completed step of a frame,
+    e.g. 'gt', 'image' or 'stored', listing the files written by the step with their sizes. A step counts as done only
+    while all its files exist with the journaled sizes, so that lost or truncated outputs are produced again.
+
+    Attributes
+    ----------
+    current_run_base_dir    :   str
+        Path of directory with ground truth of current run, holding run_state.json and journal.jsonl.
+    state   :   dict
+        State of the run, None if no run was started.
+    journal :   dict
+        Maps (frame, step) to journaled entry with dict 'files' of paths and sizes of files written by the step and
+        further results of the step, e.g. 'allowed'. Shard processes keep their own journal file, see shard_rendering.
+
+    Methods
+    -------
+    start(job, **state)
+        Starts checkpoint of a new run of job, discarding the journal of the previous run.
+    is_resumable(job)
+        True if an unfinished run of job was interrupted.
+    update(**state)
+        Adds entries to the state of the run.
+    add(frame, step, paths, **fields)
+        Journals step of frame as done with the files it wrote and its results.
+    is_done(frame, step)
+        True if step of frame is journaled and its files are intact.
+    finish()
+        Marks run as finished, so that it is not resumed.
+    """
+    def __init__(self, current_run_base_dir, journal_file=journal_file_name):
+        self.current_run_base_dir = current_run_base_dir
+        self.state_path = os.path.join(current_run_base_dir, state_file_name)
+        self.journal_path = os.path.join(current_run_base_dir, journal_file)
+        self.state = self.load_state()
+        self.journal = self.load_journal()
+
+    def load_state(self):
+        if not os.path.isfile(self.state_path):
+            return None
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def load_journal(self):
+        journal = {}
+        if not os.path.isfile(self.journal_path):
+            return journal
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line truncated by a crash
+                    continue
+                journal[(entry.pop('frame'), entry.pop('step'))] = entry
+        return journal
+
+    def write_state(self):
+        with atomic_write(self.state_path) as tmp_path, open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=4)
+
+    def start(self, job, **state):
+        os.makedirs(self.current_run_base_dir, exist_ok=True)
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal = {}
+        self.state = dict(state, job=json.loads(json.dumps(job)), started=datetime.now().isoformat(), finished=False)
+        self.write_state()
+
+    def is_resumable(self, job):
+        """True if an unfinished run of job, compared as JSON, was interrupted."""
+        return self.state is not None and not self.state['finished'] and \
+            self.state['job'] == json.loads(json.dumps(job))
+
+    def update(self, **state):
+        self.state.update(state)
+        self.write_state()
+
+    def add(self, frame, step, paths, **fields):
+        """Journals step of frame as done with the files in paths it wrote and fields, e.g. its filtering decision.
+        The line is flushed to disk before the next step starts."""
+        entry = dict(fields, files={path: os.path.getsize(path) for path in paths})
+        self.journal[(frame, step)] = entry
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(dict(entry, frame=frame, step=step)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_done(self, frame, step):
+        entry = self.journal.get((frame, step))
+        if entry is None:
+            return False
+        return all(os.path.isfile(path) and os.path.getsize(path) == size for path, size in entry['files'].items())
+
+    def get_entry(self, frame, step):
+        """Returns journaled entry of step of frame, empty if not journaled."""
+        return self.journal.get((frame, step), {})
+
+    def get_done_frames(self, frames, step):
+        """Returns frames, whose step is done."""
+        return [frame for frame in frames if self.is_done(frame, step)]
+
+    def finish(self):
+        self.update(finished=True)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,423 @@
+import os, pickle, time, logging, importlib, argparse
+import numpy as np
+from . import grid_interface
+from . import path_interface
+from . import collision_handler
+from . import traffic_simulation
+from . import layout_generator
+from . import frame_prefilter
+from . import metrics
+from . import run_checkpoint
+importlib.reload(grid_interface)
+importlib.reload(path_interface)
+importlib.reload(collision_handler)
+importlib.reload(traffic_simulation)
+importlib.reload(layout_generator)
+importlib.reload(frame_prefilter)
+importlib.reload(metrics)
+importlib.reload(run_checkpoint)
+"""Blender-free planning of cars, collision avoidance and rendering frames on grid defined in /data/grid"""
+
+# default maximal number of nodes of candidate paths per cell of the grid side lengths, bounding walks in circles
+max_path_length_factor = 2
+
+
+class PlannedCar:
+    """Planned movement of one car in city, independent of blender.
+
+    Attributes
+    ----------
+    model_index :   int
+        Index of the car's model in car_models_info.
+    main_object_name    :   str
+        Name of top-parent of blender-object, used to identify car in logs.
+    frames_per_node :   int
+        Number of frames the car needs to pass one node of its path with constant velocity.
+    nodes   :   Path
+        Array-backed path containing coords and momenta of nodes in order to model car's animation.
+    grid_path_coordinates   :
+        Grid coordinates of path.
+    node_frames :   np.ndarray of int
+        Timing profile with first frame per node and, as last element, the frame the car leaves the path. None for
+        constant velocity given by frames_per_node.
+
+    Methods
+    -------
+    get_frames_for_pos(node_index)
+        Returns interval of frames, in which the car will be in the node of given index of its path
+    get_pos_for_frame(frame)
+        Returns index of path-node the car is in in given frame
+    get_node_frames()
+        Returns first frame per node of path and the frame the car leaves the path.
+    get_pos_for_frames(frames)
+        Vectorised get_pos_for_frame.
+    update_grid_path()
+        Sets grid path taken from nodes' coordinates.
+    predict_movement_at_pos(pos)
+        Returns direction as str, depending on momenta of node with index pos and pos+1
+    predict_movements()
+        Returns predict_movement_at_pos for all positions but the last.
+    truncate(length)
+        Truncates path and timing profile to given number of nodes.
+    """
+    def __init__(self, main_object_name, model_index=None, frames_per_node=1, nodes=None):
+        self.model_index = model_index
+        self.main_object_name = main_object_name
+        self.frames_per_node = frames_per_node
+        self.nodes = nodes
+        self.grid_path_coordinates = None
+        self.node_frames = None
+        self.update_grid_path()
+
+    def get_frames_for_pos(self, node_index):
+        """Returns interval of frames, in which the car will be in the node of given index of its path"""
+        if self.node_frames is not None:
+            return list(range(self.node_frames[node_index], self.node_frames[node_index + 1]))
+        # Definite frames by linear velocity approximation
+        frames = [self.frames_per_node * node_index + i for i in range(self.frames_per_node)]
+        # puffer frames
+        #frames.insert(0, frames[0]-1)
+        #frames.insert(len(frames), frames[len(frames)-1]+1)
+        return frames
+
+    def get_pos_for_frame(self, frame):
+        """Returns index of node of path the car is in given frame"""
+        if self.node_frames is not None:
+            return int(np.searchsorted(self.node_frames, frame, side='right')) - 1
+        return frame // self.frames_per_node
+
+    def get_node_frames(self):
+        """Returns array with first frame per node of path and, as last element, the frame the car leaves the path."""
+        if self.node_frames is not None:
+            return np.array(self.node_frames)
+        return np.arange(len(self.nodes) + 1) * self.frames_per_node
+
+    def get_pos_for_frames(self, frames):
+        """Returns array with index of node of path the car is in for each of the given frames"""
+        if self.node_frames is not None:
+            return np.searchsorted(self.node_frames, frames, side='right') - 1
+        return np.asarray(frames) // self.frames_per_node
+
+    def update_grid_path(self):
+        """Set grid path from nodes"""
+        if not self.nodes:
+            return
+        self.grid_path_coordinates = self.nodes.grid_coordinates()
+
+    def truncate(self, length):
+        """Truncates path and timing profile to given number of nodes."""
+        self.nodes = self.nodes[:length]
+        if self.node_frames is not None:
+            self.node_frames = self.node_frames[:length + 1]
+        self.update_grid_path()
+
+    def predict_movement_at_pos(self, pos):
+        """Position is given as index of nodes. Turn is determined via cross product of momenta."""
+        if pos + 1 > len(self.nodes) - 1:
+            raise RuntimeError("Nothing to predict at end of path.")
+        momenta = self.nodes.momenta
+        z_comp_cross_product = momenta[pos, 0] * momenta[pos + 1, 1] - momenta[pos, 1] * momenta[pos + 1, 0]
+        if z_comp_cross_product < 0:
+            return "right"
+        if z_comp_cross_product > 0:
+            return "left"
+        return "straight"
+
+    def predict_movements(self):
+        """Vectorised predict_movement_at_pos over all positions but the last."""
+        return self.nodes.predict_movements()
+
+
+class ScenePlan:
+    """Outcome of planning a scene, handed to blender if render_worth.
+
+    Attributes
+    ----------
+    seed    :   int
+        Seed of the attempt that produced the plan.
+    grid    :   Grid
+        Grid the cars are planned on.
+    cars    :   list of PlannedCar
+        Cars with paths after collision avoidance, the first one carries the camera.
+    render_worth    :   bool
+        True if the planned scene passes the criteria of is_render_worth.
+    rendering_frames    :   list of int
+        Frames to be rendered.
+    end_frame   :   int
+        Last frame of the animation.
+    attempts    :   int
+        Number of planning attempts needed.
+    """
+    def __init__(self, seed, grid, cars, render_worth=False, rendering_frames=None, end_frame=0, attempts=1):
+        self.seed = seed
+        self.grid = grid
+        self.cars = cars
+        self.render_worth = render_worth
+        self.rendering_frames = rendering_frames if rendering_frames is not None else []
+        self.end_frame = end_frame
+        self.attempts = attempts
+
+
+def get_default_max_path_length(grid, min_path_length=0):
+    """Returns max_path_length_factor times the sum of the side lengths of grid, but at least enough nodes for a path of
+    min_path_length."""
+    return max(max_path_length_factor * sum(grid.grid_size), min_path_length + 1)
+
+
+def plan_cars(grid, car_models_info, rng, number_cars=5, min_number_cars=4, min_path_length=5, render_steps=1,
+              number_candidate_paths=200, max_path_length=None, border_bias=0.0, simulate_traffic=False,
+              max_wait_frames=30, seed=None, camera_data=None):
+    """Plans one scene: chooses models, velocities and paths of cars and truncates paths to avoid collisions, or lets
+    cars wait for each other in a traffic simulation.
+
+    Parameters
+    ----------
+    grid    :   Grid
+        Grid with precomputed road index and distance fields.
+    car_models_info : list of dict
+        Each dict contains "file path" to .blend file of model, "main object name" of top parent and "scaling factor".
+    rng :   np.random.Generator
+        Random generator used for choosing models, velocities and paths.
+    simulate_traffic    :   bool
+        If True, cars keep their paths and wait at occupied cells and crossings in a TrafficSimulation, which sets
+        their timing profiles. Else paths are truncated before the first collision.
+    max_wait_frames :   int
+        Number of frames a car waits in the traffic simulation before it parks.
+    max_path_length :   int
+        Maximal number of nodes of candidate paths, None for get_default_max_path_length of grid.
+    seed    :   int
+        Seed of rng, stored in the plan to reproduce it.
+    camera_data :   dict
+        Content of camera.json and image_size, see frame_prefilter.get_allowed_frames. If given, rendering frames are pre-filtered geometrically by
+        frame_prefilter.get_allowed_frames and the plan is not worth rendering if none remain.
+
+    For the remaining parameters see car_handler.add_cars_to_city.
+
+    Returns
+    -------
+    ScenePlan
+        Planned scene, with render_worth False and without rendering frames if it is not worth rendering.
+    """
+    if max_path_length is None:
+        max_path_length = get_default_max_path_length(grid, min_path_length)
+    border_streets = grid_interface.get_border_streets(grid)
+    available_start_points = border_streets[:]
+    number_start_points = len(available_start_points)
+    logging.debug('available_start_points: %s', available_start_points)
+
+    # choosing cars from car models
+    cars = [PlannedCar(car_models_info[i]['main object name'], model_index=int(i))
+            for i in rng.integers(len(car_models_info), size=number_cars)]
+    for car in cars:
+        car.frames_per_node = int(rng.integers(1, 6))
+    # test to accelerate generation
+    cars[0].frames_per_node = 3
+
+    # set random paths picked from pool of candidates
+    candidate_paths = path_interface.sample_random_paths(grid, rng, number_candidate_paths, available_start_points,
+                                                         min_length=min_path_length + 1, max_length=max_path_length,
+                                                         border_bias=border_bias)
+    for i, car in enumerate(cars):
+        car.nodes = pick_candidate_path(candidate_paths, available_start_points,
+                                        min_path_length=min_path_length if i == 0 else 0)
+        if not car.nodes:
+            logging.info(f'no candidate path left for car {car.main_object_name}')
+            continue
+        car.update_grid_path()
+
+        # whole paths are only formatted if debug output is enabled
+        logging.info('added car %s, frames_per_node: %d, %d nodes', car.main_object_name, car.frames_per_node,
+                     len(car.nodes))
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f'path coord: {car.nodes.coords.tolist()}, '
+                          f'momentum coord: {car.nodes.momenta.tolist()}, '
+                          f'at frames: {car.get_node_frames()[:-1].tolist()}, '
+                          f'takes turns: {car.predict_movements()[1:]}')
+
+        if not available_start_points:
+            break
+
+    # reduce list to cars with paths
+    cars = [car for car in cars if car.nodes]
+    logging.info(f'{len(cars)} cars with paths before avoid collisions')
+
+    with metrics.measure('collision_resolution', simulate_traffic=simulate_traffic, number_cars=len(cars)):
+        if simulate_traffic:
+            # let cars wait for each other, prior cars taking priority
+            traffic_simulation.TrafficSimulation(cars, grid, max_wait_frames=max_wait_frames).run()
+        else:
+            # truncate to avoid collisions with cars accepted before
+            occupancy_index = collision_handler.OccupancyIndex()
+            for i, car in enumerate(cars):
+                if i > 0:
+                    collision_handler.avoid_collisions(car, occupancy_index)
+                occupancy_index.add(car)
+
+    # reduce to cars with a minimal path length of 2
+    cars = [car for car in cars if len(car.nodes) > 1]
+    logging.info(f'{len(cars)} cars with paths after avoid collisions')
+
+    if not is_render_worth(cars, min_number_cars, number_start_points, min_path_length):
+        return ScenePlan(seed, grid, cars)
+    end_frame, rendering_frames = get_rendering_frames(cars[0], render_steps)
+    if camera_data is not None:
+        camera_height = car_models_info[cars[0].model_index]['camera_pos'][2]
+        rendering_frames = frame_prefilter.get_allowed_frames(cars, grid, rendering_frames, camera_data, camera_height)
+        if not rendering_frames:
+            return ScenePlan(seed, grid, cars)
+    return ScenePlan(seed, grid, cars, render_worth=True, rendering_frames=rendering_frames, end_frame=end_frame)
+
+
+def is_render_worth(cars, min_number_cars, number_start_points, min_path_length):
+    """True if planned cars exceed minimum number and half of the initially available start points and the ego path
+    is longer than min_path_length and takes at least one turn."""
+    if len(cars) < min_number_cars or len(cars) <= number_start_points / 2 or len(cars[0].nodes) <= min_path_length or \
+            all(["straight" == movement for movement in cars[0].predict_movements()[1:]]):
+        return False
+    return True
+
+
+def get_rendering_frames(ego_car, render_steps=1):
+    """Returns end frame and rendering frames of car carrying camera, rendered till last turn to avoid depicting the
+    city edge."""
+    node_frames = ego_car.get_node_frames().tolist()
+    end_frame = node_frames[len(ego_car.nodes) - 1]
+    nodes_of_turns = [i for i, movement in enumerate(ego_car.predict_movements()) if i > 0 and movement != "straight"]
+    if nodes_of_turns:
+        end_frame = node_frames[nodes_of_turns[-1]]
+    logging.info(f'end_frame: {end_frame}, nodes of turns: {nodes_of_turns}')
+    rendering_frames = list(range(node_frames[1], end_frame, render_steps))
+    return end_frame, rendering_frames
+
+
+def plan_scene(grid, car_models_info, seed=None, max_attempts=20, grid_loader=None, attempts_per_grid=5, **kwargs):
+    """Retries plan_cars with new seeds, and new grids from grid_loader if given, until a plan is render_worth.
+
+    Parameters
+    ----------
+    grid    :   Grid
+        Grid to start planning on.
+    car_models_info : list of dict
+        See plan_cars.
+    seed    :   int
+        Seed of the first attempt, seeds of further attempts are derived from it. None draws a fresh seed.
+    max_attempts    :   int
+        Maximal number of attempts.
+    grid_loader :   callable
+        Called without arguments to get a new Grid after attempts_per_grid failed attempts on the current one. None
+        keeps the grid for all attempts.
+    attempts_per_grid   :   int
+        Number of attempts on one grid before asking grid_loader for a new one.
+    kwargs  :
+        Passed to plan_cars.
+
+    Returns
+    -------
+    ScenePlan
+        First render_worth plan or the plan of the last attempt.
+    """
+    start_time = time.time()
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    # seeds of further attempts derived from seed, so that the first attempt is reproduced by seed alone
+    seeds = [seed] + np.random.SeedSequence(seed).generate_state(max_attempts - 1, dtype=np.uint64).tolist()
+    plan = None
+    for attempt, attempt_seed in enumerate(seeds, start=1):
+        if grid_loader is not None and attempt > 1 and (attempt - 1) % attempts_per_grid == 0:
+            grid = grid_loader()
+            logging.info(f'loaded new grid of size {grid.grid_size}')
+        logging.info(f'planning attempt {attempt}, seed: {attempt_seed}')
+        with metrics.measure('planning_attempt', attempt=attempt) as fields:
+            plan = plan_cars(grid, car_models_info, np.random.default_rng(attempt_seed), seed=attempt_seed, **kwargs)
+            fields.update(render_worth=plan.render_worth, number_cars=len(plan.cars),
+                          frames=len(plan.rendering_frames))
+        plan.attempts = attempt
+        if plan.render_worth:
+            break
+    logging.info(f'planned scene with render_worth {plan.render_worth} after {plan.attempts} attempts - '
+                 f'execution Time: {time.time() - start_time} s')
+    return plan
+
+
+def pick_candidate_path(candidate_paths, available_start_points, min_path_length=0):
+    """Removes and returns first candidate path starting at an available start point, whose start point is removed.
+
+    Candidates longer than min_path_length and taking at least one turn are preferred. Returns None if no
+    candidate starts at an available start point.
+    """
+    available = [i for i, path in enumerate(candidate_paths)
+                 if path is not None and tuple(path.coords[0].tolist()) in available_start_points]
+    if not available:
+        return None
+    if min_path_length:
+        preferred = [i for i in available if len(candidate_paths[i]) > min_path_length
+                     and any(movement != "straight" for movement in candidate_paths[i].predict_movements()[1:])]
+        available = preferred or available
+    path = candidate_paths.pop(available[0])
+    available_start_points.remove(tuple(path.coords[0].tolist()))
+    return path
+
+
+def save_plan(plan, data_dir, plan_file="plan.pkl"):
+    """Saves plan in data_dir, next to grid, see run_checkpoint.atomic_write."""
+    with run_checkpoint.atomic_write(os.path.join(data_dir, plan_file)) as tmp_path, open(tmp_path, 'wb') as f:
+        pickle.dump(plan, f)
+
+
+def load_plan(data_dir, plan_file="plan.pkl"):
+    """Returns plan saved in data_dir, None if there is none."""
+    plan_path = os.path.join(data_dir, plan_file)
+    if not os.path.isfile(plan_path):
+        return None
+    return pickle.load(open(plan_path, "rb"))
+
+
+if __name__ == "__main__":
+    # python -m scripts.scene_planner data ... plans on grid in data outside of blender and saves accepted plans
+    parser = argparse.ArgumentParser(description="Plans cars on grid in data_dir until the scene is worth rendering.")
+    parser.add_argument("data_dir")
+    parser.add_argument("--car-models-info", default=None,
+                        help="Path to .json list of car_models_info dicts. Defaults to a single placeholder model.")
+    parser.add_argument("--number-cars", type=int, default=10)
+    parser.add_argument("--min-number-cars", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-attempts", type=int, default=20)
+    parser.add_argument("--camera-json", default=None,
+                        help="Path to camera.json, pre-filters rendering frames geometrically if given.")
+    parser.add_argument("--image-size", type=int, nargs=2, default=None, metavar=("W", "H"),
+                        help="Resolution of rendered images, required with --camera-json.")
+    parser.add_argument("--generate-grid", type=int, nargs=2, default=None, metavar=("N", "M"),
+                        help="Plan on generated layouts of given size instead of grid in data_dir and save the "
+                             "layout of the accepted plan in data_dir/grid.")
+    args = parser.parse_args()
+    if args.camera_json and not args.image_size:
+        parser.error("--camera-json requires --image-size")
+    logging.basicConfig(level=logging.INFO)
+    # plan with classes of the imported module, so that saved plans unpickle outside of __main__
+    planner = importlib.import_module(__spec__.name)
+    if args.car_models_info:
+        import json
+        with open(args.car_models_info) as f:
+            models_info = json.load(f)
+    else:
+        models_info = [{'main object name': "Car", 'camera_pos': (0, 0, 0.15)}]
+    grid_loader = None
+    if args.generate_grid:
+        grid_loader = layout_generator.get_grid_loader(np.random.default_rng(args.seed), tuple(args.generate_grid))
+        first_grid = grid_loader()
+    else:
+        first_grid = grid_interface.get_grid_from_data(args.data_dir)
+    camera = None
+    if args.camera_json:
+        import json
+        with open(args.camera_json) as f:
+            camera = dict(json.load(f), image_size=tuple(args.image_size))
+    scene_plan = planner.plan_scene(first_grid, models_info, seed=args.seed, max_attempts=args.max_attempts,
+                                    grid_loader=grid_loader, number_cars=args.number_cars,
+                                    min_number_cars=args.min_number_cars, camera_data=camera)
+    if scene_plan.render_worth:
+        if args.generate_grid:
+            grid_interface.save_grid_data(scene_plan.grid.data, args.data_dir)
+        planner.save_plan(scene_plan, args.data_dir)
+    print(f'render_worth: {scene_plan.render_worth}, seed: {scene_plan.seed}, attempts: {scene_plan.attempts}')
+    raise SystemExit(0 if scene_plan.render_worth else 1)
@@ -0,0 +1,107 @@
+import bpy
+import sys, json, time, logging, resource, argparse
+"""Long-lived worker, that generates many scenes in one Blender session instead of starting Blender once per run."""
+
+# growth of resident memory in MB after which a warning about leaking data is logged
+rss_growth_warning = 500
+
+# prefix of lines on stdout reporting the result of a job to scripts/orchestrator.py
+result_prefix = "CITYNTHESIZER_RESULT "
+
+
+def get_rss():
+    """Returns current resident set size of the process in MB, falls back to its peak if /proc is not available."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_scene(base_blend_file):
+    """Reopens base_blend_file without its UI, which frees all data-blocks of the previous job. Python modules, enabled
+    add-ons and compiled state of the session are kept. Memory not freed this way, e.g. leaked by add-ons or Python
+    references to old data, is detected by the RSS growth logged by run_jobs."""
+    bpy.ops.wm.open_mainfile(filepath=base_blend_file, load_ui=False)
+
+
+def read_jobs(jobs_file=None, runs=1):
+    """Returns list of job dicts, one per line of JSON-lines jobs_file, else runs empty jobs using the defaults. With
+    jobs_file '-' jobs are read from stdin one at a time until it is closed, as handed out by scripts/orchestrator.py."""
+    if jobs_file is None:
+        return [{} for _ in range(runs)]
+    if jobs_file == "-":
+        return (json.loads(line) for line in sys.stdin if line.strip())
+    with open(jobs_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def print_result(result):
+    """Reports result of a job on stdout, Blender's own output is ignored by the orchestrator."""
+    print(result_prefix + json.dumps(result), flush=True)
+
+
+def run_jobs(jobs, run, base_blend_file, report=None):
+    """Runs jobs one after the other in the current Blender session, resetting the scene in between.
+
+    Parameters
+    ----------
+    jobs    :   iterable of dict
+        Parameters per scene, passed to run.
+    run :   function
+        Generates one scene from a job dict and returns render_worth, e.g. run of setup.py.
+    base_blend_file :   str
+        Path of .blend file every job starts from, e.g. standard.blend.
+    report  :   function
+        Called with the result of each job once it finished, e.g. print_result.
+
+    Returns
+    -------
+    list of dict
+        Per job its index, whether it succeeded, render_worth, duration in s and RSS in MB after reset.
+    """
+    results = []
+    base_rss = None
+    for i, job in enumerate(jobs):
+        reset_scene(base_blend_file)
+        rss = get_rss()
+        if base_rss is None:
+            base_rss = rss
+        logging.info(f'worker job {i+1}: {job}, RSS {rss:.0f} MB ({rss - base_rss:+.0f} MB since first job)')
+        if rss - base_rss > rss_growth_warning:
+            logging.warning(f'RSS grew by {rss - base_rss:.0f} MB over {i} jobs, data of finished jobs may leak')
+        start_time = time.time()
+        result = {'job': i, 'succeeded': False, 'render_worth': False, 'rss': rss}
+        try:
+            result['render_worth'] = bool(run(job))
+            result['succeeded'] = True
+        except Exception:
+            # a failed scene must not end the session, remaining jobs start from a fresh scene
+            logging.exception(f'worker job {i+1} failed')
+        result['duration'] = time.time() - start_time
+        results.append(result)
+        if report is not None:
+            report(result)
+    reset_scene(base_blend_file)
+    final_rss = get_rss()
+    logging.info(f'worker finished {sum(result["succeeded"] for result in results)}/{len(results)} jobs, '
+                 f'RSS {final_rss:.0f} MB ({final_rss - (base_rss or final_rss):+.0f} MB since first job)')
+    return results
+
+
+def parse_args(argv=None):
+    """Parses arguments given to the worker after '--' on the Blender command line."""
+    argv = sys.argv if argv is None else argv
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(description="Generate several scenes in one Blender session.")
+    parser.add_argument("--jobs", default=None, help="JSON-lines file with one dict of run parameters per scene, "
+                                                     "'-' reads them from stdin")
+    parser.add_argument("--runs", type=int, default=1, help="number of scenes with default parameters, without --jobs")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    pass
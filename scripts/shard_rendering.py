@@ -0,0 +1,201 @@
+import os, sys, glob, json, time, shlex, signal, logging, argparse, subprocess
+from . import run_checkpoint
+"""Frame-sharded rendering of one scene, that splits the frames of current_city.blend into shards rendered by several
+Blender processes running render_shard.py, on one machine or via launchers on several machines with shared storage.
+Shards write into the current_run layout of the run and journal their frames separately, the journals are merged into
+the checkpoint of the run afterwards."""
+
+# render stages of a shard and the step journaled per frame, see gt_rendering.render_shard
+stage_steps = {'gt': 'gt', 'single_pass': 'gt', 'image': 'image'}
+
+# journal of shard i in current_run, e.g. journal_shard0.jsonl
+shard_journal_prefix = "journal_shard"
+
+# process group ids of the running shards of current_run, killed if the run is resumed while they are still alive
+shard_pids_file_name = "shard_pids.json"
+
+render_shard_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "render_shard.py")
+
+
+def get_shards(frames, number_shards):
+    """Returns list of number_shards lists of frames. Frames are dealt out in turn, so that every shard covers the
+    whole ego path and shards of scenes getting busier along the path take similarly long."""
+    return [frames[i::number_shards] for i in range(number_shards)]
+
+
+def get_journal_file_name(shard):
+    return shard_journal_prefix + str(shard) + ".jsonl"
+
+
+def merge_shard_journals(checkpoint):
+    """Journals steps of all shard journals in the current_run of checkpoint, whose files are intact, in checkpoint
+    and removes the shard journals. Returns number of merged steps."""
+    number_merged = 0
+    for journal_path in sorted(glob.glob(os.path.join(checkpoint.current_run_base_dir, shard_journal_prefix + "*"))):
+        shard_checkpoint = run_checkpoint.RunCheckpoint(checkpoint.current_run_base_dir,
+                                                        os.path.basename(journal_path))
+        for (frame, step), entry in shard_checkpoint.journal.items():
+            if shard_checkpoint.is_done(frame, step) and not checkpoint.is_done(frame, step):
+                fields = {name: value for name, value in entry.items() if name != 'files'}
+                checkpoint.add(frame, step, list(entry['files']), **fields)
+                number_merged += 1
+        os.remove(journal_path)
+    return number_merged
+
+
+def kill_shard(pid):
+    """Kills the process group of the shard started as pid, i.e. its launcher and all processes started by it."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def is_shard_process(pid):
+    """True if process pid is still a shard running render_shard.py, so that a reused pid is never killed."""
+    try:
+        with open(os.path.join("/proc", str(pid), "cmdline"), "rb") as f:
+            return render_shard_script.encode() in f.read()
+    except OSError:
+        return False
+
+
+def write_shard_pids(current_run_base_dir, pids):
+    """Writes pids of the running shards, see run_checkpoint.atomic_write."""
+    path = os.path.join(current_run_base_dir, shard_pids_file_name)
+    with run_checkpoint.atomic_write(path) as tmp_path, open(tmp_path, "w") as f:
+        json.dump(pids, f)
+
+
+def kill_stale_shards(current_run_base_dir):
+    """Kills shards of an interrupted run still writing to current_run_base_dir, e.g. if the worker of the run was
+    killed by the orchestrator, since shards run in their own sessions. Returns number of killed shards."""
+    path = os.path.join(current_run_base_dir, shard_pids_file_name)
+    if not os.path.isfile(path):
+        return 0
+    try:
+        with open(path) as f:
+            pids = json.load(f)
+    except ValueError:
+        pids = []
+    stale_pids = [pid for pid in pids if is_shard_process(pid)]
+    for pid in stale_pids:
+        logging.warning(f'killing shard process group {pid} of an interrupted run')
+        kill_shard(pid)
+    os.remove(path)
+    return len(stale_pids)
+
+
+def get_shard_command(blender, blend_file, current_run_base_dir, data_dir, frames, stage, shard, render_profile,
+                      launcher=None):
+    """Returns command starting a headless Blender process on blend_file rendering stage of frames as shard. launcher,
+    e.g. ['ssh', 'node1'], is prepended to run the process on another machine sharing the paths. Its arguments are then
+    quoted, since remote launchers like ssh pass them through a shell, e.g. a JSON render_profile or paths with spaces."""
+    command = [
+        blender, blend_file, "-b", "-P", render_shard_script, "--", "--current-run-dir", current_run_base_dir,
+        "--data-dir", data_dir, "--stage", stage, "--shard", str(shard), "--render-profile",
+        render_profile if isinstance(render_profile, str) else json.dumps(render_profile),
+        "--frames"] + [str(frame) for frame in frames]
+    if not launcher:
+        return command
+    return list(launcher) + [shlex.quote(argument) for argument in command]
+
+
+def render_shards(blender, blend_file, checkpoint, data_dir, frames, stage, number_shards, render_profile,
+                  launchers=None, timeout=None):
+    """Renders stage of frames of blend_file in number_shards parallel Blender processes and merges their journals
+    into checkpoint.
+
+    Parameters
+    ----------
+    blender :   str
+        Path of blender executable, e.g. bpy.app.binary_path.
+    blend_file  :   str
+        Path of saved scene, i.e. current_city.blend.
+    checkpoint  :   RunCheckpoint
+        Checkpoint of the run, whose current_run_base_dir the shards write to.
+    data_dir    :   str
+        Path of data directory with legends and camera.json.
+    frames  :   list of int
+        Frames to render, frames already journaled in checkpoint are skipped.
+    stage   :   str
+        One of stage_steps.
+    number_shards   :   int
+        Number of Blender processes.
+    render_profile  :   str or dict
+        Render profile of the shards, see gt_rendering.set_render_settings.
+    launchers   :   list of list of str
+        Command prefixes assigned to the shards in turn, e.g. [['ssh', 'node1'], ['ssh', 'node2']], that run the
+        quoted command through a shell. None runs all shards on this machine.
+    timeout :   float
+        Maximal duration of the shards in s, after which remaining process groups are killed. None for no limit.
+
+    Returns
+    -------
+    list of int
+        Frames not rendered by the shards, e.g. of crashed processes, which are left to the caller.
+    """
+    step = stage_steps[stage]
+    # shards and journals of an interrupted run
+    kill_stale_shards(checkpoint.current_run_base_dir)
+    merge_shard_journals(checkpoint)
+    frames = [frame for frame in frames if not checkpoint.is_done(frame, step)]
+    start_time = time.time()
+    processes = []
+    try:
+        for shard, shard_frames in enumerate(get_shards(frames, number_shards)):
+            if not shard_frames:
+                continue
+            launcher = launchers[shard % len(launchers)] if launchers else None
+            command = get_shard_command(blender, blend_file, checkpoint.current_run_base_dir, data_dir, shard_frames,
+                                        stage, shard, render_profile, launcher)
+            with open(os.path.join(checkpoint.current_run_base_dir, "shard" + str(shard) + ".log"), "a") as log_file:
+                # own session, so that the whole process group of the shard can be killed
+                processes.append((shard, subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log_file,
+                                                          stderr=subprocess.STDOUT, start_new_session=True)))
+            write_shard_pids(checkpoint.current_run_base_dir, [process.pid for _, process in processes])
+        logging.info(f'rendering {stage} of {len(frames)} frames in {len(processes)} shards')
+        for shard, process in processes:
+            try:
+                remaining = None if timeout is None else max(timeout - (time.time() - start_time), 0)
+                return_code = process.wait(timeout=remaining)
+            except subprocess.TimeoutExpired:
+                logging.warning(f'shard {shard} exceeded timeout of {timeout} s')
+                kill_shard(process.pid)
+                return_code = process.wait()
+            if return_code:
+                logging.warning(f'shard {shard} exited with {return_code}')
+    finally:
+        # shards left running by an exception, e.g. KeyboardInterrupt
+        for shard, process in processes:
+            if process.poll() is None:
+                kill_shard(process.pid)
+                process.wait()
+        if os.path.isfile(os.path.join(checkpoint.current_run_base_dir, shard_pids_file_name)):
+            os.remove(os.path.join(checkpoint.current_run_base_dir, shard_pids_file_name))
+    number_merged = merge_shard_journals(checkpoint)
+    missing_frames = [frame for frame in frames if not checkpoint.is_done(frame, step)]
+    logging.info(f'{len(processes)} shards rendered {number_merged} frames in {time.time() - start_time:.0f} s, '
+                 f'{len(missing_frames)} frames missing')
+    return missing_frames
+
+
+def parse_args(argv=None):
+    """Parses arguments given to render_shard.py after '--' on the Blender command line."""
+    argv = sys.argv if argv is None else argv
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(description="Render a shard of the frames of a saved scene.")
+    parser.add_argument("--current-run-dir", required=True, help="current_run directory of the run")
+    parser.add_argument("--data-dir", required=True, help="data directory with legends and camera.json")
+    parser.add_argument("--stage", required=True, choices=list(stage_steps))
+    parser.add_argument("--shard", type=int, required=True, help="index of the shard, names its journal")
+    parser.add_argument("--render-profile", default="gpu_cuda", help="name of render profile or profile as JSON")
+    parser.add_argument("--frames", type=int, nargs="+", required=True)
+    args = parser.parse_args(argv)
+    if args.render_profile.startswith("{"):
+        args.render_profile = json.loads(args.render_profile)
+    return args
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,143 @@
+import importlib, logging
+import numpy as np
+from . import collision_handler
+importlib.reload(collision_handler)
+"""Time-stepped traffic simulation, in which cars wait for reserved cells instead of having their paths truncated."""
+
+
+def get_reservation_keys(car, intersection_cells):
+    """Returns per node of car the key of its cell reservation.
+
+    On roads the key is (coord, direction of travel), so that cars in opposite lanes pass each other, at T- and
+    X-crossings it is (coord, None), shared only by cars whose movements comply.
+    """
+    headings = np.sign(car.nodes.momenta)
+    if len(headings) > 1:
+        # first node has no momentum, car already faces the direction of its first step
+        headings[0] = headings[1]
+    return [(coord, None) if coord in intersection_cells else (coord, tuple(heading))
+            for coord, heading in zip(car.grid_path_coordinates, headings.tolist())]
+
+
+class TrafficSimulation:
+    """Steps cars frame by frame along their paths. A car enters its next node once it has spent frames_per_node frames
+    in the current one and the next cell is free, else it waits. The resulting timing profile is stored in node_frames
+    of each car.
+
+    Attributes
+    ----------
+    cars    :   list of PlannedCar
+        Cars with paths in order of priority, the first car always has priority.
+    keys    :   list of list
+        Reservation key per car and node, see get_reservation_keys.
+    reservations    :   dict
+        Maps reservation key to list of tuples (car index, node index) of cars holding it.
+    max_wait_frames :   int
+        Number of frames a car waits before it is considered stuck, e.g. in gridlock, and parks where it is.
+
+    Methods
+    -------
+    can_enter(car_index, pos)
+        True if car may enter node pos of its path.
+    run()
+        Simulates traffic until all cars left the city or parked and sets node_frames of cars.
+    """
+    def __init__(self, cars, grid, max_wait_frames=30):
+        self.cars = cars
+        intersection_cells = {tuple(coord) for coord in grid.road_cells[grid.intersections].tolist()}
+        self.keys = [get_reservation_keys(car, intersection_cells) for car in cars]
+        self.reservations = {}
+        self.max_wait_frames = max_wait_frames
+
+    def can_enter(self, car_index, pos):
+        """True if car may enter node pos of its path. On roads the lane has to be free, at crossings all cars in it have
+        to comply with the car's movement according to no_collision_while_driving, the prior car taking priority."""
+        key = self.keys[car_index][pos]
+        holders = self.reservations.get(key, [])
+        if not holders:
+            return True
+        if key[1] is not None:
+            return False
+        car = self.cars[car_index]
+        for holder_index, holder_pos in holders:
+            holder = self.cars[holder_index]
+            # cars at end of path collide
+            if pos + 2 > len(car.nodes) or holder_pos + 2 > len(holder.nodes):
+                return False
+            if holder_index < car_index:
+                complies = collision_handler.no_collision_while_driving(holder, holder_pos, car, pos)
+            else:
+                complies = collision_handler.no_collision_while_driving(car, pos, holder, holder_pos)
+            if not complies:
+                return False
+        return True
+
+    def reserve(self, car_index, pos):
+        self.reservations.setdefault(self.keys[car_index][pos], []).append((car_index, pos))
+
+    def release(self, car_index, pos):
+        self.reservations[self.keys[car_index][pos]].remove((car_index, pos))
+
+    def run(self):
+        """Simulates traffic until all cars left the city or parked and sets node_frames of cars.
+
+        Returns
+        -------
+        int
+            Number of cars that parked before the end of their path.
+        """
+        number_cars = len(self.cars)
+        pos = [-1] * number_cars
+        ready_frame = [0] * number_cars
+        waited = [0] * number_cars
+        node_frames = [[] for _ in range(number_cars)]
+        active = list(range(number_cars))
+        parked = 0
+        frame = 0
+        while active:
+            still_active = []
+            for i in active:
+                car = self.cars[i]
+                if frame < ready_frame[i]:
+                    still_active.append(i)
+                    continue
+                next_pos = pos[i] + 1
+                if next_pos == len(car.nodes):
+                    # car leaves the city at the border
+                    self.release(i, pos[i])
+                    node_frames[i].append(frame)
+                    continue
+                if self.can_enter(i, next_pos):
+                    if pos[i] >= 0:
+                        self.release(i, pos[i])
+                    self.reserve(i, next_pos)
+                    pos[i] = next_pos
+                    node_frames[i].append(frame)
+                    ready_frame[i] = frame + car.frames_per_node
+                    waited[i] = 0
+                    still_active.append(i)
+                    continue
+                waited[i] += 1
+                if waited[i] <= self.max_wait_frames:
+                    still_active.append(i)
+                    continue
+                # stuck, park at current node keeping its reservation, cars without a path of 2 nodes are dropped
+                parked += 1
+                node_frames[i].append(frame)
+                if pos[i] < 1:
+                    if pos[i] == 0:
+                        self.release(i, pos[i])
+                    node_frames[i] = [frame] * (pos[i] + 2)
+                car.node_frames = np.array(node_frames[i])
+                car.truncate(pos[i] + 1)
+            active = still_active
+            frame += 1
+        for i, car in enumerate(self.cars):
+            if len(node_frames[i]) == len(car.nodes) + 1:
+                car.node_frames = np.array(node_frames[i])
+        logging.info(f'simulated traffic of {number_cars} cars over {frame} frames, {parked} cars parked')
+        return parked
+
+
+if __name__ == "__main__":
+    pass
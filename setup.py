@@ -1,5 +1,6 @@
 import bpy
-import importlib, sys, os, logging
+import importlib, sys, os, logging, json
+import numpy as np
 from datetime import datetime
 
 blend_file_dir = os.path.dirname(bpy.data.filepath)
@@ -8,7 +9,13 @@ if blend_file_dir not in sys.path:
 
 import scripts.city_handler as city_handler
 import scripts.car_handler as car_handler
+import scripts.blender_car_interface as blender_car_interface
 import scripts.gt_rendering as gt_rendering
+import scripts.grid_interface as grid_interface
+import scripts.scene_planner as scene_planner
+import scripts.metrics as metrics
+import scripts.profiling as profiling
+import scripts.run_checkpoint as run_checkpoint
 
 
 #path_scene_city = os.path.join(blend_file_dir, "others", "SceneCity.zip")
@@ -19,19 +26,25 @@ bpy.ops.preferences.addon_enable(module='scenecity')
 # force reload
 importlib.reload(city_handler)
 importlib.reload(car_handler)
+importlib.reload(blender_car_interface)
 importlib.reload(gt_rendering)
+importlib.reload(grid_interface)
+importlib.reload(scene_planner)
+importlib.reload(metrics)
+importlib.reload(profiling)
+importlib.reload(run_checkpoint)
 
-data_dir = os.path.join(blend_file_dir, "data")
-logging.basicConfig(filename=os.path.join(data_dir, "runs.log"), filemode='a', level=logging.INFO)
-logging.info('Started run at ' + datetime.now().strftime("%d/%m/%Y %H:%M:%S"))
-
-# create city
+# parallel workers of scripts/orchestrator.py run in their own working directory, holding data incl. runs.log,
+# current_city.blend and current_run, while the CityScapes-format data set and city cache are shared
+work_dir = os.environ.get("CITYNTHESIZER_WORK_DIR", blend_file_dir)
+data_dir = os.path.join(work_dir, "data")
 HDRI_base_dir = os.path.join(blend_file_dir, "HDRI")
-sky_HDRI = "example.hdr"
+gt_base_dir = os.path.join(blend_file_dir, "ground_truth")
+current_run_base_dir = os.path.join(work_dir, "ground_truth", "current_run")
 
-city_handler.create_city(grid_size=(20, 20), road_bl_objects=city_handler.road_bl_objects,
-                         buildings_bl_objects=city_handler.buildings_bl_objects, data_dir=data_dir,
-                         HDRI_base_dir=HDRI_base_dir, sky_HDRI=sky_HDRI)
+# built cities are cached and reused by later runs, which then only plan and animate new traffic
+city_cache_dir = os.path.join(blend_file_dir, "city_cache")
+number_cached_cities = 10
 
 # Define metadata for car models. Structure should be of the form ./models/cars/Car0x.blend . 
 cars_base = os.path.join(blend_file_dir, "models", "cars")
@@ -42,19 +55,149 @@ cars_base = os.path.join(blend_file_dir, "models", "cars")
 #     {'file path': os.path.join(cars_base, "Car12.blend"), 'scaling factor': 0.12, 'main object name': "Chocofur_Free_Car_02", 'camera_pos': (0, 0, 0.15)}]
 car_models_info = []
 
-render_worth, rendering_frames = car_handler.add_cars_to_city(car_models_info=car_models_info, data_dir=data_dir,
-                                                              number_cars=10, min_number_cars=5)
+# parameters of a run, single entries can be overwritten per job of worker.py
+default_job = {'grid_size': (20, 20), 'sky_HDRI': "example.hdr", 'number_cars': 10, 'min_number_cars': 5,
+               'seed': None, 'test_perc': 0.5, 'val_perc': 0.0, 'number_of_frames': None, 'single_pass': False,
+               'probe_fraction': None, 'render_profile': 'gpu_cuda', 'profile': None, 'resume': True,
+               'render_shards': 1, 'shard_launchers': None, 'shard_timeout': None, 'simulate_traffic': True,
+               'max_planning_attempts': 20}
+
+# profiling hooks, e.g. 'cprofile,tracemalloc,frames', are set per job by 'profile' or else by CITYNTHESIZER_PROFILE
+profile_dir = os.path.join(data_dir, "profiles")
+
+
+def set_up_logging():
+    logging.basicConfig(filename=os.path.join(data_dir, "runs.log"), filemode='a', level=logging.INFO)
+
+
+def get_city_seed(seed):
+    """Returns one of number_cached_cities city seeds, derived from the seed of the job, so that a seeded job reuses the
+    same cached city. None draws a fresh city seed."""
+    return int(np.random.default_rng(seed).integers(number_cached_cities))
+
+
+def create_scene(job, checkpoint):
+    """Creates or loads city, plans and animates cars and saves the scene as current_city.blend. Starts checkpoint
+    with the plan of a scene worth rendering. Returns render_worth and rendering_frames.
+
+    If no scene worth rendering is planned on a new layout, planning continues on further layouts, of which the last
+    one is built. A cached city keeps its grid, as its roads and buildings are already instanced on it and a new layout
+    would mean building and storing another city under its key."""
+    grid_size = tuple(job['grid_size'])
+    sky_HDRI = job['sky_HDRI']
+    city_key = city_handler.get_city_key(grid_size, city_handler.road_bl_objects, city_handler.buildings_bl_objects,
+                                         sky_HDRI, city_seed=get_city_seed(job['seed']))
+    with metrics.measure('city_cache_load') as fields:
+        city_cached = city_handler.load_cached_city(city_cache_dir, city_key, data_dir)
+        fields['hit'] = city_cached
+    metrics.update_run(city_key=city_key, city_cached=city_cached)
+    layout = {}
+    if city_cached:
+        set_up_logging()
+        logging.info(f'loaded cached city {city_key}')
+    else:
+        # create city layout only, roads and buildings are instanced once a scene worth rendering is planned
+        with metrics.measure('city_layout'):
+            layout['nodetree'], layout['final_grid_node'] = city_handler.create_city_layout(grid_size=grid_size,
+                                                                                            data_dir=data_dir)
+
+    def load_new_grid():
+        # new layout replacing the one rejected by plan_scene
+        with metrics.measure('city_layout'):
+            layout['nodetree'], layout['final_grid_node'] = city_handler.create_city_layout(grid_size=grid_size,
+                                                                                            data_dir=data_dir,
+                                                                                            link=False)
+        return grid_interface.get_grid_from_data(data_dir)
+
+    # plan cars outside of the scene, retrying with new seeds until the scene is worth rendering
+    # rendering frames are pre-filtered geometrically in the ego camera's frustum at the rendered resolution
+    with open(os.path.join(data_dir, "camera.json")) as f:
+        camera_data = dict(json.load(f), image_size=blender_car_interface.image_size)
+    plan = scene_planner.plan_scene(grid_interface.get_grid_from_data(data_dir), car_models_info, seed=job['seed'],
+                                    max_attempts=job['max_planning_attempts'],
+                                    grid_loader=None if city_cached else load_new_grid,
+                                    number_cars=job['number_cars'], min_number_cars=job['min_number_cars'],
+                                    simulate_traffic=job['simulate_traffic'],
+                                    camera_data=camera_data)
+
+    render_worth, rendering_frames = plan.render_worth, plan.rendering_frames
+    metrics.update_run(seed=plan.seed, planning_attempts=plan.attempts, number_cars=len(plan.cars))
+    if render_worth:
+        if not city_cached:
+            with metrics.measure('city_build'):
+                city_handler.build_city(layout['nodetree'], layout['final_grid_node'],
+                                        road_bl_objects=city_handler.road_bl_objects,
+                                        buildings_bl_objects=city_handler.buildings_bl_objects,
+                                        HDRI_base_dir=HDRI_base_dir, sky_HDRI=sky_HDRI)
+            with metrics.measure('city_cache_store'):
+                city_handler.store_city(city_cache_dir, city_key, data_dir)
+        with metrics.measure('add_cars'):
+            render_worth, rendering_frames = car_handler.add_cars_to_city(car_models_info=car_models_info,
+                                                                          data_dir=data_dir, plan=plan)
+
+    logging.info(f'render_worth: {render_worth}')
+    logging.info(f'rendering_frames: {rendering_frames}')
+    if render_worth:
+        # save created city as .blend, together with the plan it is the checkpoint a preempted run resumes from
+        with metrics.measure('save_city'):
+            bpy.ops.wm.save_mainfile(filepath=os.path.join(work_dir, "current_city.blend"))
+        logging.info('saved city under .current_city.blend')
+        # plan first, so that a started checkpoint always comes with the plan of its run
+        os.makedirs(current_run_base_dir, exist_ok=True)
+        scene_planner.save_plan(plan, current_run_base_dir, run_checkpoint.plan_file_name)
+        checkpoint.start(job, city_key=city_key, seed=plan.seed, rendering_frames=rendering_frames)
+    return render_worth, rendering_frames
+
+
+def resume_scene(checkpoint):
+    """Opens current_city.blend of the interrupted run of checkpoint and restores the planning metrics of the run from
+    its saved plan. Returns render_worth and rendering_frames."""
+    logging.info(f'resuming run started at {checkpoint.state["started"]}')
+    bpy.ops.wm.open_mainfile(filepath=os.path.join(work_dir, "current_city.blend"))
+    set_up_logging()
+    metrics.update_run(city_key=checkpoint.state['city_key'], seed=checkpoint.state['seed'], resumed=True)
+    plan = scene_planner.load_plan(current_run_base_dir, run_checkpoint.plan_file_name)
+    if plan is not None:
+        metrics.update_run(planning_attempts=plan.attempts, number_cars=len(plan.cars))
+    return True, checkpoint.state['rendering_frames']
+
+
+def run(job=None):
+    """Creates or loads city, plans and animates cars and renders ground truth for one scene. An interrupted run of
+    the same job is resumed from its checkpoint instead, unless job['resume'] is False. Returns render_worth."""
+    job = dict(default_job, **(job or {}))
+    logging.info('Started run at ' + datetime.now().strftime("%d/%m/%Y %H:%M:%S"))
+    metrics.start_run(os.path.join(data_dir, metrics.metrics_file_name), **job)
+    profiling.start_run(profile_dir, metrics.current_run['id'], profiling.get_modes(job['profile']))
+
+    checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir)
+    if job['resume'] and checkpoint.is_resumable(job) and os.path.isfile(os.path.join(work_dir, "current_city.blend")):
+        render_worth, rendering_frames = resume_scene(checkpoint)
+    else:
+        render_worth, rendering_frames = create_scene(job, checkpoint)
+
+    stored_frames = []
+    if render_worth:
+        # setup and render ground truth (gt)
+        stored_frames = gt_rendering.extract_gt(gt_base_dir=gt_base_dir, data_dir=data_dir, blend_file_dir=work_dir,
+                                                rendering_frames=rendering_frames, test_perc=job['test_perc'],
+                                                val_perc=job['val_perc'], number_of_frames=job['number_of_frames'],
+                                                current_run_base_dir=current_run_base_dir,
+                                                parameters=dict(job, city_key=checkpoint.state['city_key'],
+                                                                seed=checkpoint.state['seed']),
+                                                single_pass=job['single_pass'], probe_fraction=job['probe_fraction'],
+                                                render_profile=job['render_profile'], checkpoint=checkpoint,
+                                                number_shards=job['render_shards'],
+                                                shard_launchers=job['shard_launchers'],
+                                                shard_timeout=job['shard_timeout'])
 
-logging.info(f'render_worth: {render_worth}')
-logging.info(f'rendering_frames: {rendering_frames}')
-if render_worth:
-    # save created city as .blend
-    bpy.ops.wm.save_mainfile(filepath=os.path.join(blend_file_dir, "current_city.blend"))
-    logging.info('saved city under .current_city.blend')
+    metrics.end_run(render_worth=render_worth, frames_planned=len(rendering_frames), frames_stored=len(stored_frames))
+    for profile_file in profiling.end_run():
+        logging.info(f'wrote profile {profile_file}')
+    logging.info('Finished run at ' + datetime.now().strftime("%d/%m/%Y %H:%M:%S") + '\n')
+    return render_worth
 
-    # setup and render ground truth (gt)
-    gt_base_dir = os.path.join(blend_file_dir, "ground_truth")
-    gt_rendering.extract_gt(gt_base_dir=gt_base_dir, data_dir=data_dir, blend_file_dir=blend_file_dir,
-                            rendering_frames=rendering_frames, test_perc=0.5, val_perc=0.0, number_of_frames=None)
 
-logging.info('Finished run at ' + datetime.now().strftime("%d/%m/%Y %H:%M:%S") + '\n')
+if __name__ == "__main__":
+    set_up_logging()
+    run()
@@ -0,0 +1,66 @@
+import os, sys
+import numpy as np
+import pytest
+# modules in scripts are imported as package scripts from the repository root, as in Blender
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+"""Fixtures of hand-made SceneCity grids for the Blender-free modules in scripts."""
+
+# '#' is a road cell, '.' a building cell
+small_city_map = ["..#..#.",
+                  "..#..#.",
+                  "#######",
+                  "..#..#.",
+                  "..#....",
+                  "..####.",
+                  "..#..#."]
+
+
+def grid_data_from_map(city_map):
+    """Returns (nxm)-matrix of SceneCity dicts of city_map, roads with 'road' and buildings with 'building' key."""
+    grid_data = np.empty((len(city_map), len(city_map[0])), dtype=object)
+    for i, row in enumerate(city_map):
+        for j, cell in enumerate(row):
+            grid_data[i, j] = {'road': "asphalt", 'height': 0} if cell == "#" else {'building': "comm", 'height': i}
+    return grid_data
+
+
+@pytest.fixture
+def small_grid_data():
+    return grid_data_from_map(small_city_map)
+
+
+@pytest.fixture
+def small_grid(small_grid_data):
+    from scripts import grid_interface
+    return grid_interface.Grid(small_grid_data, small_grid_data.shape)
+
+
+def make_path(coords):
+    """Returns path_interface.Path through neighbouring coords, with momenta accumulated along straight parts as in
+    path_interface.create_random_path."""
+    from scripts import path_interface
+    momenta = [(0, 0)]
+    for previous, coord in zip(coords[:-1], coords[1:]):
+        direction = (coord[0] - previous[0], coord[1] - previous[1])
+        if path_interface.momenta_parallel(momenta[-1], direction):
+            direction = (momenta[-1][0] + direction[0], momenta[-1][1] + direction[1])
+        momenta.append(direction)
+    return path_interface.Path(coords, momenta)
+
+
+def make_car(name, coords, frames_per_node=1):
+    """Returns scene_planner.PlannedCar driving along coords with constant velocity."""
+    from scripts import scene_planner
+    return scene_planner.PlannedCar(name, frames_per_node=frames_per_node, nodes=make_path(coords))
+
+
+def row_path(row, start, end):
+    """Returns coords along row from column start to column end."""
+    step = 1 if end >= start else -1
+    return [(row, j) for j in range(start, end + step, step)]
+
+
+def column_path(column, start, end):
+    """Returns coords along column from row start to row end."""
+    step = 1 if end >= start else -1
+    return [(i, column) for i in range(start, end + step, step)]
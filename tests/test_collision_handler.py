@@ -0,0 +1,174 @@
+import copy
+import numpy as np
+import pytest
+from conftest import make_car, row_path, column_path
+from scripts import collision_handler, layout_generator, path_interface, scene_planner
+"""Tests of OccupancyIndex against the former pop-and-recheck collision avoidance and of each of its rules."""
+
+
+# former implementation, that rescanned all previous cars after popping each node
+def reference_avoid_collisions(car, prev_cars):
+    while reference_collision(car, prev_cars):
+        car.truncate(len(car.nodes) - 1)
+        if len(car.nodes) == 1:
+            break
+
+
+def reference_collision(car, prev_cars):
+    return reference_stops_not_correct(car, prev_cars) or \
+        any(reference_stops_not_correct(prev_car, [car]) for prev_car in prev_cars) or \
+        reference_drives_not_correct_driving(car, prev_cars)
+
+
+def reference_stops_not_correct(car, driving_cars):
+    stop_point = car.grid_path_coordinates[-1]
+    stop_frame = (len(car.nodes) - 1) * car.frames_per_node
+    for driving_car in driving_cars:
+        frames = {frame for i, coord in enumerate(driving_car.grid_path_coordinates) if coord == stop_point
+                  for frame in driving_car.get_frames_for_pos(i)}
+        if any(frame >= stop_frame for frame in frames):
+            return True
+    return False
+
+
+def reference_drives_not_correct_driving(car, prev_cars):
+    for prev_car in prev_cars:
+        for shared_coord in set(prev_car.grid_path_coordinates).intersection(car.grid_path_coordinates):
+            if reference_first_collision_at_coord(prev_car, car, shared_coord):
+                return True
+    return False
+
+
+def reference_first_collision_at_coord(car, main_car, shared_coord):
+    main_car_frames = [main_car.get_frames_for_pos(i) for i, coord in enumerate(main_car.grid_path_coordinates)
+                       if coord == shared_coord]
+    car_frames = {frame for i, coord in enumerate(car.grid_path_coordinates) if coord == shared_coord
+                  for frame in car.get_frames_for_pos(i)}
+    for frame_interval in main_car_frames:
+        shared_frame = next((frame for frame in frame_interval if frame in car_frames), None)
+        if not shared_frame:
+            continue
+        main_car_pos = main_car.get_pos_for_frame(shared_frame)
+        car_pos = car.get_pos_for_frame(shared_frame)
+        if car_pos + 2 > len(car.nodes) or main_car_pos + 2 > len(main_car.nodes):
+            return True
+        if not collision_handler.no_collision_while_driving(car, car_pos, main_car, main_car_pos):
+            return True
+    return False
+
+
+def get_index(accepted_cars):
+    occupancy_index = collision_handler.OccupancyIndex()
+    for accepted_car in accepted_cars:
+        occupancy_index.add(accepted_car)
+    return occupancy_index
+
+
+def get_valid_length(car, accepted_cars):
+    return get_index(accepted_cars).get_valid_length(car)
+
+
+def get_reference_length(car, accepted_cars):
+    car = copy.deepcopy(car)
+    reference_avoid_collisions(car, accepted_cars)
+    return len(car.nodes)
+
+
+def test_stops_in_path_of_car_passing_later():
+    # car stops at (2, 5) in frame 2, accepted car passes there in frames 12 to 14
+    accepted_car = make_car("accepted", row_path(2, 1, 6), frames_per_node=3)
+    car = make_car("car", column_path(5, 0, 2))
+    always, at_end = get_index([accepted_car]).get_conflicts(car)
+    assert not always.any()
+    assert at_end.tolist() == [False, False, True]
+    assert get_index([accepted_car]).collision(car)
+    assert get_valid_length(car, [accepted_car]) == 2 == get_reference_length(car, [accepted_car])
+
+
+def test_drives_through_standing_car():
+    # accepted car stands at (2, 3) from frame 2, car reaches it in frame 6
+    accepted_car = make_car("accepted", column_path(3, 0, 2))
+    car = make_car("car", row_path(2, 0, 5), frames_per_node=2)
+    always, at_end = get_index([accepted_car]).get_conflicts(car)
+    assert always.tolist() == [False, False, False, True, False, False]
+    assert get_valid_length(car, [accepted_car]) == 3 == get_reference_length(car, [accepted_car])
+
+
+def test_crossing_straight_while_driving():
+    # both cars cross (2, 3) straight in frame 2, the accepted car has priority
+    accepted_car = make_car("accepted", row_path(2, 1, 6))
+    car = make_car("car", column_path(3, 0, 4))
+    always, _ = get_index([accepted_car]).get_conflicts(car)
+    assert always.tolist() == [False, False, True, False, False]
+    assert get_valid_length(car, [accepted_car]) == 2 == get_reference_length(car, [accepted_car])
+
+
+def test_compliant_right_turn_while_driving():
+    # accepted car turns right at (2, 3) in frame 2 into the street car comes from, which complies
+    accepted_car = make_car("accepted", column_path(3, 0, 2) + row_path(2, 2, 1))
+    assert accepted_car.predict_movement_at_pos(2) == "right"
+    car = make_car("car", row_path(2, 1, 4))
+    always, at_end = get_index([accepted_car]).get_conflicts(car)
+    assert not always.any()
+    assert not at_end[-1]
+    assert not get_index([accepted_car]).collision(car)
+    assert get_valid_length(car, [accepted_car]) == 4 == get_reference_length(car, [accepted_car])
+
+
+def test_meeting_at_end_of_path():
+    # accepted car ends its path at (2, 3) in frame 2, where car passes in frame 2
+    accepted_car = make_car("accepted", column_path(3, 0, 2))
+    car = make_car("car", row_path(2, 1, 5))
+    always, _ = get_index([accepted_car]).get_conflicts(car)
+    assert always[2]
+    assert get_valid_length(car, [accepted_car]) == get_reference_length(car, [accepted_car])
+
+
+
+def plan_seeded_cars(seed, number_cars=12, grid_size=(20, 20)):
+    """Returns cars with random paths and velocities on a generated layout, as plan_cars picks them."""
+    rng = np.random.default_rng(seed)
+    grid = layout_generator.get_grid_from_layout(layout_generator.generate_layout(rng, grid_size))
+    paths = [path for path in path_interface.sample_random_paths(grid, rng, number_cars, min_length=4)
+             if path is not None]
+    return [scene_planner.PlannedCar(f"car{i}", frames_per_node=int(rng.integers(1, 6)), nodes=path)
+            for i, path in enumerate(paths)]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_truncation_matches_former_loop(seed):
+    cars = plan_seeded_cars(seed)
+    reference_cars = copy.deepcopy(cars)
+    occupancy_index = collision_handler.OccupancyIndex()
+    for i, (car, reference_car) in enumerate(zip(cars, reference_cars)):
+        if i > 0:
+            collision_handler.avoid_collisions(car, occupancy_index)
+            reference_avoid_collisions(reference_car, reference_cars[:i])
+        occupancy_index.add(car)
+        assert len(car.nodes) == len(reference_car.nodes), f"car {i} of seed {seed}"
+        assert car.grid_path_coordinates == reference_car.grid_path_coordinates
+
+
+def test_truncation_truncates_seeded_scenes():
+    # the comparison above is only meaningful if collisions occur
+    truncated = 0
+    for seed in range(40):
+        cars = plan_seeded_cars(seed)
+        lengths = [len(car.nodes) for car in cars]
+        occupancy_index = collision_handler.OccupancyIndex()
+        for i, car in enumerate(cars):
+            if i > 0:
+                collision_handler.avoid_collisions(car, occupancy_index)
+            occupancy_index.add(car)
+        truncated += sum(len(car.nodes) < length for car, length in zip(cars, lengths))
+    assert truncated > 40
+
+
+def test_truncated_path_does_not_collide():
+    for seed in range(10):
+        occupancy_index = collision_handler.OccupancyIndex()
+        for i, car in enumerate(plan_seeded_cars(seed)):
+            if i > 0:
+                collision_handler.avoid_collisions(car, occupancy_index)
+                assert len(car.nodes) == 1 or not occupancy_index.collision(car)
+            occupancy_index.add(car)
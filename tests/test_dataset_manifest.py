@@ -0,0 +1,67 @@
+import os, sys, subprocess
+from scripts import dataset_manifest
+"""Tests of the manifest of the data set, allocating sequence numbers for concurrent workers and indexing data sets
+stored without manifest."""
+
+repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# allocates sequence numbers in a separate process and prints them
+allocate_script = """
+import sys
+from scripts import dataset_manifest
+manifest = dataset_manifest.DatasetManifest(sys.argv[1])
+print(" ".join(str(manifest.allocate_sequence({'worker': sys.argv[2]})) for _ in range(int(sys.argv[3]))))
+manifest.close()
+"""
+
+
+def write_sample(city_scapes_dir, category, split, sequence, frame, suffix):
+    split_dir = os.path.join(city_scapes_dir, category, split, "scenecity")
+    os.makedirs(split_dir, exist_ok=True)
+    file_name = '_'.join(["scenecity", str(sequence).zfill(6), str(frame).zfill(6), suffix])
+    with open(os.path.join(split_dir, file_name), "w") as f:
+        f.write(file_name)
+
+
+def test_concurrent_allocation(tmp_path):
+    city_scapes_dir = str(tmp_path)
+    dataset_manifest.DatasetManifest(city_scapes_dir).close()
+    number_workers, number_allocations = 4, 25
+    workers = [subprocess.Popen([sys.executable, "-c", allocate_script, city_scapes_dir, str(i),
+                                 str(number_allocations)], cwd=repository_dir, stdout=subprocess.PIPE)
+               for i in range(number_workers)]
+    sequences = []
+    for worker in workers:
+        output, _ = worker.communicate(timeout=120)
+        assert worker.returncode == 0
+        sequences += [int(sequence) for sequence in output.split()]
+    assert sorted(sequences) == list(range(1, number_workers * number_allocations + 1))
+    manifest = dataset_manifest.DatasetManifest(city_scapes_dir)
+    assert manifest.get_summary()['sequences'] == number_workers * number_allocations
+    manifest.close()
+
+
+def test_existing_directory_indexed_once(tmp_path):
+    city_scapes_dir = str(tmp_path)
+    for frame, split in ((1, "train"), (2, "test")):
+        write_sample(city_scapes_dir, "gtFine", split, 3, frame, "gtFine_labelIds.png")
+        write_sample(city_scapes_dir, "leftImg8bit", split, 3, frame, "leftImg8bit.png")
+    write_sample(city_scapes_dir, "gtFine", "val", 7, 5, "gtFine_color.png")
+    manifest = dataset_manifest.DatasetManifest(city_scapes_dir)
+    assert manifest.get_samples() == [(3, 1, "train"), (3, 2, "test"), (7, 5, "val")]
+    assert manifest.get_files(3, 2) == {'gtFine_labelIds': os.path.join("gtFine", "test", "scenecity",
+                                                                        "scenecity_000003_000002_gtFine_labelIds.png"),
+                                        'leftImg8bit': os.path.join("leftImg8bit", "test", "scenecity",
+                                                                    "scenecity_000003_000002_leftImg8bit.png")}
+    summary = manifest.get_summary()
+    assert summary['sequences'] == 2 and summary['bytes'] > 0
+    # new sequences continue after the indexed ones
+    assert manifest.allocate_sequence() == 8
+    manifest.close()
+
+    # files stored without the manifest later are not indexed when the manifest is opened again
+    write_sample(city_scapes_dir, "gtFine", "train", 9, 1, "gtFine_labelIds.png")
+    manifest = dataset_manifest.DatasetManifest(city_scapes_dir)
+    assert manifest.get_samples(sequence=9) == []
+    assert manifest.get_summary() == dict(summary, sequences=3)
+    manifest.close()
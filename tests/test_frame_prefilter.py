@@ -0,0 +1,167 @@
+import json, os
+import numpy as np
+import pytest
+from conftest import make_car, row_path, column_path
+from scripts import frame_prefilter, grid_interface, layout_generator, scene_planner
+"""Tests of frame_prefilter, whose rejections are held to the frames filtering.is_allowed rejects in semantic
+segmentations ray cast from sample scenes."""
+
+data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+camera_height = 0.15
+
+# extents of the boxes of cars and the height of buildings in cells, as in the rendered scenes
+car_half_length, car_half_width, car_height = 0.22, 0.1, 0.15
+building_height = 1.0
+
+# fraction of the resolution, at which semantic segmentations are ray cast, and step of the rays in cells
+render_fraction = 0.25
+render_step = 0.02
+
+
+@pytest.fixture
+def camera_data():
+    with open(os.path.join(data_dir, "camera.json")) as f:
+        return dict(json.load(f), image_size=(2048, 1024))
+
+
+def get_test_grid():
+    """Returns Grid of a road crossing a 9x9 city from border to border in row 4 and a road from row 4 to the bottom
+    border in column 4, all other cells are districts."""
+    layout = np.full((9, 9), layout_generator.district_kind, dtype=np.uint8)
+    layout[4, :] = layout_generator.road_kind
+    layout[4:, 4] = layout_generator.road_kind
+    return layout_generator.get_grid_from_layout(layout)
+
+
+def test_frustum_follows_image_size(camera_data):
+    left_angle, right_angle, min_ground_distance = frame_prefilter.get_frustum(camera_data, camera_height)
+    intrinsic = camera_data['intrinsic']
+    assert np.isclose(left_angle, np.arctan(intrinsic['u0'] / intrinsic['fx']))
+    assert np.isclose(right_angle, np.arctan((2048 - intrinsic['u0']) / intrinsic['fx']))
+    wider = dict(camera_data, image_size=(4096, 2048))
+    wider_left, wider_right, wider_distance = frame_prefilter.get_frustum(wider, camera_height)
+    assert wider_left == left_angle and wider_right > right_angle and wider_distance < min_ground_distance
+
+
+def test_edge_at_road_end(camera_data):
+    grid = get_test_grid()
+    ego = make_car("ego", row_path(4, 1, 3))
+    # the road in row 4 ends at the border ahead, the camera turning into column 4 faces the bottom border
+    frames = ego.get_node_frames()[:2].tolist()
+    car = make_car("car", column_path(4, 8, 7))
+    assert frame_prefilter.get_allowed_frames([ego, car], grid, frames, camera_data, camera_height) == []
+
+
+def test_edge_hidden_by_car_ahead(camera_data):
+    grid = get_test_grid()
+    ego = make_car("ego", row_path(4, 1, 2))
+    car = make_car("car", row_path(4, 3, 5))
+    assert frame_prefilter.get_allowed_frames([ego, car], grid, [0], camera_data, camera_height) == [0]
+
+
+def test_car_behind_district_not_shown(camera_data):
+    grid = get_test_grid()
+    occluder_mask = frame_prefilter.get_occluder_mask(grid)
+    frustum = frame_prefilter.get_frustum(camera_data, camera_height)
+    position = np.array(grid_interface.coordtransform_grid_to_blender((6, 4), grid)[:2])
+    heading = np.array([-1.0, 0.0])
+    ahead = np.array([grid_interface.coordtransform_grid_to_blender((4, 4), grid)[:2]])
+    behind_districts = np.array([grid_interface.coordtransform_grid_to_blender((2, 2), grid)[:2]])
+    assert frame_prefilter.frame_shows_car(grid, occluder_mask, position, heading, frustum, ahead)
+    assert not frame_prefilter.frame_shows_car(grid, occluder_mask, position, heading, frustum, behind_districts)
+    assert not frame_prefilter.frame_shows_car(grid, occluder_mask, position, -heading, frustum, ahead)
+
+
+def get_box_intervals(origin, directions, position, heading):
+    """Returns distances, at which rays from origin in (Wx2)-directions enter and leave the box of a car at position
+    with heading, inf where they miss it."""
+    side = np.array([-heading[1], heading[0]])
+    relative = origin - position
+    enter = np.zeros(len(directions))
+    leave = np.full(len(directions), np.inf)
+    for axis, half_extent in ((heading, car_half_length), (side, car_half_width)):
+        start, speed = relative @ axis, directions @ axis
+        with np.errstate(divide='ignore', invalid='ignore'):
+            first, second = (-half_extent - start) / speed, (half_extent - start) / speed
+        parallel = speed == 0
+        first = np.where(parallel, np.where(abs(start) <= half_extent, -np.inf, np.inf), first)
+        second = np.where(parallel, np.where(abs(start) <= half_extent, np.inf, -np.inf), second)
+        enter = np.maximum(enter, np.minimum(first, second))
+        leave = np.minimum(leave, np.maximum(first, second))
+    hit = (enter <= leave) & (leave > 0)
+    return np.where(hit, enter, np.inf), np.where(hit, leave, np.inf)
+
+
+def ray_cast_sem_seg(grid, position, heading, car_poses, camera_data, class_id_dict):
+    """Returns semantic segmentation with unlabeled and sky swapped, as seen by a horizontal camera at position, of
+    districts as buildings, of the ground in the grid and of cars as boxes, the sky beyond the grid."""
+    (w, h) = (round(size * render_fraction) for size in camera_data['image_size'])
+    intrinsic = {key: value * render_fraction for key, value in camera_data['intrinsic'].items()}
+    occluder_mask = frame_prefilter.get_occluder_mask(grid)
+    right = np.array([heading[1], -heading[0]])
+    x = (np.arange(w) + 0.5 - intrinsic['u0']) / intrinsic['fx']
+    y = (intrinsic['v0'] - np.arange(h) - 0.5) / intrinsic['fy']
+    norms = np.sqrt(1 + x ** 2)
+    directions = (heading[None, :] + x[:, None] * right[None, :]) / norms[:, None]
+    # height of the ray per row and column over the horizontal distance travelled
+    slopes = y[:, None] / norms[None, :]
+    heights = lambda distances: camera_height + slopes * distances
+
+    max_distance = np.hypot(*grid.grid_size) * grid.cell_size
+    steps = np.arange(1, int(max_distance / render_step) + 2) * render_step
+    cells, inside = frame_prefilter.get_cells(grid, position + steps[None, :, None] * directions[:, None, :])
+    clipped = np.where(inside[..., None], cells, 0)
+    blocked = inside & occluder_mask[clipped[..., 0], clipped[..., 1]]
+    exit_distance = np.where((~inside).any(axis=1), steps[np.argmax(~inside, axis=1)], np.inf)
+    building_distance = np.where(blocked.any(axis=1), steps[np.argmax(blocked, axis=1)], np.inf)
+
+    with np.errstate(divide='ignore'):
+        ground_distance = np.where(slopes < 0, -camera_height / slopes, np.inf)
+    ground_distance = np.where(ground_distance < exit_distance[None, :], ground_distance, np.inf)
+    building_distance = np.where(heights(building_distance) <= building_height * grid.cell_size,
+                                 building_distance[None, :], np.inf)
+    car_distance = np.full((h, w), np.inf)
+    for car_position, car_heading in car_poses:
+        enter, leave = get_box_intervals(position, directions, car_position, car_heading)
+        low = np.minimum(heights(enter), heights(leave))
+        high = np.maximum(heights(enter), heights(leave))
+        hit = np.isfinite(enter)[None, :] & (low <= car_height * grid.cell_size) & (high >= 0)
+        car_distance = np.minimum(car_distance, np.where(hit, np.maximum(enter, 0)[None, :], np.inf))
+
+    ground_points = position + np.where(np.isfinite(ground_distance), ground_distance, 0)[..., None] * directions
+    ground_cells, ground_inside = frame_prefilter.get_cells(grid, ground_points)
+    ground_cells = np.where(ground_inside[..., None], ground_cells, 0)
+    on_road = grid.road_mask[ground_cells[..., 0], ground_cells[..., 1]]
+
+    sem_seg = np.full((h, w), int(class_id_dict['unlabeled']))
+    nearest = np.argmin(np.stack([ground_distance, building_distance, car_distance]), axis=0)
+    visible = np.isfinite(np.minimum(np.minimum(ground_distance, building_distance), car_distance))
+    sem_seg[visible & (nearest == 0)] = int(class_id_dict['building'])
+    sem_seg[visible & (nearest == 0) & on_road] = int(class_id_dict['road'])
+    sem_seg[visible & (nearest == 1)] = int(class_id_dict['building'])
+    sem_seg[visible & (nearest == 2)] = int(class_id_dict['car'])
+    return sem_seg
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_rejections_rejected_by_filtering(seed, camera_data):
+    filtering = pytest.importorskip("scripts.filtering")
+    class_id_dict = filtering.pre_processing.get_dict_from_file(data_dir, "class_id_legend.txt")
+    rng = np.random.default_rng(seed)
+    grid = layout_generator.get_grid_from_layout(layout_generator.generate_layout(rng, (12, 12)))
+    models_info = [{'main object name': "Car", 'camera_pos': (0, 0, camera_height)}]
+    plan = scene_planner.plan_cars(grid, models_info, rng, number_cars=8, min_number_cars=1, min_path_length=3,
+                                   simulate_traffic=True, seed=seed)
+    if not plan.render_worth:
+        pytest.skip(f"seed {seed} is not worth rendering")
+    # every frame of the ego car, not only the rendering frames before its last turn, to include edges in view
+    frames = list(range(int(plan.cars[0].get_node_frames()[len(plan.cars[0].nodes) - 1])))
+    allowed_frames = frame_prefilter.get_allowed_frames(plan.cars, grid, frames, camera_data, camera_height)
+    poses = [frame_prefilter.get_poses(car, grid, frames) for car in plan.cars]
+    rejected_frames = [frame for frame in frames if frame not in allowed_frames]
+    assert rejected_frames
+    for frame in rejected_frames:
+        i = frames.index(frame)
+        car_poses = [(positions[i], headings[i]) for positions, headings in poses[1:]]
+        sem_seg = ray_cast_sem_seg(grid, poses[0][0][i], poses[0][1][i], car_poses, camera_data, class_id_dict)
+        assert not filtering.is_allowed(sem_seg, class_id_dict), f"frame {frame} of seed {seed}"
@@ -0,0 +1,127 @@
+import os, pickle
+import numpy as np
+from scripts import grid_interface, path_interface
+"""Tests of the road index of Grid against probing the SceneCity dicts of the grid cell by cell, and of the compact
+grid format against grid.pkl."""
+
+
+def probe_neighbours(grid_data, coord):
+    """Returns road neighbours of coord with their direction by probing the cell dicts, as create_random_path did."""
+    (n, m) = grid_data.shape
+    neighbours = []
+    for dx, dy in path_interface.directions:
+        x, y = coord[0] + dx, coord[1] + dy
+        if 0 <= x < n and 0 <= y < m and 'road' in grid_data[x][y]:
+            neighbours.append(((x, y), (dx, dy)))
+    return neighbours
+
+
+def probe_border_streets(grid_data):
+    """Border streets in the order of the former get_border_streets."""
+    (n, m) = grid_data.shape
+    border_streets = [(0, j) for j, grid_dict in enumerate(grid_data[0, :]) if 'road' in grid_dict]
+    border_streets.extend([(i, 0) for i, grid_dict in enumerate(grid_data[:, 0]) if 'road' in grid_dict])
+    border_streets.extend([(n - 1, j) for j, grid_dict in enumerate(grid_data[n - 1, :]) if 'road' in grid_dict])
+    border_streets.extend([(i, m - 1) for i, grid_dict in enumerate(grid_data[:, m - 1]) if 'road' in grid_dict])
+    return border_streets
+
+
+def test_road_mask(small_grid, small_grid_data):
+    expected = np.array([['road' in grid_dict for grid_dict in row] for row in small_grid_data])
+    np.testing.assert_array_equal(small_grid.road_mask, expected)
+    assert small_grid.road_mask.dtype == bool
+    for coord in np.ndindex(small_grid_data.shape):
+        assert small_grid.is_road(coord) == ('road' in small_grid_data[coord])
+    assert not small_grid.is_road((-1, 2))
+    assert not small_grid.is_road(small_grid.grid_size)
+
+
+def test_road_cells_and_ids(small_grid):
+    np.testing.assert_array_equal(small_grid.road_cells, np.argwhere(small_grid.road_mask))
+    for cell_id, (i, j) in enumerate(small_grid.road_cells):
+        assert small_grid.cell_ids[i, j] == cell_id
+    assert (small_grid.cell_ids[~small_grid.road_mask] == -1).all()
+
+
+def test_csr_adjacency(small_grid, small_grid_data):
+    for cell_id, coord in enumerate(map(tuple, small_grid.road_cells.tolist())):
+        start, end = small_grid.adjacency_indptr[cell_id], small_grid.adjacency_indptr[cell_id + 1]
+        csr_neighbours = [(tuple(small_grid.road_cells[small_grid.adjacency_indices[k]].tolist()),
+                           path_interface.directions[small_grid.adjacency_directions[k]]) for k in range(start, end)]
+        expected = probe_neighbours(small_grid_data, coord)
+        assert sorted(csr_neighbours) == sorted(expected)
+        assert sorted(small_grid.neighbours[coord]) == sorted(expected)
+        assert small_grid.degree[cell_id] == len(expected)
+        for direction_index, neighbour_id in enumerate(small_grid.neighbour_table[cell_id]):
+            dx, dy = path_interface.directions[direction_index]
+            if neighbour_id >= 0:
+                assert ((coord[0] + dx, coord[1] + dy), (dx, dy)) in expected
+            else:
+                assert ((coord[0] + dx, coord[1] + dy), (dx, dy)) not in expected
+    assert small_grid.adjacency_indptr[-1] == len(small_grid.adjacency_indices)
+
+
+def test_border_streets(small_grid, small_grid_data):
+    expected = probe_border_streets(small_grid_data)
+    assert small_grid.border_streets == expected
+    assert grid_interface.get_border_streets(small_grid) == expected
+    assert small_grid.border_cells == set(expected)
+    border_coords = {tuple(coord) for coord in small_grid.road_cells[small_grid.border_ids].tolist()}
+    assert border_coords == set(expected)
+
+
+def test_intersections(small_grid, small_grid_data):
+    expected = {coord for coord in map(tuple, small_grid.road_cells.tolist())
+                if len(probe_neighbours(small_grid_data, coord)) >= 3}
+    assert {tuple(small_grid.road_cells[cell_id].tolist()) for cell_id in small_grid.intersections} == expected
+    for coord in np.ndindex(small_grid_data.shape):
+        assert small_grid.is_intersection(coord) == (coord in expected)
+
+
+def test_road_mask_given(small_grid_data):
+    road_mask = grid_interface.get_road_mask(small_grid_data)
+    grid = grid_interface.Grid(small_grid_data, small_grid_data.shape, road_mask=road_mask)
+    np.testing.assert_array_equal(grid.road_mask, road_mask)
+
+
+def save_grid_pkl(grid_data, data_dir):
+    with open(os.path.join(data_dir, "grid.pkl"), "wb") as f:
+        pickle.dump(grid_data.tolist(), f)
+
+
+def test_grid_pkl_fallback(small_grid, small_grid_data, tmp_path):
+    save_grid_pkl(small_grid_data, str(tmp_path))
+    grid = grid_interface.get_grid_from_data(str(tmp_path))
+    assert not isinstance(grid.data, grid_interface.CompactGridData)
+    assert grid.grid_size == small_grid_data.shape
+    assert grid.data.tolist() == small_grid_data.tolist()
+    np.testing.assert_array_equal(grid.road_mask, small_grid.road_mask)
+
+
+def test_compact_round_trip(small_grid, small_grid_data, tmp_path):
+    data_dir = str(tmp_path)
+    save_grid_pkl(small_grid_data, data_dir)
+    grid_interface.convert_grid_file(data_dir)
+    # compact format is preferred over grid.pkl
+    save_grid_pkl(np.full((2, 2), {}, dtype=object), data_dir)
+    grid = grid_interface.get_grid_from_data(data_dir)
+    compact = grid.data
+    assert isinstance(compact, grid_interface.CompactGridData)
+    assert all(isinstance(plane, np.memmap) for plane in compact.planes.values())
+    assert compact.shape == small_grid_data.shape
+    for coord, grid_dict in np.ndenumerate(small_grid_data):
+        assert compact[coord] == grid_dict
+    assert compact.tolist() == small_grid_data.tolist()
+
+    np.testing.assert_array_equal(compact.get_mask('road'), small_grid.road_mask)
+    np.testing.assert_array_equal(compact.get_mask('road', "asphalt"), small_grid.road_mask)
+    np.testing.assert_array_equal(compact.get_mask('building'), ~small_grid.road_mask)
+    heights = np.array([[grid_dict['height'] for grid_dict in row] for row in small_grid_data])
+    np.testing.assert_array_equal(compact.get_mask('height', 3), heights == 3)
+    np.testing.assert_array_equal(compact.get_mask('height', 0), heights == 0)
+    assert not compact.get_mask('road', "gravel").any()
+    assert not compact.get_mask('district').any()
+
+    np.testing.assert_array_equal(grid.road_mask, small_grid.road_mask)
+    np.testing.assert_array_equal(grid.neighbour_table, small_grid.neighbour_table)
+    assert grid.border_streets == small_grid.border_streets
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from scripts import grid_interface, layout_generator
+"""Tests of generated city layouts and of their compact grids against grids built from the cell dicts."""
+
+seeds = range(20)
+grid_sizes = [(12, 12), (20, 20), (15, 31)]
+
+
+@pytest.mark.parametrize("grid_size", grid_sizes)
+@pytest.mark.parametrize("seed", seeds)
+def test_roads_straight_or_crossing(seed, grid_size):
+    layout = layout_generator.generate_layout(np.random.default_rng(seed), grid_size)
+    road_mask = layout == layout_generator.road_kind
+    assert set(np.unique(layout).tolist()) == {layout_generator.road_kind, layout_generator.district_kind}
+    (n, m) = grid_size
+    for i, j in zip(*np.nonzero(road_mask)):
+        vertical = [0 <= i + di < n and road_mask[i + di, j] for di in (-1, 1)]
+        horizontal = [0 <= j + dj < m and road_mask[i, j + dj] for dj in (-1, 1)]
+        degree = sum(vertical) + sum(horizontal)
+        on_border = i in (0, n - 1) or j in (0, m - 1)
+        if degree == 2:
+            # straight, no curves
+            assert all(vertical) or all(horizontal), (i, j)
+        elif degree == 1:
+            # road end
+            assert on_border, (i, j)
+        else:
+            # T- or X-crossing
+            assert degree in (3, 4), (i, j)
+
+
+@pytest.mark.parametrize("grid_size", grid_sizes)
+@pytest.mark.parametrize("seed", seeds)
+def test_road_ends_on_border(seed, grid_size):
+    grid = layout_generator.get_grid_from_layout(layout_generator.generate_layout(np.random.default_rng(seed),
+                                                                                  grid_size))
+    assert grid.border_streets
+    dead_ends = [tuple(coord) for coord, degree in zip(grid.road_cells.tolist(), grid.degree) if degree < 2]
+    assert set(dead_ends) <= grid.border_cells
+    # every road cell reaches the border
+    assert (grid.border_distance < grid_interface.path_interface.unreachable_distance).all()
+
+
+def test_same_seed_same_layout():
+    layouts = [layout_generator.generate_layouts(np.random.default_rng(7), 3, (20, 20)) for _ in range(2)]
+    np.testing.assert_array_equal(layouts[0], layouts[1])
+    assert not np.array_equal(layouts[0][0], layouts[0][1])
+    other = layout_generator.generate_layouts(np.random.default_rng(8), 3, (20, 20))
+    assert not np.array_equal(layouts[0], other)
+
+
+@pytest.mark.parametrize("seed", seeds)
+def test_compact_round_trip_through_grid(seed, tmp_path):
+    layout = layout_generator.generate_layout(np.random.default_rng(seed), (20, 20))
+    grid_data = np.array(layout_generator.layout_to_grid_data(layout))
+    compact = layout_generator.layout_to_compact(layout)
+    assert compact.tolist() == grid_data.tolist()
+    expected = grid_interface.Grid(grid_data, grid_data.shape)
+
+    layout_generator.save_layout(layout, str(tmp_path))
+    for grid in (layout_generator.get_grid_from_layout(layout), grid_interface.get_grid_from_data(str(tmp_path))):
+        assert isinstance(grid.data, grid_interface.CompactGridData)
+        assert grid.data.tolist() == grid_data.tolist()
+        np.testing.assert_array_equal(grid.road_mask, expected.road_mask)
+        np.testing.assert_array_equal(grid.road_cells, expected.road_cells)
+        np.testing.assert_array_equal(grid.neighbour_table, expected.neighbour_table)
+        assert grid.border_streets == expected.border_streets
+        np.testing.assert_array_equal(grid.intersections, expected.intersections)
+        np.testing.assert_array_equal(grid.data.get_mask('district'), layout == layout_generator.district_kind)
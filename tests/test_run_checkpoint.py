@@ -0,0 +1,148 @@
+import os, json, shutil
+import pytest
+from scripts import run_checkpoint
+"""Tests of writing files atomically and of resuming runs from the checkpoint in current_run."""
+
+job = {'grid_size': [20, 20], 'seed': 3}
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    path = write_file(str(tmp_path / "state.json"), "old")
+    with run_checkpoint.atomic_write(path) as tmp_file:
+        # same directory and extension, e.g. for cv2.imwrite to pick the format
+        assert tmp_file != path and os.path.dirname(tmp_file) == str(tmp_path) and tmp_file.endswith(".json")
+        write_file(tmp_file, "new")
+        assert read_file(path) == "old"
+    assert read_file(path) == "new"
+    assert os.listdir(str(tmp_path)) == ["state.json"]
+
+
+def test_atomic_write_keeps_file_on_error(tmp_path):
+    path = write_file(str(tmp_path / "plan.pkl"), "old")
+    with pytest.raises(KeyboardInterrupt):
+        with run_checkpoint.atomic_write(path) as tmp_file:
+            write_file(tmp_file, "trunc")
+            raise KeyboardInterrupt
+    assert read_file(path) == "old"
+    assert os.listdir(str(tmp_path)) == ["plan.pkl"]
+
+
+def test_atomic_write_directory_not_replacing_stored_one(tmp_path):
+    city_dir = str(tmp_path / "city_key")
+    with run_checkpoint.atomic_write(city_dir) as tmp_dir:
+        write_file(os.path.join(tmp_dir, "city.blend"), "first")
+    # a second worker storing the same city fails to rename onto the stored one and leaves nothing behind
+    with pytest.raises(OSError):
+        with run_checkpoint.atomic_write(city_dir) as tmp_dir:
+            write_file(os.path.join(tmp_dir, "city.blend"), "second")
+    assert read_file(os.path.join(city_dir, "city.blend")) == "first"
+    assert os.listdir(str(tmp_path)) == ["city_key"]
+
+
+def start_checkpoint(current_run_base_dir, frames=(1, 2, 3)):
+    checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir)
+    checkpoint.start(job, city_key="key", seed=3, rendering_frames=list(frames))
+    for frame in frames:
+        path = write_file(os.path.join(current_run_base_dir, "all", "gt" + str(frame) + ".png"), "gt" * frame)
+        checkpoint.add(frame, 'gt', [path], allowed=frame != 2)
+    return checkpoint
+
+
+def test_journal_replayed(tmp_path):
+    current_run_base_dir = str(tmp_path)
+    start_checkpoint(current_run_base_dir)
+    checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir)
+    assert checkpoint.is_resumable(job)
+    assert not checkpoint.is_resumable(dict(job, seed=4))
+    assert checkpoint.state['rendering_frames'] == [1, 2, 3]
+    assert checkpoint.get_done_frames([1, 2, 3, 4], 'gt') == [1, 2, 3]
+    assert [checkpoint.get_entry(frame, 'gt')['allowed'] for frame in (1, 2, 3)] == [True, False, True]
+    assert not checkpoint.is_done(1, 'image')
+    checkpoint.finish()
+    assert not run_checkpoint.RunCheckpoint(current_run_base_dir).is_resumable(job)
+
+
+def test_journal_truncated_by_crash(tmp_path):
+    current_run_base_dir = str(tmp_path)
+    start_checkpoint(current_run_base_dir, frames=(1, 2))
+    with open(os.path.join(current_run_base_dir, run_checkpoint.journal_file_name), "a") as f:
+        f.write('{"frame": 3, "step": "gt", "fi')
+    assert run_checkpoint.RunCheckpoint(current_run_base_dir).get_done_frames([1, 2, 3], 'gt') == [1, 2]
+
+
+def test_start_discards_journal(tmp_path):
+    current_run_base_dir = str(tmp_path)
+    start_checkpoint(current_run_base_dir)
+    run_checkpoint.RunCheckpoint(current_run_base_dir).start(job, seed=3)
+    checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir)
+    assert checkpoint.journal == {} and checkpoint.get_done_frames([1, 2, 3], 'gt') == []
+
+
+def test_size_checks(tmp_path):
+    current_run_base_dir = str(tmp_path)
+    start_checkpoint(current_run_base_dir)
+    # truncated by a crash while writing and lost
+    write_file(os.path.join(current_run_base_dir, "all", "gt2.png"), "g")
+    os.remove(os.path.join(current_run_base_dir, "all", "gt3.png"))
+    checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir)
+    assert checkpoint.get_done_frames([1, 2, 3], 'gt') == [1]
+    # produced again
+    path = write_file(os.path.join(current_run_base_dir, "all", "gt3.png"), "new gt")
+    checkpoint.add(3, 'gt', [path], allowed=True)
+    assert run_checkpoint.RunCheckpoint(current_run_base_dir).get_done_frames([1, 2, 3], 'gt') == [1, 3]
+
+
+def test_store_resumed_under_recorded_sequence_and_splits(tmp_path, monkeypatch):
+    post_processing = pytest.importorskip("scripts.post_processing")
+    gt_base_dir, data_dir = str(tmp_path / "ground_truth"), str(tmp_path / "data")
+    current_run_base_dir = os.path.join(gt_base_dir, "current_run")
+    current_gt_categories = ["image", "semantic_segmentation", "disparity", "semantic_segmentation_color"]
+    city_scapes_gt_categories = ["gtFine", "disparity", "camera", "leftImg8bit"]
+    frames = list(range(1, 9))
+    for category in current_gt_categories:
+        for frame in frames:
+            write_file(os.path.join(current_run_base_dir, "filtered", category, category + str(frame) + ".png"),
+                       category * frame)
+    write_file(os.path.join(data_dir, "camera.json"), json.dumps({'intrinsic': {}}))
+    post_processing.check_city_scapes_dirs(gt_base_dir, city_scapes_gt_categories)
+    checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir)
+    checkpoint.start(job)
+
+    # interrupted while copying the files of the fourth frame
+    copied = []
+
+    def copy_until_interrupted(src, dst):
+        if len(copied) == 3 * 5 + 2:
+            raise KeyboardInterrupt
+        copied.append(dst)
+        shutil.copyfile(src, dst)
+    monkeypatch.setattr(post_processing, "copyfile", copy_until_interrupted)
+    store = lambda: post_processing.store_current_run(gt_base_dir, data_dir, frames, city_scapes_gt_categories,
+                                                      current_gt_categories, test_perc=0.5, checkpoint=checkpoint)
+    with pytest.raises(KeyboardInterrupt):
+        store()
+    sequence, splits = checkpoint.state['sequence'], checkpoint.state['splits']
+
+    checkpoint = run_checkpoint.RunCheckpoint(current_run_base_dir)
+    assert checkpoint.get_done_frames(frames, 'stored') == [1, 2, 3]
+    monkeypatch.setattr(post_processing, "copyfile", shutil.copyfile)
+    assert store() == sequence
+    manifest = post_processing.dataset_manifest.DatasetManifest(os.path.join(gt_base_dir, "CityScapes_format"))
+    assert manifest.get_summary()['sequences'] == 1
+    assert manifest.get_samples() == [(sequence, frame, splits[str(frame)]) for frame in frames]
+    for frame in frames:
+        for category, path in manifest.get_files(sequence, frame).items():
+            assert os.path.join(splits[str(frame)], "scenecity") in path
+    manifest.close()
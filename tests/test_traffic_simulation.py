@@ -0,0 +1,76 @@
+import numpy as np
+from conftest import grid_data_from_map, make_car, row_path, column_path
+from scripts import grid_interface, traffic_simulation
+"""Tests of lane blocking, crossing priority and parking in gridlock of TrafficSimulation."""
+
+
+def get_grid(city_map):
+    grid_data = grid_data_from_map(city_map)
+    return grid_interface.Grid(grid_data, grid_data.shape)
+
+
+def test_reservation_keys(small_grid):
+    car = make_car("car", row_path(2, 0, 3))
+    intersection_cells = {tuple(coord) for coord in small_grid.road_cells[small_grid.intersections].tolist()}
+    keys = traffic_simulation.get_reservation_keys(car, intersection_cells)
+    # lane keys of roads carry the direction of travel, also for the first node, crossings are shared
+    assert keys == [((2, 0), (0, 1)), ((2, 1), (0, 1)), ((2, 2), None), ((2, 3), (0, 1))]
+
+
+def test_lane_blocked_by_slower_car(small_grid):
+    slow_car = make_car("slow", row_path(2, 1, 6), frames_per_node=4)
+    fast_car = make_car("fast", row_path(2, 0, 6))
+    oncoming_car = make_car("oncoming", row_path(2, 6, 0))
+    parked = traffic_simulation.TrafficSimulation([slow_car, fast_car, oncoming_car], small_grid).run()
+    assert parked == 0
+    np.testing.assert_array_equal(slow_car.node_frames, np.arange(7) * 4)
+    # fast car enters each cell only after the slow car left it
+    for j in range(1, 7):
+        assert fast_car.node_frames[j] >= slow_car.node_frames[j]
+    assert fast_car.node_frames[-1] > len(fast_car.nodes)
+    # the opposite lane is not blocked
+    np.testing.assert_array_equal(oncoming_car.node_frames, np.arange(8))
+
+
+def test_crossing_priority(small_grid):
+    # both cars reach crossing (2, 2) straight in frame 2, the prior car passes first
+    for first, second in [(row_path(2, 0, 6), column_path(2, 0, 6)), (column_path(2, 0, 6), row_path(2, 0, 6))]:
+        prior_car = make_car("prior", first)
+        waiting_car = make_car("waiting", second)
+        traffic_simulation.TrafficSimulation([prior_car, waiting_car], small_grid).run()
+        np.testing.assert_array_equal(prior_car.node_frames, np.arange(8))
+        assert waiting_car.node_frames[2] == 3
+        assert waiting_car.node_frames[-1] == 8
+
+
+def test_compliant_cars_share_crossing(small_grid):
+    # cars passing each other straight at crossings do not wait
+    cars = [make_car("east", row_path(2, 0, 6)), make_car("west", row_path(2, 6, 0))]
+    traffic_simulation.TrafficSimulation(cars, small_grid).run()
+    for car in cars:
+        np.testing.assert_array_equal(car.node_frames, np.arange(8))
+
+
+def test_gridlock_parks_after_max_wait_frames():
+    # four cars on the crossings of a 2x2 loop, each waiting for the cell of the next one
+    grid = get_grid(["####"] * 4)
+    cars = [make_car("east", row_path(1, 1, 3)), make_car("south", column_path(2, 1, 3)),
+            make_car("west", row_path(2, 2, 0)), make_car("north", column_path(1, 2, 0))]
+    max_wait_frames = 5
+    parked = traffic_simulation.TrafficSimulation(cars, grid, max_wait_frames=max_wait_frames).run()
+    # the first three cars park at their first node in the same frame and are dropped, freeing the loop
+    assert parked == 3
+    assert [len(car.nodes) for car in cars] == [1, 1, 1, 3]
+    np.testing.assert_array_equal(cars[3].node_frames, [0, max_wait_frames + 1, max_wait_frames + 2,
+                                                        max_wait_frames + 3])
+
+
+def test_parked_car_keeps_path_to_parking_node(small_grid):
+    # slow car blocks the lane for longer than max_wait_frames
+    blocking_car = make_car("blocking", column_path(2, 3, 6), frames_per_node=100)
+    car = make_car("car", column_path(2, 0, 6))
+    parked = traffic_simulation.TrafficSimulation([blocking_car, car], small_grid, max_wait_frames=5).run()
+    assert parked == 1
+    assert car.grid_path_coordinates == column_path(2, 0, 2)
+    # parked after waiting max_wait_frames for (3, 2) from frame 3
+    np.testing.assert_array_equal(car.node_frames, [0, 1, 2, 8])
@@ -0,0 +1,21 @@
+import bpy
+import importlib, sys, os
+
+blend_file_dir = os.path.dirname(bpy.data.filepath)
+if blend_file_dir not in sys.path:
+    sys.path.append(blend_file_dir)
+
+# importing setup enables SceneCity and loads the pipeline once, its run is called per job
+import setup
+import scripts.scene_worker as scene_worker
+importlib.reload(scene_worker)
+
+# every job starts from the .blend file the worker was started on, e.g. standard.blend
+base_blend_file = bpy.data.filepath
+
+if __name__ == "__main__":
+    args = scene_worker.parse_args()
+    setup.set_up_logging()
+    jobs = scene_worker.read_jobs(args.jobs, args.runs)
+    scene_worker.run_jobs(jobs, setup.run, base_blend_file,
+                          report=scene_worker.print_result if args.jobs == "-" else None)